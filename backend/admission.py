@@ -0,0 +1,179 @@
+"""Admission control: shed load early instead of queueing it without bound.
+
+Each limited route has a ``ConcurrencyLimiter``. Up to ``limit`` requests run
+at once; the next ``queue`` wait in arrival order, each for at most
+``timeout`` seconds. Anything beyond that is answered 503 with Retry-After
+by ``AdmissionMiddleware`` before its body is read. The request then costs
+almost nothing, and the event loop and the Motor pool stay free for the
+requests that were admitted, including the read routes, which are not
+limited.
+
+``TokenBuckets`` additionally caps how fast a single driver may call a
+route. Routes check it themselves, since the driver id is in the body.
+
+Limits are per worker process.
+"""
+import asyncio
+import json
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Optional
+
+from metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_QUEUE_WAIT, ADMISSION_REJECTED, route_template
+
+
+class Overloaded(Exception):
+    """The request was not admitted; `reason` is "queue_full" or "deadline"."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter:
+    """At most `limit` concurrent holders and `queue` waiters, FIFO."""
+
+    def __init__(self, method: str, route: str, limit: int, queue: int, timeout: float, retry_after: float = 1.0):
+        self.method = method
+        self.route = route
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.waiters: deque = deque()
+
+    def _record(self):
+        ADMISSION_IN_FLIGHT.labels(self.method, self.route).set(self.in_flight)
+        ADMISSION_QUEUE_DEPTH.labels(self.method, self.route).set(len(self.waiters))
+
+    def _reject(self, reason: str) -> Overloaded:
+        ADMISSION_REJECTED.labels(self.method, self.route, reason).inc()
+        return Overloaded(reason, self.retry_after)
+
+    async def acquire(self):
+        """Take a slot, waiting up to `timeout` for one. Raises Overloaded."""
+        if self.in_flight < self.limit and not self.waiters:
+            self.in_flight += 1
+            self._record()
+            return
+        if len(self.waiters) >= self.queue:
+            raise self._reject("queue_full")
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self.waiters.append(waiter)
+        self._record()
+        started = loop.time()
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            # A slot handed over just as the deadline passed is still ours
+            if not (waiter.done() and not waiter.cancelled()):
+                raise self._reject("deadline")
+        except asyncio.CancelledError:
+            # The client went away; pass on a slot that was already handed over
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+            self._record()
+            ADMISSION_QUEUE_WAIT.labels(self.method, self.route).observe(loop.time() - started)
+
+    def release(self):
+        """Hand the slot to the longest waiter still waiting, or free it."""
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._record()
+                return
+        self.in_flight -= 1
+        self._record()
+
+
+def load_limiters(policies: Dict[str, dict]) -> Dict[str, ConcurrencyLimiter]:
+    """Limiters keyed by "METHOD /route/{template}", from policies of the form
+    {"limit": 32, "queue": 128, "timeout": 1.0, "retry_after": 1.0}."""
+    limiters = {}
+    for key, policy in policies.items():
+        method, route = key.split(" ", 1)
+        limiters[key] = ConcurrencyLimiter(method, route, **policy)
+    return limiters
+
+
+def load_policies(defaults: Dict[str, dict], overrides: str) -> Dict[str, dict]:
+    """`defaults` with the routes in the JSON object `overrides` replaced or added;
+    a route overridden with null is not limited."""
+    policies = dict(defaults)
+    for key, policy in json.loads(overrides or "{}").items():
+        if policy is None:
+            policies.pop(key, None)
+        else:
+            policies[key] = {**defaults.get(key, {}), **policy}
+    return policies
+
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
+
+
+class AdmissionMiddleware:
+    """Admits each request to a limited route through its route's limiter."""
+
+    def __init__(self, app, limiters: Dict[str, ConcurrencyLimiter]):
+        self.app = app
+        self.limiters = limiters
+
+    async def __call__(self, scope, receive, send):
+        limiter = None
+        if scope["type"] == "http" and self.limiters:
+            limiter = self.limiters.get(f"{scope['method']} {route_template(scope)}")
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await limiter.acquire()
+        except Overloaded as exc:
+            body = json.dumps({"detail": f"Server is busy ({exc.reason}), retry later"}).encode()
+            await send({"type": "http.response.start", "status": 503, "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", retry_after_header(exc.retry_after).encode()),
+            ]})
+            await send({"type": "http.response.body", "body": body})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+
+class TokenBuckets:
+    """A token bucket per key: `burst` tokens, refilled at `rate` per second.
+    Only the `max_keys` most recently used keys are kept; a key that falls out
+    starts again with a full bucket."""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def take(self, key: str) -> Optional[float]:
+        """Take a token for `key`. Returns None if one was available, otherwise
+        the seconds until one will be."""
+        now = self.clock()
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        available = tokens >= 1
+        self._buckets[key] = (tokens - 1 if available else tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return None if available else (1 - tokens) / self.rate
@@ -0,0 +1,122 @@
+"""Read-through cache for hot driver reads.
+
+Entries are grouped under tags such as ``deliveries:<driver_id>``, built by
+``cache_tag`` so that no two part lists share a tag. Each tag
+has a version stored alongside the entries and every entry key embeds the
+version current when it was loaded, so invalidating a tag is a single write
+that makes all of its entries unreachable; they then age out through the
+store's TTL and LRU eviction. A version that is itself evicted is replaced by
+a fresh random one, never reset, so an eviction cannot resurrect old entries.
+
+Stores are async and pluggable: ``MemoryStore`` keeps entries in the worker
+process, and a shared store only has to implement ``CacheStore``. With the
+in-process store a write only invalidates the worker that handled it; other
+workers may serve entries up to ``ttl`` seconds old.
+"""
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+from urllib.parse import quote
+
+
+def cache_tag(*parts: str) -> str:
+    """The tag for `parts`, each percent-escaped so ":" only separates them."""
+    return ":".join(quote(part, safe="") for part in parts)
+
+
+class CacheStore:
+    """Key/value storage with per-entry expiry."""
+
+    async def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: Any, ttl: float):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {}
+
+
+class MemoryStore(CacheStore):
+    """Bounded in-process store with LRU eviction and TTL expiry."""
+
+    def __init__(self, max_entries: int = 10000, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        self.evictions = 0
+        self.expirations = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= self.clock():
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any, ttl: float):
+        self._entries[key] = (value, self.clock() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class ReadThroughCache:
+    def __init__(self, store: CacheStore, ttl: float):
+        self.store = store
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    async def _version(self, tag: str) -> str:
+        version = await self.store.get(f"version:{tag}")
+        if version is None:
+            version = uuid.uuid4().hex
+            # Versions outlive the entries that embed them
+            await self.store.set(f"version:{tag}", version, self.ttl * 2)
+        return version
+
+    async def get_or_load(self, tag: str, key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Cached value of `key` under `tag`, calling `loader` on a miss.
+
+        Cached values are shared between requests and must not be mutated.
+        """
+        # With "@" escaped in the tag, the first "@" ends it
+        entry_key = f"entry:{quote(tag, safe=':')}@{await self._version(tag)}:{key}"
+        value = await self.store.get(entry_key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = await loader()
+        await self.store.set(entry_key, value, self.ttl)
+        return value
+
+    async def invalidate(self, *tags: str):
+        for tag in tags:
+            await self.store.set(f"version:{tag}", uuid.uuid4().hex, self.ttl * 2)
+        self.invalidations += len(tags)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            **self.store.stats(),
+        }
@@ -0,0 +1,155 @@
+"""Batch assignment of unassigned deliveries to available drivers.
+
+Every delivery and driver position becomes a unit vector from the Earth's
+centre, so the cosine of the angle between each delivery and each driver is
+one matrix product. ``1 - cos`` grows with the great-circle distance, which
+is all the matching needs; distances in km are computed only for the pairs
+it picks.
+
+Deliveries are matched to drivers by deferred acceptance: each delivery
+proposes to its nearest driver it has not yet proposed to, and each driver
+keeps its `capacity` nearest proposals, rejecting the others, which propose
+again in the next round. Every round handles all proposing deliveries in a
+few vectorized steps. A full driver only gets choosier, so a proposal
+farther than everything it holds moves on to the next driver at once.
+
+The result is stable: no delivery and driver are closer to each other than
+to what they were given. It is the matching a greedy pass over all
+(delivery, driver) pairs, closest first, produces, without sorting all pairs.
+"""
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from routing import EARTH_RADIUS_KM
+
+# Drivers ranked per delivery up front; a delivery rejected by all of them
+# has four times as many ranked, and so on
+PREFERENCE_WINDOW = 16
+
+
+class _Preferences:
+    """Each delivery's drivers, nearest first, ranked a window at a time."""
+
+    def __init__(self, costs: np.ndarray):
+        self.costs = costs
+        self.order = np.empty(costs.shape, dtype=int)
+        self.ranked = np.zeros(len(costs), dtype=int)
+
+    def at(self, rows: np.ndarray, rank: np.ndarray) -> np.ndarray:
+        """The driver at position `rank` in the preferences of each of `rows`."""
+        short = rank >= self.ranked[rows]
+        if short.any():
+            self._extend(rows[short])
+        return self.order[rows, rank]
+
+    def _extend(self, rows: np.ndarray):
+        drivers = self.costs.shape[1]
+        for width in np.unique(self.ranked[rows]):
+            group = rows[self.ranked[rows] == width]
+            costs = self.costs[group]
+            new_width = min(max(PREFERENCE_WINDOW, 4 * width), drivers)
+            if new_width < drivers:
+                candidates = np.argpartition(costs, new_width - 1, axis=1)[:, :new_width]
+            else:
+                candidates = np.broadcast_to(np.arange(drivers), costs.shape)
+            keys = np.take_along_axis(costs, candidates, axis=1)
+            self.order[group, :new_width] = np.take_along_axis(
+                candidates, np.lexsort((candidates, keys), axis=1), axis=1)
+            self.ranked[group] = new_width
+
+
+def assign(costs: np.ndarray, capacities, max_cost: Optional[float] = None) -> np.ndarray:
+    """The driver (column of `costs`) given each delivery (row), or -1 for
+    deliveries left unassigned: every driver within `max_cost` of them was
+    filled by nearer deliveries."""
+    costs = np.asarray(costs, dtype=float)
+    capacities = np.asarray(capacities, dtype=int)
+    count, drivers = costs.shape
+    assigned = np.full(count, -1)
+    if count == 0 or drivers == 0:
+        return assigned
+    reachable = capacities[None, :] > 0
+    if max_cost is not None:
+        reachable = reachable & (costs <= max_cost)
+    costs = np.where(reachable, costs, np.inf)
+    preferences = _Preferences(costs)
+    # Position in its preferences of the driver each delivery proposes to next
+    rank = np.zeros(count, dtype=int)
+    load = np.zeros(drivers, dtype=int)
+    # Cost of the farthest delivery each driver holds
+    farthest = np.full(drivers, -np.inf)
+
+    def hopeless(choice, cost):
+        return (load[choice] >= capacities[choice]) & (cost > farthest[choice]) & (cost < np.inf)
+
+    proposing = np.arange(count)
+    while proposing.size:
+        choice = preferences.at(proposing, rank[proposing])
+        cost = costs[proposing, choice]
+        looking = np.flatnonzero(hopeless(choice, cost))
+        while looking.size:
+            rows = proposing[looking]
+            rank[rows] += 1
+            exhausted = rank[rows] >= drivers
+            cost[looking[exhausted]] = np.inf
+            looking, rows = looking[~exhausted], rows[~exhausted]
+            choice[looking] = preferences.at(rows, rank[rows])
+            cost[looking] = costs[rows, choice[looking]]
+            looking = looking[hopeless(choice[looking], cost[looking])]
+        # A delivery whose next choice is out of reach has no one left to ask
+        in_reach = np.isfinite(cost)
+        proposing, choice, cost = proposing[in_reach], choice[in_reach], cost[in_reach]
+        if not proposing.size:
+            break
+        rank[proposing] += 1
+        # Drivers with room for all their proposals keep them
+        contested = load + np.bincount(choice, minlength=drivers) > capacities
+        uncontested = ~contested[choice]
+        assigned[proposing[uncontested]] = choice[uncontested]
+        load += np.bincount(choice[uncontested], minlength=drivers)
+        np.maximum.at(farthest, choice[uncontested], cost[uncontested])
+        # The others choose among what they hold and the new proposals, and end up full
+        held = np.flatnonzero((assigned >= 0) & contested[assigned])
+        rows = np.concatenate([held, proposing[~uncontested]])
+        row_drivers = np.concatenate([assigned[held], choice[~uncontested]])
+        row_costs = costs[rows, row_drivers]
+        order = np.lexsort((rows, row_costs, row_drivers))
+        rows, row_drivers, row_costs = rows[order], row_drivers[order], row_costs[order]
+        # Rank of each proposal among its driver's, nearest first
+        place = np.arange(rows.size) - np.searchsorted(row_drivers, row_drivers)
+        kept = place < capacities[row_drivers]
+        assigned[rows[kept]] = row_drivers[kept]
+        assigned[rows[~kept]] = -1
+        load[contested] = capacities[contested]
+        farthest[contested] = -np.inf
+        np.maximum.at(farthest, row_drivers[kept], row_costs[kept])
+        proposing = rows[~kept]
+        proposing = proposing[rank[proposing] < drivers]
+    return assigned
+
+
+def unit_vectors(points) -> np.ndarray:
+    """(lat, lon) points in degrees as unit vectors from the Earth's centre."""
+    lat, lon = np.radians(np.asarray(points, dtype=float)).T
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def plan_dispatch(deliveries, drivers, capacities, max_distance_km: Optional[float] = None
+                  ) -> List[Tuple[int, int, float]]:
+    """Assign `deliveries` to `drivers`, both lists of (lat, lon), each driver
+    taking at most its entry of `capacities`. Returns (delivery index, driver
+    index, great-circle distance in km) for every assigned delivery."""
+    if not deliveries or not drivers:
+        return []
+    delivery_vectors, driver_vectors = unit_vectors(deliveries), unit_vectors(drivers)
+    costs = 1 - delivery_vectors @ driver_vectors.T
+    max_cost = None
+    if max_distance_km is not None:
+        max_cost = 1 - np.cos(min(max_distance_km / EARTH_RADIUS_KM, np.pi))
+    assigned = assign(costs, capacities, max_cost)
+    rows = np.flatnonzero(assigned >= 0)
+    # From the chord between the two points, which stays exact for short distances
+    chords = np.linalg.norm(delivery_vectors[rows] - driver_vectors[assigned[rows]], axis=1)
+    distances = 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chords / 2, 0.0, 1.0))
+    return [(int(row), int(assigned[row]), float(distance)) for row, distance in zip(rows, distances)]
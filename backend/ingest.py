@@ -0,0 +1,96 @@
+"""Incremental parsing of bulk request bodies.
+
+Records are yielded as soon as they are complete in the stream, so a large
+upload is validated and written while the rest of it is still arriving.
+"""
+import codecs
+import json
+from typing import AsyncIterator, Optional, Tuple
+
+NDJSON_CONTENT_TYPES = {"application/x-ndjson", "application/jsonl", "application/ndjson"}
+
+_WHITESPACE = " \t\r\n"
+
+
+class MalformedBody(ValueError):
+    """The body is not a JSON array; nothing past this point can be recovered."""
+
+
+def _skip_whitespace(buffer: str, pos: int) -> int:
+    while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+        pos += 1
+    return pos
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[object, Optional[str]]]:
+    """Yield (record, error) per non-blank line; a bad line only affects itself."""
+    text = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    async for chunk in chunks:
+        pending += text.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            if line.strip():
+                yield _parse_line(line)
+    pending += text.decode(b"", final=True)
+    if pending.strip():
+        yield _parse_line(pending)
+
+
+def _parse_line(line: str) -> Tuple[object, Optional[str]]:
+    try:
+        return json.loads(line), None
+    except json.JSONDecodeError as exc:
+        return None, f"Malformed JSON: {exc.msg}"
+
+
+async def iter_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[object, Optional[str]]]:
+    """Yield (record, None) for each element of a top-level JSON array.
+
+    Raises MalformedBody when the stream stops being a valid array.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buffer, pos = "", 0
+    state = "start"  # start -> first -> (value -> separator)* -> end
+
+    async def more():
+        async for chunk in chunks:
+            yield text.decode(chunk)
+        yield text.decode(b"", final=True)
+
+    async for data in more():
+        buffer, pos = buffer[pos:] + data, 0
+        while True:
+            pos = _skip_whitespace(buffer, pos)
+            if pos == len(buffer):
+                break
+            char = buffer[pos]
+            if state == "start":
+                if char != "[":
+                    raise MalformedBody("Expected a JSON array")
+                state, pos = "first", pos + 1
+            elif state == "separator":
+                if char not in ",]":
+                    raise MalformedBody(f"Expected ',' or ']' at offset {pos}")
+                state, pos = ("value" if char == "," else "end"), pos + 1
+            elif state == "first" and char == "]":
+                state, pos = "end", pos + 1
+            elif state in ("first", "value"):
+                try:
+                    record, pos = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    break  # incomplete element; wait for more data
+                state = "separator"
+                yield record, None
+            else:
+                raise MalformedBody("Unexpected data after the JSON array")
+    if state != "end" or _skip_whitespace(buffer, pos) != len(buffer):
+        raise MalformedBody("Truncated or malformed JSON array")
+
+
+def iter_records(chunks: AsyncIterator[bytes], content_type: str) -> AsyncIterator[Tuple[object, Optional[str]]]:
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type in NDJSON_CONTENT_TYPES:
+        return iter_ndjson(chunks)
+    return iter_json_array(chunks)
@@ -0,0 +1,79 @@
+"""Maintenance commands for the backend database.
+
+Run from the backend directory, e.g. ``python manage.py backfill-locations``.
+"""
+import asyncio
+
+import typer
+
+import server
+import tiering
+
+cli = typer.Typer(help="Food Delivery Driver API maintenance commands")
+
+
+@cli.command("ensure-indexes")
+def ensure_indexes():
+    """Create every index the API routes rely on."""
+    asyncio.run(server.storage.ensure_indexes())
+    typer.echo("Indexes ensured")
+
+
+@cli.command("backfill-locations")
+def backfill_locations():
+    """Store a GeoJSON location on deliveries created before it was recorded."""
+    modified = asyncio.run(server.storage.deliveries.backfill_locations())
+    typer.echo(f"Backfilled location on {modified} deliveries")
+
+
+@cli.command("rebuild-active-customers")
+def rebuild_active_customers():
+    """Recompute the active-customers view from deliveries.
+
+    Run while delivery writes are paused; writes that land during the rebuild
+    may be missing from the result until their customer is next updated.
+    """
+    drivers = asyncio.run(server.storage.deliveries.rebuild_active_customers())
+    typer.echo(f"Rebuilt active customers for {drivers} drivers")
+
+
+@cli.command("check-active-customers")
+def check_active_customers():
+    """Compare the active-customers view against the aggregation over deliveries."""
+    mismatched = asyncio.run(server.storage.deliveries.check_active_customers())
+    if mismatched:
+        typer.echo(f"{len(mismatched)} drivers out of sync: {', '.join(mismatched)}", err=True)
+        raise typer.Exit(code=1)
+    typer.echo("Active customers view is consistent")
+
+
+@cli.command("rebuild-conversations")
+def rebuild_conversations():
+    """Recompute each conversation's latest message, which the inbox reads, from messages.
+
+    Run once before serving the inbox from a database whose messages predate it.
+    """
+    conversations = asyncio.run(server.storage.messages.rebuild_conversations())
+    typer.echo(f"Rebuilt {conversations} conversations")
+
+
+@cli.command("rebuild-rollups")
+def rebuild_rollups():
+    """Recompute the hourly and daily driver rollups from the status-change events."""
+    rollups = asyncio.run(server.storage.status_events.rebuild_rollups())
+    typer.echo(f"Rebuilt {rollups} rollups")
+
+
+@cli.command("archive-cold")
+def archive_cold():
+    """Move messages and delivered deliveries past the tiering policy's age into the archives.
+
+    The policy comes from TIERING_MESSAGE_MAX_AGE_DAYS, TIERING_DELIVERED_MAX_AGE_HOURS
+    and TIERING_BATCH_SIZE.
+    """
+    moved = asyncio.run(tiering.archive_cold(server.storage, tiering.TieringPolicy.from_env()))
+    typer.echo(f"Archived {moved['messages']} messages and {moved['deliveries']} deliveries")
+
+
+if __name__ == "__main__":
+    cli()
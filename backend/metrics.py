@@ -0,0 +1,242 @@
+"""Prometheus metrics for the API.
+
+Three views of where a request's time goes:
+
+* ``http_request_duration_seconds`` per route template, recorded by
+  ``MetricsMiddleware`` around the whole request, serialization included;
+* ``mongodb_command_duration_seconds`` per collection and command, recorded
+  by ``CommandTimer`` from pymongo's command monitoring, with a warning
+  logged for every command slower than the threshold;
+* ``event_loop_lag_seconds``, how late the event loop runs a timer, sampled
+  by ``monitor_event_loop``. Lag means requests are waiting for CPU-bound
+  work elsewhere rather than for MongoDB.
+
+``mongodb_pool_connections``, kept by ``PoolMonitor``, shows whether
+requests wait for a pooled connection instead, and the ``admission_*``
+metrics whether they were queued or turned away before running at all.
+
+Metrics are per worker process; Prometheus scrapes each worker.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from pymongo import monitoring
+from starlette.routing import Match
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time to handle a request, by route template",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Requests currently being handled, by route template", ["method", "route"],
+)
+MONGO_COMMAND_DURATION = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command round trips, by collection and command",
+    ["collection", "command", "outcome"], buckets=LATENCY_BUCKETS,
+)
+MONGO_SLOW_COMMANDS = Counter(
+    "mongodb_slow_commands_total", "MongoDB commands slower than the slow-command threshold",
+    ["collection", "command"],
+)
+TIERING_DOCUMENTS_MOVED = Counter(
+    "tiering_documents_moved_total", "Documents moved from a hot collection to its archive", ["collection"],
+)
+TIERING_BYTES_MOVED = Counter(
+    "tiering_bytes_moved_total", "BSON bytes moved from a hot collection to its archive", ["collection"],
+)
+TIER_DOCUMENTS = Gauge(
+    "tier_documents", "Documents per collection and tier, as of the last tiering run", ["collection", "tier"],
+)
+MONGO_POOL_CONNECTIONS = Gauge(
+    "mongodb_pool_connections", "MongoDB pool connections per server, by state (open, checked_out, waiting)",
+    ["address", "state"],
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "admission_in_flight", "Requests admitted and running, per limited route", ["method", "route"],
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "admission_queue_depth", "Requests waiting for admission, per limited route", ["method", "route"],
+)
+ADMISSION_QUEUE_WAIT = Histogram(
+    "admission_queue_wait_seconds", "Time requests waited for admission, whether admitted or not",
+    ["method", "route"], buckets=LATENCY_BUCKETS,
+)
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total", "Requests turned away: queue_full, deadline or rate_limited",
+    ["method", "route", "reason"],
+)
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "Delay between when a timer was due and when the event loop ran it",
+    buckets=LATENCY_BUCKETS,
+)
+
+
+def _resolve_route_template(scope) -> str:
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+def route_template(scope) -> str:
+    """The path template of the route `scope` resolves to, so that path
+    parameters do not each get their own series. The middlewares need it
+    before routing runs, so it is resolved once and kept in the request state."""
+    state = scope.setdefault("state", {})
+    if "route_template" not in state:
+        state["route_template"] = _resolve_route_template(scope)
+    return state["route_template"]
+
+
+class MetricsMiddleware:
+    """Records latency, status and concurrency of every HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method, route = scope["method"], route_template(scope)
+        status = "500"
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        in_progress = REQUESTS_IN_PROGRESS.labels(method, route)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_DURATION.labels(method, route, status).observe(time.perf_counter() - started)
+            in_progress.dec()
+
+
+class CommandTimer(monitoring.CommandListener):
+    """pymongo listener timing every command against its collection.
+
+    Pass it to the client through ``event_listeners``.
+    """
+
+    def __init__(self, slow_threshold_ms: float):
+        self.slow_threshold_s = slow_threshold_ms / 1000
+        # Namespace of each command in flight; only the started event carries it
+        self._namespaces: Dict[Tuple, Tuple[str, str]] = {}
+
+    @staticmethod
+    def _key(event) -> Tuple:
+        return event.connection_id, event.request_id
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            target = event.command.get("collection")
+        self._namespaces[self._key(event)] = event.database_name, target if isinstance(target, str) else ""
+
+    def _finished(self, event, outcome: str):
+        database, collection = self._namespaces.pop(self._key(event), ("", ""))
+        duration = event.duration_micros / 1e6
+        MONGO_COMMAND_DURATION.labels(collection, event.command_name, outcome).observe(duration)
+        if duration >= self.slow_threshold_s:
+            MONGO_SLOW_COMMANDS.labels(collection, event.command_name).inc()
+            logger.warning("Slow MongoDB command: %s on %s.%s took %.1f ms (%s)", event.command_name,
+                           database, collection, duration * 1000, outcome)
+
+    def succeeded(self, event):
+        self._finished(event, "success")
+
+    def failed(self, event):
+        self._finished(event, "failure")
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """pymongo listener tracking connection pool usage per server.
+
+    Pass it to the client through ``event_listeners``. pymongo calls it from
+    its own threads, hence the lock.
+    """
+
+    STATES = ("open", "checked_out", "waiting")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Dict[str, int]] = defaultdict(lambda: dict.fromkeys(self.STATES, 0))
+
+    def _add(self, event, state: str, delta: int):
+        address = "%s:%s" % event.address
+        with self._lock:
+            self._counts[address][state] += delta
+            MONGO_POOL_CONNECTIONS.labels(address, state).set(self._counts[address][state])
+
+    def snapshot(self, max_pool_size: int) -> dict:
+        """Connections of the busiest server's pool, with its saturation: the
+        share of `max_pool_size` checked out, above 1 when requests are waiting."""
+        with self._lock:
+            counts = max(self._counts.values(), key=lambda c: c["checked_out"] + c["waiting"],
+                         default=dict.fromkeys(self.STATES, 0))
+            busy = counts["checked_out"] + counts["waiting"]
+            return {**counts, "max_size": max_pool_size, "saturation": busy / max_pool_size}
+
+    def pool_closed(self, event):
+        with self._lock:
+            self._counts.pop("%s:%s" % event.address, None)
+
+    def connection_created(self, event):
+        self._add(event, "open", 1)
+
+    def connection_closed(self, event):
+        self._add(event, "open", -1)
+
+    def connection_check_out_started(self, event):
+        self._add(event, "waiting", 1)
+
+    def connection_check_out_failed(self, event):
+        self._add(event, "waiting", -1)
+
+    def connection_checked_out(self, event):
+        self._add(event, "waiting", -1)
+        self._add(event, "checked_out", 1)
+
+    def connection_checked_in(self, event):
+        self._add(event, "checked_out", -1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+
+async def monitor_event_loop(interval: float = 0.5):
+    """Sample event loop lag until cancelled."""
+    loop = asyncio.get_running_loop()
+    while True:
+        due = loop.time() + interval
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(loop.time() - due, 0.0))
+
+
+def render() -> Tuple[bytes, str]:
+    """The current metrics in the Prometheus text format, with its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
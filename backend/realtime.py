@@ -0,0 +1,196 @@
+"""Real-time fan-out of stored chat messages to WebSocket subscribers.
+
+Every worker process keeps a local hub of subscriptions keyed by channel, a
+tuple such as ``("conversation", driver_id, customer_name)``.
+A broker decides how new messages reach the hubs: the in-process broker
+dispatches straight into the local hub (single worker, tests), while the
+change-stream broker tails ``db.messages`` so every worker sees every insert
+no matter which process stored it.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Messages buffered per subscriber before it is considered too slow and dropped
+SUBSCRIPTION_BUFFER = 256
+
+
+Channel = Tuple[str, ...]
+
+
+def driver_channel(driver_id: str) -> Channel:
+    return ("driver", driver_id)
+
+
+def conversation_channel(driver_id: str, customer_name: str) -> Channel:
+    return ("conversation", driver_id, customer_name)
+
+
+def message_channels(message: dict):
+    """Channels a stored message is delivered to."""
+    return [
+        driver_channel(message["driver_id"]),
+        conversation_channel(message["driver_id"], message["customer_name"]),
+    ]
+
+
+class Subscription:
+    """Bounded queue of messages for one subscriber.
+
+    A subscriber that falls ``maxsize`` messages behind is closed rather than
+    allowed to grow without limit; it should reconnect and catch up through
+    the paginated read endpoints.
+    """
+
+    def __init__(self, hub: "LocalHub", channel: Channel, maxsize: int = SUBSCRIPTION_BUFFER):
+        self.hub = hub
+        self.channel = channel
+        self.overflowed = False
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self._closed = False
+
+    def deliver(self, message: dict):
+        if self._closed:
+            return
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            self.close()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.hub.unsubscribe(self)
+            # Wake up a reader blocked on an empty queue
+            if not self._queue.full():
+                self._queue.put_nowait(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        if self._closed and self._queue.empty():
+            raise StopAsyncIteration
+        message = await self._queue.get()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+
+class LocalHub:
+    """Subscriptions of the current process, indexed by channel."""
+
+    def __init__(self):
+        self._subscribers: Dict[Channel, Set[Subscription]] = defaultdict(set)
+
+    def subscribe(self, channel: Channel) -> Subscription:
+        subscription = Subscription(self, channel)
+        self._subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.channel)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.channel]
+
+    def dispatch(self, channels: Iterable[Channel], message: dict):
+        for channel in channels:
+            for subscription in list(self._subscribers.get(channel, ())):
+                subscription.deliver(message)
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+class MessageBroker:
+    """Delivers stored messages to the subscribers of every worker."""
+
+    def __init__(self):
+        self.hub = LocalHub()
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, message: dict):
+        """Called by ``send_message`` once the message is stored."""
+        raise NotImplementedError
+
+    def subscribe(self, driver_id: str, customer_name: Optional[str] = None) -> Subscription:
+        if customer_name is None:
+            return self.hub.subscribe(driver_channel(driver_id))
+        return self.hub.subscribe(conversation_channel(driver_id, customer_name))
+
+
+class InProcessBroker(MessageBroker):
+    """Fan-out within a single process. Suitable for one worker and for tests."""
+
+    async def publish(self, message: dict):
+        self.hub.dispatch(message_channels(message), message)
+
+
+class ChangeStreamBroker(MessageBroker):
+    """Fan-out across processes by tailing the messages collection's change stream.
+
+    Every worker watches inserts on ``db.messages``, so publishing is implicit
+    in the insert itself. Requires MongoDB running as a replica set.
+    """
+
+    RETRY_DELAY = 1.0
+    HISTORY_LOST = 286
+
+    def __init__(self, collection):
+        super().__init__()
+        self.collection = collection
+        self._task: Optional[asyncio.Task] = None
+        self._resume_token = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def publish(self, message: dict):
+        pass
+
+    async def _watch(self):
+        pipeline = [{"$match": {"operationType": "insert"}}]
+        while True:
+            try:
+                async with self.collection.watch(pipeline, resume_after=self._resume_token) as stream:
+                    async for change in stream:
+                        self._resume_token = stream.resume_token
+                        message = change["fullDocument"]
+                        self.hub.dispatch(message_channels(message), message)
+            except PyMongoError as exc:
+                if isinstance(exc, OperationFailure) and exc.code == self.HISTORY_LOST:
+                    # The oplog rolled past our position; resume from now
+                    self._resume_token = None
+                logger.exception("Message change stream failed, retrying in %ss", self.RETRY_DELAY)
+                await asyncio.sleep(self.RETRY_DELAY)
+
+
+def create_broker(kind: str, collection) -> MessageBroker:
+    if kind == "memory":
+        return InProcessBroker()
+    if kind == "changestream":
+        return ChangeStreamBroker(collection)
+    raise ValueError(f"Unknown MESSAGE_BROKER {kind!r}; expected 'memory' or 'changestream'")
@@ -0,0 +1,95 @@
+"""Stop ordering for a driver's open deliveries.
+
+Distances are great-circle (haversine) distances computed for every pair of
+points at once with NumPy. A nearest-neighbour tour from the driver's
+position is improved with 2-opt moves until no move helps or the time
+budget runs out, so large inputs degrade to a slightly worse route rather
+than a slow response.
+"""
+import time
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_matrix(latitudes, longitudes) -> np.ndarray:
+    """Pairwise great-circle distances in km between points given in degrees."""
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lon = np.radians(np.asarray(longitudes, dtype=float))
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine_km(origin, destination) -> float:
+    """Great-circle distance in km between two (lat, lon) points."""
+    (lat1, lon1), (lat2, lon2) = origin, destination
+    return float(haversine_matrix([lat1, lat2], [lon1, lon2])[0, 1])
+
+
+def path_length(distances: np.ndarray, tour) -> float:
+    tour = np.asarray(tour)
+    return float(distances[tour[:-1], tour[1:]].sum())
+
+
+def nearest_neighbour_tour(distances: np.ndarray) -> np.ndarray:
+    """Open tour starting at point 0 that always visits the closest unvisited point next."""
+    size = len(distances)
+    tour = np.empty(size, dtype=int)
+    visited = np.zeros(size, dtype=bool)
+    current = tour[0] = 0
+    visited[0] = True
+    for position in range(1, size):
+        candidates = np.where(visited, np.inf, distances[current])
+        current = tour[position] = int(np.argmin(candidates))
+        visited[current] = True
+    return tour
+
+
+def two_opt(distances: np.ndarray, tour: np.ndarray, deadline: float) -> np.ndarray:
+    """Improve an open tour with fixed start by reversing segments.
+
+    For each segment start the gain of every possible segment end is computed
+    in one vectorized step and the best improving reversal is applied.
+    """
+    tour = tour.copy()
+    last = len(tour) - 1
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for i in range(1, last):
+            a, b = tour[i - 1], tour[i]
+            ends = tour[i + 1:]  # candidate segment ends c = tour[j], j in i+1..last
+            after = tour[i + 2:]  # e = tour[j + 1]; the path simply stops after the last point
+            delta = distances[a, ends] - distances[a, b]
+            delta[:-1] += distances[b, after] - distances[ends[:-1], after]
+            best = int(np.argmin(delta))
+            if delta[best] < -1e-9:
+                j = i + 1 + best
+                tour[i:j + 1] = tour[i:j + 1][::-1].copy()
+                improved = True
+            if time.perf_counter() >= deadline:
+                break
+    return tour
+
+
+def plan_route(start, stops, time_budget_s: float) -> dict:
+    """Suggest a visit order for `stops` (a list of (lat, lon)) starting at `start`.
+
+    Returns the order as indices into `stops`, the total distance of that
+    order and of the plain nearest-neighbour order it was improved from.
+    """
+    if not stops:
+        return {"order": [], "total_distance_km": 0.0, "baseline_distance_km": 0.0}
+    deadline = time.perf_counter() + time_budget_s
+    points = np.array([start, *stops], dtype=float)
+    distances = haversine_matrix(points[:, 0], points[:, 1])
+    baseline = nearest_neighbour_tour(distances)
+    tour = two_opt(distances, baseline, deadline)
+    return {
+        "order": [int(point) - 1 for point in tour[1:]],
+        "total_distance_km": path_length(distances, tour),
+        "baseline_distance_km": path_length(distances, baseline),
+    }
@@ -1,31 +1,196 @@
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import ExecutionTimeout, PyMongoError
 import os
+import asyncio
+import time
+import base64
+import binascii
+import csv
+import io
+import json
 import logging
+import orjson
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Literal, Optional
 import uuid
-from datetime import datetime
+import zlib
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+
+from admission import AdmissionMiddleware, TokenBuckets, load_limiters, load_policies, retry_after_header
+from cache import MemoryStore, ReadThroughCache, cache_tag
+from dispatch import plan_dispatch
+from ingest import MalformedBody, iter_records
+from metrics import ADMISSION_REJECTED, CommandTimer, MetricsMiddleware, PoolMonitor, monitor_event_loop, render as render_metrics
+from realtime import create_broker
+from routing import haversine_km, plan_route
+from storage import create_storage, geo_point, status_event
+from tiering import TieringPolicy, run_periodically as run_tiering
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# MongoDB client options set from the environment, per deployment; unset ones
+# keep pymongo's defaults. Values are parsed as in a connection string, e.g.
+# MONGO_COMPRESSORS="zstd,zlib"
+MONGO_CLIENT_OPTIONS = {
+    "maxPoolSize": "MONGO_MAX_POOL_SIZE",
+    "minPoolSize": "MONGO_MIN_POOL_SIZE",
+    "maxIdleTimeMS": "MONGO_MAX_IDLE_TIME_MS",
+    "maxConnecting": "MONGO_MAX_CONNECTING",
+    "connectTimeoutMS": "MONGO_CONNECT_TIMEOUT_MS",
+    "socketTimeoutMS": "MONGO_SOCKET_TIMEOUT_MS",
+    "serverSelectionTimeoutMS": "MONGO_SERVER_SELECTION_TIMEOUT_MS",
+    "waitQueueTimeoutMS": "MONGO_WAIT_QUEUE_TIMEOUT_MS",
+    "compressors": "MONGO_COMPRESSORS",
+    "zlibCompressionLevel": "MONGO_ZLIB_COMPRESSION_LEVEL",
+}
+
+def mongo_client_options() -> dict:
+    return {option: os.environ[name] for option, name in MONGO_CLIENT_OPTIONS.items() if os.environ.get(name)}
+
+# MongoDB connection; every command is timed, and ones slower than
+# MONGO_SLOW_COMMAND_MS are logged. The client connects lazily: the lifespan
+# handler below opens the first connections before the app takes requests
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+pool_monitor = PoolMonitor()
+client = AsyncIOMotorClient(
+    mongo_url,
+    event_listeners=[CommandTimer(float(os.environ.get('MONGO_SLOW_COMMAND_MS', '100'))), pool_monitor],
+    **mongo_client_options(),
+)
 db = client[os.environ['DB_NAME']]
 
+# Routes reach the database through the storage layer; STORAGE_ENGINE=memory
+# runs the app without MongoDB, e.g. for load tests
+storage = create_storage(os.environ.get('STORAGE_ENGINE', 'mongo'), db)
+
+# Fan-out of new messages to WebSocket subscribers; use "changestream" when
+# running several workers against a replica set
+broker = create_broker(os.environ.get('MESSAGE_BROKER', 'memory'), db.messages)
+
+# Read-through cache for the driver list endpoints; invalidated by the writes
+# in this process, other workers see changes within CACHE_TTL_SECONDS
+cache = ReadThroughCache(
+    MemoryStore(int(os.environ.get('CACHE_MAX_ENTRIES', '10000'))),
+    float(os.environ.get('CACHE_TTL_SECONDS', '5')),
+)
+
+# Admission control for the write routes: bursts wait briefly for a slot and
+# are then turned away with 503, rather than piling up on the event loop and
+# the Motor pool and slowing down the read routes. ADMISSION_POLICIES (JSON)
+# overrides a route's policy, e.g. '{"POST /api/messages": {"limit": 64}}',
+# or lifts its limit with null
+WRITE_ROUTE_POLICY = {"limit": 32, "queue": 128, "timeout": 1.0, "retry_after": 1.0}
+# Dispatch runs one batch at a time: concurrent batches would plan over the
+# same unassigned deliveries and all but one would lose them
+DISPATCH_ROUTE_POLICY = {"limit": 1, "queue": 4, "timeout": 10.0, "retry_after": 5.0}
+admission_limiters = load_limiters(load_policies(
+    {
+        **{route: WRITE_ROUTE_POLICY for route in (
+            "POST /api/messages",
+            "POST /api/deliveries",
+            "POST /api/deliveries/bulk",
+            "POST /api/deliveries/status",
+            "PUT /api/deliveries/{delivery_id}/status",
+        )},
+        "POST /api/dispatch": DISPATCH_ROUTE_POLICY,
+    },
+    os.environ.get('ADMISSION_POLICIES', ''),
+))
+
+# Per-driver rate limit on sending messages and creating deliveries: off
+# unless DRIVER_RATE_LIMIT (requests per second) is set; a driver may burst
+# up to DRIVER_RATE_BURST requests
+DRIVER_RATE_LIMIT = float(os.environ.get('DRIVER_RATE_LIMIT', '0'))
+driver_buckets = (
+    TokenBuckets(DRIVER_RATE_LIMIT, float(os.environ.get('DRIVER_RATE_BURST', '20')))
+    if DRIVER_RATE_LIMIT > 0 else None
+)
+
+def limit_driver_rate(request: Request, driver_id: str):
+    """Reject the request with 429 if the driver is over its rate limit."""
+    if driver_buckets is None:
+        return
+    wait = driver_buckets.take(driver_id)
+    if wait is not None:
+        ADMISSION_REJECTED.labels(request.method, request.scope["route"].path, "rate_limited").inc()
+        raise HTTPException(status_code=429, detail="Too many requests for this driver",
+                            headers={"Retry-After": retry_after_header(wait)})
+
+def messages_tag(driver_id: str) -> str:
+    return cache_tag("messages", driver_id)
+
+def conversation_tag(driver_id: str, customer_name: str) -> str:
+    return cache_tag("conversation", driver_id, customer_name)
+
+def inbox_tag(driver_id: str) -> str:
+    return cache_tag("inbox", driver_id)
+
+def deliveries_tag(driver_id: str) -> str:
+    return cache_tag("deliveries", driver_id)
+
+async def invalidate_archived(collection: str, docs: List[dict]):
+    """Invalidate the cached pages that may list documents tiering just archived."""
+    if collection == "messages":
+        tags = {tag for doc in docs for tag in (
+            messages_tag(doc["driver_id"]), conversation_tag(doc["driver_id"], doc["customer_name"]),
+            inbox_tag(doc["driver_id"]))}
+    else:
+        tags = {deliveries_tag(doc["driver_id"]) for doc in docs}
+    await cache.invalidate(*tags)
+
+# Connections opened at startup, before the worker reports ready
+MONGO_WARM_CONNECTIONS = int(os.environ.get('MONGO_WARM_CONNECTIONS', '10'))
+
+# Tiering runs in the app when TIERING_INTERVAL_SECONDS is set; otherwise
+# schedule `python manage.py archive-cold` instead
+TIERING_INTERVAL_SECONDS = float(os.environ.get('TIERING_INTERVAL_SECONDS', '0'))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    await storage.warm_up(MONGO_WARM_CONNECTIONS)
+    await storage.ensure_indexes()
+    logger.info("Storage warmed up and indexes ensured in %.0f ms (%d connections open)",
+                (time.perf_counter() - started) * 1000, pool_monitor.snapshot(max_pool_size())["open"])
+    await broker.start()
+    background = [asyncio.create_task(monitor_event_loop()),
+                  asyncio.create_task(retry_status_events(STATUS_EVENT_RETRY_SECONDS))]
+    if TIERING_INTERVAL_SECONDS > 0:
+        background.append(asyncio.create_task(
+            run_tiering(lambda: storage, TieringPolicy.from_env(), TIERING_INTERVAL_SECONDS, invalidate_archived)
+        ))
+    try:
+        yield
+    finally:
+        for task in background:
+            task.cancel()
+        await broker.stop()
+        client.close()
+
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
 
+def delivery_document(delivery_obj) -> dict:
+    """Stored form of a delivery: the model fields plus its GeoJSON location."""
+    doc = delivery_obj.dict()
+    doc["location"] = geo_point(delivery_obj.latitude, delivery_obj.longitude)
+    return doc
+
+
 # Define Models
 class Message(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -41,9 +206,41 @@ class MessageCreate(BaseModel):
     text: str
     sender: str
 
+DeliveryStatus = Literal["pending", "in_progress", "delivered"]
+
+class StatusChange(BaseModel):
+    delivery_id: str
+    status: DeliveryStatus
+
+class StatusChangeResult(BaseModel):
+    delivery_id: str
+    status: str
+    matched: bool  # the delivery exists
+    applied: bool  # its status is now `status`
+    previous_status: Optional[str] = None
+    detail: Optional[str] = None  # why the change was not applied
+
+class DriverRollup(BaseModel):
+    driver_id: str
+    period: datetime  # start of the hour or day, UTC
+    started: int  # deliveries moved to in_progress
+    delivered: int
+    avg_delivery_seconds: Optional[float] = None  # from creation (pending) to delivered
+    max_delivery_seconds: Optional[float] = None
+
+class Conversation(BaseModel):
+    customer_name: str
+    last_message: Message
+    unread_count: int
+
+class ReadMarker(BaseModel):
+    driver_id: str
+    customer_name: str
+    read_at: datetime
+
 class DeliveryLocation(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    driver_id: str
+    driver_id: Optional[str] = None  # None until dispatch assigns a driver
     customer_name: str
     customer_phone: str
     address: str
@@ -54,70 +251,817 @@ class DeliveryLocation(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class DeliveryLocationCreate(BaseModel):
-    driver_id: str
+    driver_id: Optional[str] = None  # leave out to have dispatch assign one
     customer_name: str
     customer_phone: str
     address: str
-    latitude: float
-    longitude: float
+    latitude: float = Field(ge=-90, le=90)
+    longitude: float = Field(ge=-180, le=180)
     order_details: str
 
+class NearbyDelivery(DeliveryLocation):
+    distance_m: float  # great-circle distance from the query point, in meters
+
+class RouteStop(DeliveryLocation):
+    leg_distance_km: float  # from the previous stop, or from the start for the first
+
+class RoutePlan(BaseModel):
+    stops: List[RouteStop]
+    total_distance_km: float
+    baseline_distance_km: float  # nearest-neighbour order, before local search
+
+class AvailableDriver(BaseModel):
+    driver_id: str
+    latitude: float = Field(ge=-90, le=90)  # current position
+    longitude: float = Field(ge=-180, le=180)
+    capacity: int = Field(1, ge=0)  # deliveries the driver can take on in this batch
+
+class DispatchRequest(BaseModel):
+    drivers: List[AvailableDriver]
+    max_distance_km: Optional[float] = Field(None, gt=0)  # farthest a driver is sent to a delivery
+
+class DispatchAssignment(BaseModel):
+    delivery_id: str
+    driver_id: str
+    distance_km: float  # from the driver's position to the delivery
+
+class DispatchResult(BaseModel):
+    considered: int  # unassigned deliveries in the batch
+    assigned: int
+    unassigned: int  # left for a later batch: no driver in range had capacity, or assigned concurrently
+    total_distance_km: float
+    assignments: List[DispatchAssignment]
+
+class BulkRecordResult(BaseModel):
+    index: int  # position of the record in the request body
+    status: str  # created, invalid or failed
+    id: Optional[str] = None
+    errors: List[str] = []
+
+class BulkDeliveryResult(BaseModel):
+    created: int
+    invalid: int
+    failed: int
+    results: List[BulkRecordResult]
+
+class MessagePage(BaseModel):
+    items: List[Message]
+    next_cursor: Optional[str] = None  # pass as `after` to continue past the last item
+    prev_cursor: Optional[str] = None  # pass as `before` to go back past the first item
+    has_more: bool = False  # more items exist in the direction this page was read
+
+class DeliveryPage(BaseModel):
+    items: List[DeliveryLocation]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+    has_more: bool = False
+
+class MessageSearchHit(Message):
+    score: float  # relevance, higher is better
+
+class DeliverySearchHit(DeliveryLocation):
+    score: float
+
+class MessageSearchPage(BaseModel):
+    items: List[MessageSearchHit]
+    next_cursor: Optional[str] = None  # pass as `after` for the next best matches
+    has_more: bool = False
+
+class DeliverySearchPage(BaseModel):
+    items: List[DeliverySearchHit]
+    next_cursor: Optional[str] = None
+    has_more: bool = False
+
+class SyncChanges(BaseModel):
+    messages: List[Message]
+    deliveries: List[DeliveryLocation]
+    token: str  # pass as `since` on the next sync
+    has_more: bool = False  # sync again right away to get the rest
+
+# Keyset pagination
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+def encode_cursor(doc: dict, field: str) -> str:
+    """Opaque cursor for the (field, id) position of a document."""
+    value = doc[field]
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else value, doc["id"]])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, parse=datetime.fromisoformat):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, doc_id = json.loads(raw)
+        return parse(value), str(doc_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def fetch_page(repository, filters: dict, limit: int, after: Optional[str] = None,
+                     before: Optional[str] = None, fields: Optional[List[str]] = None) -> dict:
+    """Read one page from `repository` in its (order_field, id) order.
+
+    `after` continues past a cursor in the listing order, `before` reads the
+    page preceding it.
+    """
+    if after and before:
+        raise HTTPException(status_code=400, detail="Use either 'after' or 'before', not both")
+    docs, has_more = await repository.page(
+        filters, limit,
+        after=decode_cursor(after) if after else None,
+        before=decode_cursor(before) if before else None,
+        fields=fields,
+    )
+    field = repository.order_field
+    return {
+        "items": docs,
+        "next_cursor": encode_cursor(docs[-1], field) if docs else after,
+        "prev_cursor": encode_cursor(docs[0], field) if docs else before,
+        "has_more": has_more,
+    }
+
+# Serialization fast path for list endpoints
+#
+# Documents are written through the models, so reading only the model fields
+# already gives the right shape and types. Copying those fields in
+# model order and encoding with orjson gives the same bytes FastAPI would
+# produce from model instances and response_model validation, without
+# building either. The one difference is floats: json.dumps writes them as
+# repr does, with an exponent below 1e-4 and from 1e16 on, while orjson
+# writes 0.00005 and 1e16. Pages holding such a float are encoded through the
+# models instead; coordinates rarely need it.
+
+def orjson_matches_repr(value) -> bool:
+    """Whether orjson writes `value` as json.dumps does."""
+    return not isinstance(value, float) or value == 0 or 1e-4 <= abs(value) < 1e16
+
+
+def encode_page(page: dict, model) -> bytes:
+    fields = list(model.model_fields)
+    float_fields = [name for name, field in model.model_fields.items() if field.annotation is float]
+
+    def item(doc):
+        try:
+            return {field: doc[field] for field in fields}
+        except KeyError:
+            # Written before a field existed: let the model fill in defaults
+            return jsonable_encoder(model(**doc))
+
+    items = [item(doc) for doc in page["items"]]
+    if all(orjson_matches_repr(doc[name]) for doc in items for name in float_fields):
+        return orjson.dumps({**page, "items": items})
+    return JSONResponse(jsonable_encoder({**page, "items": [model(**doc) for doc in page["items"]]})).body
+
+
+def page_loader(repository, model, filters: dict, limit: int, after: Optional[str], before: Optional[str]):
+    """Cache loader producing the encoded JSON body of one page."""
+    async def load() -> bytes:
+        page = await fetch_page(repository, filters, limit, after, before, fields=list(model.model_fields))
+        return encode_page(page, model)
+    return load
+
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """`value` as naive UTC, the form timestamps are stored in."""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def json_body(content: bytes) -> Response:
+    return Response(content, media_type="application/json")
+
 # Chat endpoints
 @api_router.post("/messages", response_model=Message)
-async def send_message(message: MessageCreate):
+async def send_message(message: MessageCreate, request: Request):
+    limit_driver_rate(request, message.driver_id)
     message_obj = Message(**message.dict())
-    await db.messages.insert_one(message_obj.dict())
+    await storage.messages.insert(message_obj.dict())
+    await cache.invalidate(
+        messages_tag(message_obj.driver_id),
+        conversation_tag(message_obj.driver_id, message_obj.customer_name),
+        inbox_tag(message_obj.driver_id),
+    )
+    await broker.publish(message_obj.dict())
     return message_obj
 
-@api_router.get("/messages/{driver_id}", response_model=List[Message])
-async def get_driver_messages(driver_id: str):
-    messages = await db.messages.find({"driver_id": driver_id}).sort("timestamp", 1).to_list(1000)
-    return [Message(**msg) for msg in messages]
+@api_router.get("/messages/{driver_id}", response_model=MessagePage)
+async def get_driver_messages(
+    driver_id: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+):
+    return json_body(await cache.get_or_load(
+        messages_tag(driver_id), f"{limit}:{after}:{before}",
+        page_loader(storage.messages, Message, {"driver_id": driver_id}, limit, after, before),
+    ))
+
+@api_router.get("/messages/{driver_id}/{customer_name}", response_model=MessagePage)
+async def get_conversation(
+    driver_id: str,
+    customer_name: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+):
+    return json_body(await cache.get_or_load(
+        conversation_tag(driver_id, customer_name), f"{limit}:{after}:{before}",
+        page_loader(
+            storage.messages, Message, {"driver_id": driver_id, "customer_name": customer_name}, limit, after, before
+        ),
+    ))
+
+@api_router.get("/driver/{driver_id}/inbox", response_model=List[Conversation])
+async def get_inbox(driver_id: str):
+    """Every conversation of the driver, most recent first, with its latest
+    message and the number of customer messages the driver has not read."""
+    async def load():
+        return orjson.dumps(jsonable_encoder(
+            [Conversation(**conversation) for conversation in await storage.messages.inbox(driver_id)]
+        ))
+    return json_body(await cache.get_or_load(inbox_tag(driver_id), "inbox", load))
+
+@api_router.put("/messages/{driver_id}/{customer_name}/read", response_model=ReadMarker)
+async def mark_conversation_read(driver_id: str, customer_name: str, read_at: Optional[datetime] = None):
+    """Mark the conversation read up to `read_at` (default: now). Markers never move back."""
+    marker = await storage.messages.mark_read(driver_id, customer_name, naive_utc(read_at or datetime.utcnow()))
+    await cache.invalidate(inbox_tag(driver_id))
+    return ReadMarker(driver_id=driver_id, customer_name=customer_name, read_at=marker)
+
+async def stream_messages(websocket: WebSocket, subscription):
+    """Push each message from `subscription` until either side goes away."""
+    await websocket.accept()
+
+    async def push():
+        async for message in subscription:
+            await websocket.send_text(Message(**message).json())
+
+    async def drain():
+        # Clients do not send anything; receiving only detects the disconnect
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
 
-@api_router.get("/messages/{driver_id}/{customer_name}", response_model=List[Message])
-async def get_conversation(driver_id: str, customer_name: str):
-    messages = await db.messages.find({
-        "driver_id": driver_id,
-        "customer_name": customer_name
-    }).sort("timestamp", 1).to_list(1000)
-    return [Message(**msg) for msg in messages]
+    pusher, receiver = asyncio.create_task(push()), asyncio.create_task(drain())
+    try:
+        done, _ = await asyncio.wait({pusher, receiver}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        subscription.close()
+        pusher.cancel()
+        receiver.cancel()
+    if pusher in done and pusher.exception() is None:
+        # The subscription ended first: the client fell too far behind and
+        # should catch up through the paginated endpoints
+        await websocket.close(code=1013)
+
+@api_router.websocket("/ws/messages/{driver_id}")
+async def watch_driver_messages(websocket: WebSocket, driver_id: str):
+    await stream_messages(websocket, broker.subscribe(driver_id))
+
+@api_router.websocket("/ws/messages/{driver_id}/{customer_name}")
+async def watch_conversation(websocket: WebSocket, driver_id: str, customer_name: str):
+    await stream_messages(websocket, broker.subscribe(driver_id, customer_name))
 
 # Delivery location endpoints
 @api_router.post("/deliveries", response_model=DeliveryLocation)
-async def create_delivery(delivery: DeliveryLocationCreate):
+async def create_delivery(delivery: DeliveryLocationCreate, request: Request):
+    if delivery.driver_id is not None:
+        limit_driver_rate(request, delivery.driver_id)
     delivery_obj = DeliveryLocation(**delivery.dict())
-    await db.deliveries.insert_one(delivery_obj.dict())
+    doc = delivery_document(delivery_obj)
+    await storage.deliveries.insert(doc)
+    if delivery_obj.driver_id is not None:
+        await storage.deliveries.merge_active_customers([doc])
+        await cache.invalidate(deliveries_tag(delivery_obj.driver_id))
     return delivery_obj
 
-@api_router.get("/deliveries/{driver_id}", response_model=List[DeliveryLocation])
-async def get_driver_deliveries(driver_id: str):
-    deliveries = await db.deliveries.find({"driver_id": driver_id}).sort("created_at", -1).to_list(1000)
-    return [DeliveryLocation(**delivery) for delivery in deliveries]
+# Records per insert_many call on the bulk path
+BULK_CHUNK_SIZE = 500
+
+def validation_messages(exc: ValidationError) -> List[str]:
+    return [f"{'.'.join(map(str, error['loc'])) or 'record'}: {error['msg']}" for error in exc.errors()]
+
+async def insert_delivery_chunk(chunk: list):
+    """Write one chunk unordered, so a failing document does not stop the rest."""
+    try:
+        failed = await storage.deliveries.insert_many([doc for _, doc in chunk])
+    except PyMongoError as exc:
+        logger.exception("Bulk delivery chunk of %d failed", len(chunk))
+        for result, _ in chunk:
+            result.update(status="failed", errors=[str(exc)])
+        return
+    for position, (result, _) in enumerate(chunk):
+        if position in failed:
+            _, message = failed[position]
+            result.update(status="failed", errors=[message])
+    stored = [doc for result, doc in chunk if result["status"] == "created" and doc["driver_id"] is not None]
+    if stored:
+        await storage.deliveries.merge_active_customers(stored)
+        await cache.invalidate(*{deliveries_tag(doc["driver_id"]) for doc in stored})
+
+@api_router.post("/deliveries/bulk", response_model=BulkDeliveryResult)
+async def bulk_create_deliveries(request: Request):
+    """Create deliveries from a JSON array or an NDJSON stream.
+
+    Records are validated as they arrive and written in unordered chunks of
+    BULK_CHUNK_SIZE, with the next chunk parsed while the previous one is
+    being written. Each record gets its own result.
+    """
+    results, chunk, writing = [], [], None
+    records = iter_records(request.stream(), request.headers.get("content-type", ""))
+    try:
+        async for record, error in records:
+            result = {"index": len(results), "status": "invalid", "errors": []}
+            results.append(result)
+            if error is None and not isinstance(record, dict):
+                error = "Expected a JSON object"
+            if error is not None:
+                result["errors"] = [error]
+                continue
+            try:
+                delivery_obj = DeliveryLocation(**DeliveryLocationCreate(**record).dict())
+            except ValidationError as exc:
+                result["errors"] = validation_messages(exc)
+                continue
+            result.update(status="created", id=delivery_obj.id)
+            chunk.append((result, delivery_document(delivery_obj)))
+            if len(chunk) >= BULK_CHUNK_SIZE:
+                if writing is not None:
+                    await writing
+                writing, chunk = asyncio.create_task(insert_delivery_chunk(chunk)), []
+    except MalformedBody as exc:
+        # Records parsed so far are still written; nothing after this point can be
+        results.append({"index": len(results), "status": "invalid", "errors": [str(exc)]})
+    if writing is not None:
+        await writing
+    if chunk:
+        await insert_delivery_chunk(chunk)
+    counts = {status: sum(r["status"] == status for r in results) for status in ("created", "invalid", "failed")}
+    return {**counts, "results": results}
+
+# Registered before /deliveries/{driver_id} so "nearby" is not taken for a driver id
+@api_router.get("/deliveries/nearby", response_model=List[NearbyDelivery])
+async def get_nearby_deliveries(
+    latitude: float = Query(ge=-90, le=90),
+    longitude: float = Query(ge=-180, le=180),
+    max_distance_km: float = Query(5.0, gt=0, le=100),
+    status: Optional[str] = None,
+    driver_id: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+):
+    """Deliveries closest to a point, nearest first, with their distance in meters."""
+    filters = {}
+    if status is not None:
+        filters["status"] = status
+    if driver_id is not None:
+        filters["driver_id"] = driver_id
+    return await storage.deliveries.nearby(latitude, longitude, max_distance_km * 1000, filters, limit)
+
+@api_router.get("/deliveries/{driver_id}", response_model=DeliveryPage)
+async def get_driver_deliveries(
+    driver_id: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+):
+    return json_body(await cache.get_or_load(
+        deliveries_tag(driver_id), f"{limit}:{after}:{before}",
+        page_loader(storage.deliveries, DeliveryLocation, {"driver_id": driver_id}, limit, after, before),
+    ))
+
+# Status changes follow pending -> in_progress -> delivered; each write is
+# conditional on the status it moves from, so concurrent changes cannot skip a step
+MAX_STATUS_CHANGES = 500
+
+# Each status change queues its event with the delivery; the change records
+# it right away, and events a failure left queued are recorded every
+# STATUS_EVENT_RETRY_SECONDS
+STATUS_EVENT_RETRY_SECONDS = float(os.environ.get('STATUS_EVENT_RETRY_SECONDS', '30'))
+STATUS_EVENT_BATCH_SIZE = 1000
+
+async def record_status_events(events: List[dict]):
+    await storage.status_events.record(events)
+    await storage.deliveries.mark_recorded(events)
+
+async def record_queued_status_events() -> int:
+    """Record every queued status event. Returns the number recorded."""
+    recorded = 0
+    while True:
+        events = await storage.deliveries.unrecorded_events(STATUS_EVENT_BATCH_SIZE)
+        if events:
+            await record_status_events(events)
+            recorded += len(events)
+        if len(events) < STATUS_EVENT_BATCH_SIZE:
+            return recorded
+
+async def retry_status_events(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            recorded = await record_queued_status_events()
+            if recorded:
+                logger.info("Recorded %d queued status events", recorded)
+        except Exception:
+            logger.exception("Recording queued status events failed")
+
+async def apply_status_changes(changes: List[StatusChange]) -> List[dict]:
+    results = await storage.deliveries.apply_transitions([(change.delivery_id, change.status) for change in changes])
+    applied = [result for result in results if result["applied"]]
+    # The statuses are written by now, with their events queued: a failure to
+    # record the events leaves them to the retries, and whatever fails, the
+    # view and the cache must follow the statuses
+    events = [status_event(result) for result in applied]
+    try:
+        await record_status_events(events)
+    except Exception:
+        logger.exception("Recording %d status events failed; they stay queued", len(events))
+    try:
+        for driver_id, customer_name in {(result["driver_id"], result["customer_name"]) for result in applied}:
+            await storage.deliveries.refresh_active_customer(driver_id, customer_name)
+    finally:
+        await cache.invalidate(*{deliveries_tag(result["driver_id"]) for result in applied})
+    return results
+
+@api_router.post("/deliveries/status", response_model=List[StatusChangeResult])
+async def update_delivery_statuses(changes: List[StatusChange]):
+    """Apply many status changes at once, reporting for each whether it matched a
+    delivery and whether the transition was applied."""
+    if len(changes) > MAX_STATUS_CHANGES:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_STATUS_CHANGES} changes per request")
+    return await apply_status_changes(changes)
 
 @api_router.put("/deliveries/{delivery_id}/status")
-async def update_delivery_status(delivery_id: str, status: str):
-    await db.deliveries.update_one(
-        {"id": delivery_id},
-        {"$set": {"status": status}}
-    )
+async def update_delivery_status(delivery_id: str, status: DeliveryStatus):
+    [result] = await apply_status_changes([StatusChange(delivery_id=delivery_id, status=status)])
+    if not result["matched"]:
+        raise HTTPException(status_code=404, detail=result["detail"])
+    if not result["applied"]:
+        raise HTTPException(status_code=409, detail=result["detail"])
     return {"message": "Status updated successfully"}
 
 # Driver endpoints
 @api_router.get("/driver/{driver_id}/active-customers")
 async def get_active_customers(driver_id: str):
-    # Get unique customers from recent deliveries
-    pipeline = [
-        {"$match": {"driver_id": driver_id, "status": {"$in": ["pending", "in_progress"]}}},
-        {"$group": {
-            "_id": "$customer_name",
-            "customer_phone": {"$first": "$customer_phone"},
-            "latest_order": {"$first": "$order_details"},
-            "delivery_id": {"$first": "$id"}
-        }}
+    """Customers with an open delivery, each with their most recent open order."""
+    customers = sorted(
+        await storage.deliveries.active_customers(driver_id),
+        key=lambda entry: (entry["created_at"], entry["delivery_id"]), reverse=True,
+    )
+    return [
+        {
+            "_id": entry["customer_name"],
+            "customer_phone": entry["customer_phone"],
+            "latest_order": entry["latest_order"],
+            "delivery_id": entry["delivery_id"],
+        }
+        for entry in customers
     ]
-    
-    customers = await db.deliveries.aggregate(pipeline).to_list(1000)
-    return customers
+
+# Time spent improving a route beyond nearest-neighbour, unless the request asks otherwise
+ROUTE_TIME_BUDGET_MS = int(os.environ.get('ROUTE_TIME_BUDGET_MS', '20'))
+MAX_ROUTE_STOPS = 1000
+
+@api_router.get("/driver/{driver_id}/route", response_model=RoutePlan)
+async def get_driver_route(
+    driver_id: str,
+    latitude: float = Query(ge=-90, le=90),
+    longitude: float = Query(ge=-180, le=180),
+    time_budget_ms: int = Query(ROUTE_TIME_BUDGET_MS, ge=1, le=1000),
+):
+    """Suggested visit order for the driver's open deliveries from a start point."""
+    deliveries = await storage.deliveries.open_deliveries(driver_id, MAX_ROUTE_STOPS)
+    points = [(delivery["latitude"], delivery["longitude"]) for delivery in deliveries]
+    plan = await run_in_threadpool(plan_route, (latitude, longitude), points, time_budget_ms / 1000)
+    stops, previous = [], (latitude, longitude)
+    for index in plan["order"]:
+        delivery = deliveries[index]
+        current = (delivery["latitude"], delivery["longitude"])
+        stops.append({**delivery, "leg_distance_km": haversine_km(previous, current)})
+        previous = current
+    return {
+        "stops": stops,
+        "total_distance_km": plan["total_distance_km"],
+        "baseline_distance_km": plan["baseline_distance_km"],
+    }
+
+# Dispatch: deliveries created without a driver are assigned in batches of up
+# to DISPATCH_BATCH_SIZE, oldest first, to the nearest of the drivers the
+# caller lists as available, each taking at most its capacity. Only the
+# assignment is computed here; driver positions and capacities come with the
+# request. Deliveries no driver could take stay unassigned for the next batch
+DISPATCH_BATCH_SIZE = int(os.environ.get('DISPATCH_BATCH_SIZE', '5000'))
+MAX_DISPATCH_DRIVERS = 2000
+
+@api_router.post("/dispatch", response_model=DispatchResult)
+async def dispatch_deliveries(
+    dispatch: DispatchRequest,
+    limit: int = Query(DISPATCH_BATCH_SIZE, ge=1, le=DISPATCH_BATCH_SIZE),
+):
+    """Assign a batch of unassigned deliveries to the nearest available drivers."""
+    drivers = dispatch.drivers
+    if len(drivers) > MAX_DISPATCH_DRIVERS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_DISPATCH_DRIVERS} drivers per request")
+    if len({driver.driver_id for driver in drivers}) < len(drivers):
+        raise HTTPException(status_code=422, detail="Duplicate driver_id in drivers")
+    pending = await storage.deliveries.unassigned(limit)
+    plan = await run_in_threadpool(
+        plan_dispatch,
+        [(delivery["latitude"], delivery["longitude"]) for delivery in pending],
+        [(driver.latitude, driver.longitude) for driver in drivers],
+        [driver.capacity for driver in drivers],
+        dispatch.max_distance_km,
+    )
+    assigned = set(await storage.deliveries.assign_drivers(
+        [(pending[row]["id"], drivers[column].driver_id) for row, column, _ in plan]))
+    assignments = [
+        {"delivery_id": pending[row]["id"], "driver_id": drivers[column].driver_id, "distance_km": distance_km}
+        for row, column, distance_km in plan if pending[row]["id"] in assigned
+    ]
+    if assignments:
+        docs = {doc["id"]: doc for doc in pending}
+        await storage.deliveries.merge_active_customers(
+            [{**docs[entry["delivery_id"]], "driver_id": entry["driver_id"]} for entry in assignments])
+        await cache.invalidate(*{deliveries_tag(entry["driver_id"]) for entry in assignments})
+    return {
+        "considered": len(pending),
+        "assigned": len(assignments),
+        "unassigned": len(pending) - len(assignments),
+        "total_distance_km": sum(entry["distance_km"] for entry in assignments),
+        "assignments": assignments,
+    }
+
+# Delta sync. Every write to a driver's messages or deliveries takes the
+# driver's next version; a client keeps the token from its last sync and
+# receives the documents written after it. Versions are reserved before the
+# write lands, so a change newer than SYNC_SETTLE_SECONDS may still have an
+# earlier version in flight: such changes are returned but the token stops
+# short of them, and the next sync returns them again. Clients apply changes
+# by id, so repeats are harmless. Syncing again straight away would return
+# the same unsettled changes, so such a response has has_more false and a
+# Retry-After for when the first of them settles. A token past the driver's
+# latest version was not issued by this server (or its counters were reset):
+# the client must start over from 0.
+SYNC_SETTLE_SECONDS = float(os.environ.get('SYNC_SETTLE_SECONDS', '2'))
+
+def decode_sync_token(token: str) -> int:
+    if not token.isdigit():
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+    return int(token)
+
+@api_router.get("/sync/{driver_id}", response_model=SyncChanges, responses={
+    304: {"description": "Nothing changed"}, 410: {"description": "Token unknown; sync again from 0"}})
+async def sync_driver(
+    response: Response,
+    driver_id: str,
+    since: str = "0",
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    """Messages and deliveries of the driver created or updated after `since`,
+    oldest change first. 304 when nothing changed, without reading either collection."""
+    since_version = decode_sync_token(since)
+    latest, latest_changed_at = await storage.versions.latest(driver_id)
+    if latest < since_version:
+        raise HTTPException(status_code=410, detail="Sync token is ahead of the server; sync again from 0")
+    if latest == since_version:
+        return Response(status_code=304)
+
+    messages = await storage.messages.changes(driver_id, since_version, limit + 1)
+    deliveries = await storage.deliveries.changes(driver_id, since_version, limit + 1)
+    changes = sorted(
+        [(doc["version"], "messages", doc) for doc in messages]
+        + [(doc["version"], "deliveries", doc) for doc in deliveries],
+        key=lambda change: change[0],
+    )
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    settled = datetime.utcnow() - timedelta(seconds=SYNC_SETTLE_SECONDS)
+    token = since_version
+    for version, _, doc in changes:
+        if doc["changed_at"] > settled:
+            has_more = False
+            response.headers["Retry-After"] = retry_after_header((doc["changed_at"] - settled).total_seconds())
+            break
+        token = version
+    else:
+        # Versions past the last change belong to writes that failed
+        if not has_more and latest_changed_at <= settled:
+            token = latest
+    return {
+        "messages": [doc for _, kind, doc in changes if kind == "messages"],
+        "deliveries": [doc for _, kind, doc in changes if kind == "deliveries"],
+        "token": str(token),
+        "has_more": has_more,
+    }
+
+# Exports stream a driver's documents for a time range, archived ones first,
+# in EXPORT_BATCH_SIZE batches: each batch is read, encoded and sent before
+# the next is fetched, so memory stays flat however large the export is.
+# Peak memory grows with the batch size while throughput barely does past
+# ~1000 (see benchmarks/bench_export.py)
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '1000'))
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+def encode_csv(rows) -> bytes:
+    text = io.StringIO()
+    csv.writer(text).writerows(
+        [value.isoformat() if isinstance(value, datetime) else value for value in row] for row in rows
+    )
+    return text.getvalue().encode()
+
+async def encode_export(docs, fields: List[str], export_format: str):
+    """Encoded rows of `docs`, one chunk per EXPORT_BATCH_SIZE documents."""
+    if export_format == "csv":
+        yield encode_csv([fields])
+        encode = lambda batch: encode_csv([doc.get(name) for name in fields] for doc in batch)
+    else:
+        encode = lambda batch: b"".join(orjson.dumps(doc, option=orjson.OPT_APPEND_NEWLINE) for doc in batch)
+    batch = []
+    async for doc in docs:
+        batch.append(doc)
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            yield encode(batch)
+            batch = []
+    if batch:
+        yield encode(batch)
+
+async def gzip_stream(chunks):
+    """`chunks` as one gzip member, compressed as they arrive."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def export_response(repositories, model, driver_id: str, start: Optional[datetime], end: Optional[datetime],
+                    export_format: str, gzip: bool) -> StreamingResponse:
+    fields = list(model.model_fields)
+
+    async def docs():
+        for repository in repositories:
+            async for doc in repository.stream(
+                    {"driver_id": driver_id}, naive_utc(start), naive_utc(end), EXPORT_BATCH_SIZE, fields):
+                yield doc
+
+    body = encode_export(docs(), fields, export_format)
+    headers = {"Content-Disposition": f'attachment; filename="{model.__name__.lower()}-{driver_id}.{export_format}"'}
+    if gzip:
+        body = gzip_stream(body)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type=EXPORT_MEDIA_TYPES[export_format], headers=headers)
+
+@api_router.get("/export/deliveries/{driver_id}", response_class=StreamingResponse)
+async def export_deliveries(
+    driver_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    gzip: bool = False,
+):
+    """The driver's deliveries created in [start, end), as NDJSON or CSV."""
+    return export_response(
+        [storage.deliveries_archive, storage.deliveries], DeliveryLocation, driver_id, start, end, format, gzip
+    )
+
+@api_router.get("/export/messages/{driver_id}", response_class=StreamingResponse)
+async def export_messages(
+    driver_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    gzip: bool = False,
+):
+    """The driver's messages sent in [start, end), as NDJSON or CSV."""
+    return export_response([storage.messages_archive, storage.messages], Message, driver_id, start, end, format, gzip)
+
+# History: documents the tiering policy moved out of the hot collections.
+# Archives only grow by old documents, so these reads bypass the cache.
+@api_router.get("/history/messages/{driver_id}/{customer_name}", response_model=MessagePage)
+async def get_conversation_history(
+    driver_id: str,
+    customer_name: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+):
+    return json_body(await page_loader(
+        storage.messages_archive, Message, {"driver_id": driver_id, "customer_name": customer_name},
+        limit, after, before,
+    )())
+
+@api_router.get("/history/deliveries/{driver_id}", response_model=DeliveryPage)
+async def get_delivery_history(
+    driver_id: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+):
+    return json_body(await page_loader(
+        storage.deliveries_archive, DeliveryLocation, {"driver_id": driver_id}, limit, after, before,
+    )())
+
+# Search: one driver's text search over the hot collection and its archive
+# together, best match first. The text index is per driver, so the driver is
+# required; the time range filters the driver's matches rather than narrowing
+# the index scan. A search whose words are too common to rank within
+# SEARCH_MAX_TIME_MS is rejected rather than left to hold a worker
+SEARCH_MAX_TIME_MS = int(os.environ.get('SEARCH_MAX_TIME_MS', '2000'))
+
+async def search_body(repositories, model, text: str, driver_id: str, start: Optional[datetime],
+                      end: Optional[datetime], limit: int, after: Optional[str]) -> Response:
+    position = decode_cursor(after, float) if after else None
+    filters = {"driver_id": driver_id}
+    hits, has_more = [], False
+    try:
+        for repository in repositories:
+            docs, more = await repository.search(text, filters, naive_utc(start), naive_utc(end), limit, position,
+                                                 list(model.model_fields), SEARCH_MAX_TIME_MS)
+            hits += docs
+            has_more = has_more or more
+    except ExecutionTimeout:
+        raise HTTPException(status_code=422, detail="Search is too broad; add words to it")
+    hits.sort(key=lambda doc: (-doc["score"], doc["id"]))
+    items = hits[:limit]
+    page = {
+        "items": items,
+        "next_cursor": encode_cursor(items[-1], "score") if items else after,
+        "has_more": has_more or len(hits) > limit,
+    }
+    return json_body(encode_page(page, model))
+
+@api_router.get("/search/messages", response_model=MessageSearchPage)
+async def search_messages(
+    q: str = Query(..., min_length=1),
+    driver_id: str = Query(...),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+):
+    """Messages matching `q`, e.g. `apartment 4B` (any word) or `"apartment 4B"`
+    (the phrase), best match first."""
+    return await search_body([storage.messages, storage.messages_archive], MessageSearchHit,
+                             q, driver_id, start, end, limit, after)
+
+@api_router.get("/search/deliveries", response_model=DeliverySearchPage)
+async def search_deliveries(
+    q: str = Query(..., min_length=1),
+    driver_id: str = Query(...),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+):
+    """Deliveries whose order details or address match `q`, best match first."""
+    return await search_body([storage.deliveries, storage.deliveries_archive], DeliverySearchHit,
+                             q, driver_id, start, end, limit, after)
+
+# Analytics read the hourly and daily rollups that status changes keep
+# current, never the deliveries themselves
+MAX_ROLLUPS = 5000
+
+def rollup_row(rollup: dict) -> dict:
+    delivered = rollup["delivered"]
+    return {
+        "driver_id": rollup["driver_id"],
+        "period": rollup["period"],
+        "started": rollup["started"],
+        "delivered": delivered,
+        "avg_delivery_seconds": rollup["delivery_seconds_total"] / delivered if delivered else None,
+        "max_delivery_seconds": rollup["delivery_seconds_max"] if delivered else None,
+    }
+
+async def read_rollups(granularity: str, filters: dict, start: Optional[datetime], end: Optional[datetime],
+                       limit: int) -> List[dict]:
+    rollups = await storage.status_events.rollups(granularity, filters, naive_utc(start), naive_utc(end), limit)
+    return [rollup_row(rollup) for rollup in rollups]
+
+@api_router.get("/analytics/drivers", response_model=List[DriverRollup])
+async def get_fleet_analytics(
+    granularity: Literal["hour", "day"] = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_ROLLUPS),
+):
+    """Every driver's deliveries and delivery times per hour or day, oldest period first."""
+    return await read_rollups(granularity, {}, start, end, limit)
+
+@api_router.get("/analytics/drivers/{driver_id}", response_model=List[DriverRollup])
+async def get_driver_analytics(
+    driver_id: str,
+    granularity: Literal["hour", "day"] = "hour",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_ROLLUPS),
+):
+    """The driver's deliveries and delivery times per hour or day, oldest period first."""
+    return await read_rollups(granularity, {"driver_id": driver_id}, start, end, limit)
+
+@api_router.get("/cache/stats")
+async def get_cache_stats():
+    """Hit, miss and eviction counters of this worker's read-through cache."""
+    return cache.stats()
 
 # Add your routes to the router instead of directly to app
 @api_router.get("/")
@@ -127,6 +1071,39 @@ async def root():
 # Include the router in the main app
 app.include_router(api_router)
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """This worker's metrics in the Prometheus text format."""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+def max_pool_size() -> int:
+    return client.options.pool_options.max_pool_size
+
+# Readiness: the load balancer sends traffic only to workers that reach the
+# database within READY_TIMEOUT_SECONDS and whose connection pool is not
+# saturated past READY_MAX_POOL_SATURATION (above 1, requests queue for a
+# connection)
+READY_TIMEOUT_SECONDS = float(os.environ.get('READY_TIMEOUT_SECONDS', '1'))
+READY_MAX_POOL_SATURATION = float(os.environ.get('READY_MAX_POOL_SATURATION', '1'))
+
+@app.get("/ready", include_in_schema=False)
+async def get_readiness():
+    """Database round-trip time and pool usage; 503 when not ready."""
+    pool = pool_monitor.snapshot(max_pool_size())
+    try:
+        round_trip = await asyncio.wait_for(storage.ping(), READY_TIMEOUT_SECONDS)
+    except (PyMongoError, asyncio.TimeoutError) as exc:
+        logger.warning("Readiness check failed: %r", exc)
+        return JSONResponse(status_code=503, content={"ready": False, "database_rtt_ms": None, "pool": pool})
+    ready = pool["saturation"] <= READY_MAX_POOL_SATURATION
+    return JSONResponse(status_code=200 if ready else 503,
+                        content={"ready": ready, "database_rtt_ms": round(round_trip * 1000, 3), "pool": pool})
+
+app.add_middleware(AdmissionMiddleware, limiters=admission_limiters)
+
+app.add_middleware(MetricsMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -141,7 +1118,3 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
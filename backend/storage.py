@@ -0,0 +1,1912 @@
+"""Storage engines behind the API routes.
+
+Routes talk to a ``Storage`` instead of to Motor collections. It holds a
+message and a delivery repository, and for each an archive that tiering.py
+moves cold documents into. ``MongoStorage`` is the production engine.
+``MemoryStorage`` keeps everything in process, with in-memory indexes for
+the same query patterns, so the app can be load tested without a MongoDB
+server. Both engines must agree on ordering, filtering and the
+active-customers view; tests/test_storage_conformance.py runs the same
+checks against each.
+
+Delivery status changes are also recorded as events, which keep per-driver
+hourly and daily rollups current for the analytics routes.
+
+Repositories deal in plain documents. Page positions are ``(value, id)``
+tuples of the repository's order field; the routes turn them into cursors.
+"""
+import asyncio
+import re
+import time
+import uuid
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import numpy as np
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, TEXT, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+# Delivery statuses that still need the driver's attention
+ACTIVE_STATUSES = ["pending", "in_progress"]
+
+# Delivery state machine: the statuses a delivery may move to each status from
+PREVIOUS_STATUSES = {
+    "in_progress": ["pending"],
+    "delivered": ["in_progress"],
+}
+
+# Radius MongoDB uses for spherical distances on GeoJSON points
+EARTH_RADIUS_M = 6378100.0
+
+# Fields text search looks in, with the weight of a match in each
+MESSAGE_TEXT_WEIGHTS = {"text": 1}
+DELIVERY_TEXT_WEIGHTS = {"order_details": 1, "address": 1}
+
+
+def geo_point(latitude: float, longitude: float) -> dict:
+    """GeoJSON point; note GeoJSON orders coordinates as [longitude, latitude]."""
+    return {"type": "Point", "coordinates": [longitude, latitude]}
+
+
+def active_customer_entry(delivery: dict) -> dict:
+    """A customer's entry in the active-customers view, from their latest open delivery."""
+    return {
+        "customer_name": delivery["customer_name"],
+        "customer_phone": delivery["customer_phone"],
+        "latest_order": delivery["order_details"],
+        "delivery_id": delivery["id"],
+        "created_at": delivery["created_at"],
+    }
+
+
+def plan_transitions(changes: List[Tuple[str, str]], current: Dict[str, dict]) -> Tuple[List[dict], List[dict]]:
+    """Check (delivery_id, status) changes against the state machine, given the
+    deliveries' `current` documents by id. Returns a result per change and the
+    results of the changes to attempt; the engine writes each of those only if
+    the delivery still has `previous_status`, then sets `applied`."""
+    results, planned, seen = [], [], set()
+    for delivery_id, status in changes:
+        doc = current.get(delivery_id)
+        result = {
+            "delivery_id": delivery_id,
+            "status": status,
+            "matched": doc is not None,
+            "applied": False,
+            "previous_status": doc["status"] if doc else None,
+            "detail": None,
+        }
+        if delivery_id in seen:
+            result["detail"] = "Duplicate delivery_id in batch"
+        elif doc is None:
+            result["detail"] = "Delivery not found"
+        elif doc["driver_id"] is None:
+            result["detail"] = "Delivery is not assigned to a driver"
+        elif doc["status"] not in PREVIOUS_STATUSES.get(status, ()):
+            result["detail"] = f"Cannot move from {doc['status']} to {status}"
+        else:
+            result.update(driver_id=doc["driver_id"], customer_name=doc["customer_name"],
+                          created_at=doc["created_at"])
+            planned.append(result)
+        seen.add(delivery_id)
+        results.append(result)
+    return results, planned
+
+
+# Status-change events and rollups
+
+ROLLUP_GRANULARITIES = ("hour", "day")
+
+
+def status_event(result: dict) -> dict:
+    """The event for an applied transition result. A delivery reaches each status
+    at most once, so (delivery, status) identifies the event."""
+    return {
+        "id": f"{result['delivery_id']}:{result['status']}",
+        "delivery_id": result["delivery_id"],
+        "driver_id": result["driver_id"],
+        "previous_status": result["previous_status"],
+        "status": result["status"],
+        "changed_at": result["changed_at"],
+        "created_at": result["created_at"],
+    }
+
+
+def period_start(moment: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rollup_keys(event: dict) -> List[Tuple[str, str, datetime]]:
+    """The (driver_id, granularity, period) rollups `event` counts in."""
+    return [(event["driver_id"], granularity, period_start(event["changed_at"], granularity))
+            for granularity in ROLLUP_GRANULARITIES]
+
+
+def empty_rollup() -> dict:
+    return {"started": 0, "delivered": 0, "delivery_seconds_total": 0.0, "delivery_seconds_max": 0.0}
+
+
+def rollup_increments(events, increments: Optional[dict] = None) -> Dict[Tuple[str, str, datetime], dict]:
+    """What `events` add to each (driver_id, granularity, period) rollup: deliveries
+    started and delivered, and the total and longest pending-to-delivered time.
+    Added to `increments` when given."""
+    increments = {} if increments is None else increments
+    for event in events:
+        for key in rollup_keys(event):
+            bucket = increments.setdefault(key, empty_rollup())
+            if event["status"] == "in_progress":
+                bucket["started"] += 1
+            elif event["status"] == "delivered":
+                seconds = (event["changed_at"] - event["created_at"]).total_seconds()
+                bucket["delivered"] += 1
+                bucket["delivery_seconds_total"] += seconds
+                bucket["delivery_seconds_max"] = max(bucket["delivery_seconds_max"], seconds)
+    return increments
+
+
+def _view_key(customers: list) -> list:
+    return sorted((entry["customer_name"], entry["delivery_id"]) for entry in customers)
+
+
+def _compare_views(actual: Dict[str, list], expected: Dict[str, list]) -> List[str]:
+    """Driver ids whose view entries differ from the expected entries."""
+    drivers = set(actual) | set(expected)
+    return sorted(
+        driver_id for driver_id in drivers
+        if _view_key(actual.get(driver_id, [])) != _view_key(expected.get(driver_id, []))
+    )
+
+
+class VersionCounter(ABC):
+    """Per-driver change sequence shared by messages and deliveries.
+
+    Every write takes the next version of its driver, so one number tells a
+    client which of the driver's documents it has already seen.
+    """
+
+    @abstractmethod
+    async def reserve(self, driver_id: str, count: int = 1) -> int:
+        """Take `count` consecutive versions. Returns the first."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def latest(self, driver_id: str) -> Tuple[int, Optional[datetime]]:
+        """The driver's last reserved version and when it was reserved; (0, None) if none."""
+        raise NotImplementedError
+
+    async def ensure_indexes(self):
+        pass
+
+
+async def stamp(versions: VersionCounter, docs: List[dict]):
+    """Set `version` and `changed_at` on each of `docs` before they are written.
+    Documents without a driver are in no driver's sync: they take version 0
+    rather than reserving one."""
+    by_driver: Dict[str, List[dict]] = defaultdict(list)
+    changed_at = datetime.utcnow()
+    for doc in docs:
+        if doc["driver_id"] is None:
+            doc["version"], doc["changed_at"] = 0, changed_at
+        else:
+            by_driver[doc["driver_id"]].append(doc)
+    for driver_id, driver_docs in by_driver.items():
+        first = await versions.reserve(driver_id, len(driver_docs))
+        for offset, doc in enumerate(driver_docs):
+            doc["version"] = first + offset
+            doc["changed_at"] = changed_at
+
+
+class MessageRepository(ABC):
+    order_field = "timestamp"
+    order = ASCENDING
+
+    async def ensure_indexes(self):
+        pass
+
+    @abstractmethod
+    async def insert(self, doc: dict):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def page(self, filters: dict, limit: int, after: Optional[Tuple] = None,
+                   before: Optional[Tuple] = None, fields: Optional[List[str]] = None) -> Tuple[List[dict], bool]:
+        """Up to `limit` documents matching the equality `filters`, in (order_field, id)
+        order, strictly after `after` or strictly before `before`, plus whether more
+        documents exist in the direction read."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def stream(self, filters: dict, start: Optional[datetime], end: Optional[datetime], batch_size: int,
+               fields: Optional[List[str]] = None) -> AsyncIterator[dict]:
+        """Every document matching `filters` with start <= order_field < end (either
+        bound may be None), in ascending (order_field, id) order, read from storage
+        `batch_size` documents at a time."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def search(self, text: str, filters: dict, start: Optional[datetime], end: Optional[datetime],
+                     limit: int, after: Optional[Tuple] = None, fields: Optional[List[str]] = None,
+                     max_time_ms: Optional[int] = None) -> Tuple[List[dict], bool]:
+        """Up to `limit` documents matching the text search `text` and the equality
+        `filters`, which must include `driver_id`, with start <= order_field < end, best match first: in (score desc,
+        id) order, strictly after the (score, id) position `after`. Each carries its
+        `score`; plus whether more documents match.
+
+        `text` has MongoDB $text syntax: words match any of them, "quoted phrases"
+        must all appear and -words must not."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def changes(self, driver_id: str, since: int, limit: int) -> List[dict]:
+        """Up to `limit` of the driver's documents written after version `since`, in version order."""
+        raise NotImplementedError
+
+    # Inbox: a driver's conversations with their latest message and the number
+    # of customer messages after the driver's read marker. The latest message
+    # of each conversation is kept as messages are inserted.
+
+    @abstractmethod
+    async def inbox(self, driver_id: str) -> List[dict]:
+        """{customer_name, last_message, unread_count} per conversation, most recent first."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def rebuild_conversations(self) -> int:
+        """Recompute every conversation's latest message from the messages. Returns
+        the number of conversations."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def mark_read(self, driver_id: str, customer_name: str, read_at: datetime) -> datetime:
+        """Move the read marker forward to `read_at`. Returns the marker's position."""
+        raise NotImplementedError
+
+    # Tiering: messages older than a cutoff are cold
+
+    @abstractmethod
+    async def cold_batch(self, cutoff: datetime, limit: int) -> List[dict]:
+        """Up to `limit` cold documents, oldest first, exactly as stored."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_cold(self, ids: List[str], cutoff: datetime) -> int:
+        """Delete the documents among `ids` that are still cold."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def present(self, ids: List[str]) -> List[str]:
+        """The ids among `ids` that are stored."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def count(self) -> int:
+        raise NotImplementedError
+
+
+class DeliveryRepository(ABC):
+    order_field = "created_at"
+    order = DESCENDING
+
+    async def ensure_indexes(self):
+        pass
+
+    @abstractmethod
+    async def insert(self, doc: dict):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def insert_many(self, docs: List[dict]) -> Dict[int, Tuple[int, str]]:
+        """Unordered insert. Returns (error code, message) per failed position;
+        documents whose id is already stored fail with DUPLICATE_KEY."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def page(self, filters: dict, limit: int, after: Optional[Tuple] = None,
+                   before: Optional[Tuple] = None, fields: Optional[List[str]] = None) -> Tuple[List[dict], bool]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def stream(self, filters: dict, start: Optional[datetime], end: Optional[datetime], batch_size: int,
+               fields: Optional[List[str]] = None) -> AsyncIterator[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def search(self, text: str, filters: dict, start: Optional[datetime], end: Optional[datetime],
+                     limit: int, after: Optional[Tuple] = None, fields: Optional[List[str]] = None,
+                     max_time_ms: Optional[int] = None) -> Tuple[List[dict], bool]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def apply_transitions(self, changes: List[Tuple[str, str]]) -> List[dict]:
+        """Apply (delivery_id, status) changes the state machine allows, all at once.
+        Returns a result per change, see plan_transitions; applied changes also carry
+        the delivery's driver_id, customer_name and created_at, and their changed_at.
+        Each applied change queues its status_event with the delivery, in the same write."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def unrecorded_events(self, limit: int) -> List[dict]:
+        """Up to `limit` queued status events, not yet marked recorded."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def mark_recorded(self, events: List[dict]):
+        """Drop `events` from their deliveries' queues."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def changes(self, driver_id: str, since: int, limit: int) -> List[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def open_deliveries(self, driver_id: str, limit: int) -> List[dict]:
+        """Up to `limit` of the driver's open deliveries, oldest first by (created_at, id)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def nearby(self, latitude: float, longitude: float, max_distance_m: float,
+                     filters: dict, limit: int) -> List[dict]:
+        """Deliveries within `max_distance_m`, nearest first, with `distance_m` set."""
+        raise NotImplementedError
+
+    # Dispatch: deliveries created without a driver wait, pending, until assigned
+
+    @abstractmethod
+    async def unassigned(self, limit: int) -> List[dict]:
+        """Up to `limit` deliveries without a driver, oldest first."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def assign_drivers(self, assignments: List[Tuple[str, str]]) -> List[str]:
+        """Give each (delivery_id, driver_id) delivery its driver, all at once, if it
+        has none yet. Returns the ids assigned; the others were assigned concurrently."""
+        raise NotImplementedError
+
+    async def backfill_locations(self) -> int:
+        return 0
+
+    # Active-customers view: one entry per customer with an open delivery,
+    # taken from their most recent open delivery
+
+    @abstractmethod
+    async def active_customers(self, driver_id: str) -> List[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def merge_active_customers(self, docs: List[dict]):
+        """Account for newly created open deliveries."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def refresh_active_customer(self, driver_id: str, customer_name: str):
+        """Recompute one customer's entry after one of their deliveries changed status."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def rebuild_active_customers(self) -> int:
+        """Recompute the whole view from deliveries. Returns the number of drivers."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def check_active_customers(self) -> List[str]:
+        """Driver ids whose view disagrees with a fresh computation from deliveries."""
+        raise NotImplementedError
+
+    # Tiering: delivered deliveries created before a cutoff are cold, once
+    # their status events are recorded. Same contract as on MessageRepository.
+
+    @abstractmethod
+    async def cold_batch(self, cutoff: datetime, limit: int) -> List[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_cold(self, ids: List[str], cutoff: datetime) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def present(self, ids: List[str]) -> List[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def count(self) -> int:
+        raise NotImplementedError
+
+
+class ArchiveRepository(ABC):
+    """Cold documents moved out of a hot collection; read by the history routes."""
+
+    def __init__(self, order_field: str, order: int):
+        self.order_field = order_field
+        self.order = order
+
+    async def ensure_indexes(self):
+        pass
+
+    @abstractmethod
+    async def insert_many(self, docs: List[dict]) -> Dict[int, Tuple[int, str]]:
+        """Unordered insert. Returns (error code, message) per failed position;
+        documents whose id is already stored fail with DUPLICATE_KEY."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete(self, ids: List[str]):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def page(self, filters: dict, limit: int, after: Optional[Tuple] = None,
+                   before: Optional[Tuple] = None, fields: Optional[List[str]] = None) -> Tuple[List[dict], bool]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def stream(self, filters: dict, start: Optional[datetime], end: Optional[datetime], batch_size: int,
+               fields: Optional[List[str]] = None) -> AsyncIterator[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def search(self, text: str, filters: dict, start: Optional[datetime], end: Optional[datetime],
+                     limit: int, after: Optional[Tuple] = None, fields: Optional[List[str]] = None,
+                     max_time_ms: Optional[int] = None) -> Tuple[List[dict], bool]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def count(self) -> int:
+        raise NotImplementedError
+
+
+class StatusEventRepository(ABC):
+    """Delivery status-change events, and per-driver rollups of them by hour and
+    by day that are updated as events are recorded."""
+
+    async def ensure_indexes(self):
+        pass
+
+    @abstractmethod
+    async def record(self, events: List[dict]) -> int:
+        """Store `events` and add them to the rollups. Events already stored are
+        not stored again, and each event is counted in the rollups at most once
+        however often it is recorded, so recording again after a failure to store
+        completes the rollups. Returns the number newly stored."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def rollups(self, granularity: str, filters: dict, start: Optional[datetime],
+                      end: Optional[datetime], limit: int) -> List[dict]:
+        """Up to `limit` rollups of `granularity` matching the equality `filters`
+        with start <= period < end, in (period, driver_id) order."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def rebuild_rollups(self) -> int:
+        """Recompute every rollup from the events. Returns the number of rollups."""
+        raise NotImplementedError
+
+
+class Storage:
+    def __init__(self, versions: VersionCounter, messages: MessageRepository, deliveries: DeliveryRepository,
+                 messages_archive: ArchiveRepository, deliveries_archive: ArchiveRepository,
+                 status_events: StatusEventRepository):
+        self.versions = versions
+        self.messages = messages
+        self.deliveries = deliveries
+        self.messages_archive = messages_archive
+        self.deliveries_archive = deliveries_archive
+        self.status_events = status_events
+
+    async def ensure_indexes(self):
+        await self.versions.ensure_indexes()
+        await self.messages.ensure_indexes()
+        await self.deliveries.ensure_indexes()
+        await self.messages_archive.ensure_indexes()
+        await self.deliveries_archive.ensure_indexes()
+        await self.status_events.ensure_indexes()
+
+    async def ping(self) -> float:
+        """Round-trip time to the database, in seconds."""
+        return 0.0
+
+    async def warm_up(self, connections: int):
+        """Open up to `connections` connections so early requests do not pay for them."""
+
+
+# MongoDB engine
+
+# Write error code of an insert whose unique key is already stored
+DUPLICATE_KEY = 11000
+
+# Stored fields that are not part of the documents the repositories return
+HIDDEN_FIELDS = {"_id": 0, "location": 0, "unrecorded_events": 0}
+
+def text_index(weights: Dict[str, int]) -> IndexModel:
+    """The collection's text index over the `weights` fields, per driver: every
+    search names a driver, so it reads only that driver's entries for its words.
+    With no language, words match as written, without stemming or stop words."""
+    return IndexModel([("driver_id", ASCENDING), *((name, TEXT) for name in weights)], name="driver_text_search",
+                      weights=weights, default_language="none")
+
+
+# Indexes superseded by the ones below; a collection holds one text index, so
+# the old one must go before its replacement is built
+REPLACED_INDEXES = ["text_search", "driver_active_status"]
+
+
+async def create_indexes(collection, indexes: List[IndexModel]):
+    existing = await collection.index_information()
+    for name in REPLACED_INDEXES:
+        if name in existing:
+            await collection.drop_index(name)
+    await collection.create_indexes(indexes)
+
+
+# Indexes backing every query pattern used by the routes
+MESSAGE_INDEXES = [
+    IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    # get_driver_messages: {driver_id} paged by (timestamp, id)
+    IndexModel(
+        [("driver_id", ASCENDING), ("timestamp", ASCENDING), ("id", ASCENDING)],
+        name="driver_timestamp_id",
+    ),
+    # get_conversation: {driver_id, customer_name} paged by (timestamp, id);
+    # rebuild_conversations: the latest message per conversation
+    IndexModel(
+        [("driver_id", ASCENDING), ("customer_name", ASCENDING), ("timestamp", ASCENDING), ("id", ASCENDING)],
+        name="driver_customer_timestamp_id",
+    ),
+    # Tiering: oldest messages first
+    IndexModel([("timestamp", ASCENDING), ("id", ASCENDING)], name="timestamp_id"),
+    # sync_driver: the driver's messages after a version
+    IndexModel([("driver_id", ASCENDING), ("version", ASCENDING)], name="driver_version"),
+    # get_inbox: customer messages after the read marker, counted per conversation
+    IndexModel(
+        [("driver_id", ASCENDING), ("customer_name", ASCENDING), ("sender", ASCENDING), ("timestamp", ASCENDING)],
+        name="driver_customer_sender_timestamp",
+    ),
+    # search_messages
+    text_index(MESSAGE_TEXT_WEIGHTS),
+]
+
+SYNC_VERSION_INDEXES = [
+    IndexModel([("driver_id", ASCENDING)], name="driver_unique", unique=True),
+]
+
+READ_MARKER_INDEXES = [
+    IndexModel([("driver_id", ASCENDING), ("customer_name", ASCENDING)], name="driver_customer_unique", unique=True),
+]
+
+CONVERSATION_INDEXES = [
+    IndexModel([("driver_id", ASCENDING), ("customer_name", ASCENDING)], name="driver_customer_unique", unique=True),
+    # get_inbox: a driver's conversations, most recent first
+    IndexModel(
+        [("driver_id", ASCENDING), ("last_message.timestamp", DESCENDING), ("customer_name", ASCENDING)],
+        name="driver_last_message",
+    ),
+    # Tiering: conversations whose last message was archived
+    IndexModel([("last_message.id", ASCENDING)], name="last_message_id"),
+]
+
+DELIVERY_INDEXES = [
+    # update_delivery_status: lookup by the string id
+    IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    # get_driver_deliveries: {driver_id} paged by (created_at, id) desc;
+    # dispatch_deliveries: {driver_id: null} oldest first
+    IndexModel(
+        [("driver_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+        name="driver_created_at_id",
+    ),
+    # sync_driver: the driver's deliveries after a version
+    IndexModel([("driver_id", ASCENDING), ("version", ASCENDING)], name="driver_version"),
+    # get_driver_route: {driver_id, status in ACTIVE_STATUSES} by (created_at, id); only
+    # open deliveries are indexed
+    IndexModel(
+        [("driver_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)],
+        name="driver_active_created_at_id",
+        partialFilterExpression={"status": {"$in": ACTIVE_STATUSES}},
+    ),
+    # Active-customers view: latest open delivery per (driver_id, customer_name)
+    IndexModel(
+        [("driver_id", ASCENDING), ("customer_name", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+        name="driver_customer_active_latest",
+        partialFilterExpression={"status": {"$in": ACTIVE_STATUSES}},
+    ),
+    # get_nearby_deliveries: $geoNear on the GeoJSON point, filtered by status/driver
+    IndexModel(
+        [("location", GEOSPHERE), ("status", ASCENDING), ("driver_id", ASCENDING)],
+        name="location_status_driver",
+    ),
+    # Tiering: oldest delivered deliveries first
+    IndexModel(
+        [("created_at", ASCENDING), ("id", ASCENDING)],
+        name="delivered_created_at_id",
+        partialFilterExpression={"status": "delivered"},
+    ),
+    # Status events queued by apply_transitions; only deliveries with some are indexed
+    IndexModel(
+        [("unrecorded_events.id", ASCENDING)],
+        name="unrecorded_events",
+        partialFilterExpression={"unrecorded_events.id": {"$exists": True}},
+    ),
+    # search_deliveries
+    text_index(DELIVERY_TEXT_WEIGHTS),
+]
+
+# Archives serve the history routes: one driver's (or conversation's) documents in order
+MESSAGE_ARCHIVE_INDEXES = [
+    IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    IndexModel([("driver_id", ASCENDING), ("timestamp", ASCENDING), ("id", ASCENDING)], name="driver_timestamp_id"),
+    IndexModel(
+        [("driver_id", ASCENDING), ("customer_name", ASCENDING), ("timestamp", ASCENDING), ("id", ASCENDING)],
+        name="driver_customer_timestamp_id",
+    ),
+    text_index(MESSAGE_TEXT_WEIGHTS),
+]
+
+DELIVERY_ARCHIVE_INDEXES = [
+    IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    IndexModel(
+        [("driver_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+        name="driver_created_at_id",
+    ),
+    text_index(DELIVERY_TEXT_WEIGHTS),
+]
+
+STATUS_EVENT_INDEXES = [
+    IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+]
+
+ROLLUP_INDEXES = [
+    # get_driver_analytics: one driver's rollups in period order
+    IndexModel([("driver_id", ASCENDING), ("granularity", ASCENDING), ("period", ASCENDING)],
+               name="driver_granularity_period_unique", unique=True),
+    # get_fleet_analytics: every driver's rollups in period order
+    IndexModel([("granularity", ASCENDING), ("period", ASCENDING), ("driver_id", ASCENDING)],
+               name="granularity_period_driver"),
+]
+
+ACTIVE_CUSTOMER_INDEXES = [
+    # get_active_customers: one document per driver
+    IndexModel([("driver_id", ASCENDING)], name="driver_unique", unique=True),
+]
+
+
+# Query shapes the repositories issue, as (filter, sort, limit) or pipelines;
+# tests/test_indexes.py explains these same shapes
+
+def page_query(query: dict, field: str, direction: int, limit: int, after: Optional[Tuple] = None,
+               before: Optional[Tuple] = None) -> Tuple[dict, list, int]:
+    """Keyset page: seeks to the position through the (..., field, id) index, so
+    every page costs the same regardless of depth. Reads one more than `limit`
+    to tell whether more follow; a page `before` a position reads backwards."""
+    scan = -direction if before is not None else direction
+    position = after or before
+    if position:
+        value, doc_id = position
+        strict, inclusive = ("$gt", "$gte") if scan == ASCENDING else ("$lt", "$lte")
+        query = {
+            **query,
+            field: {inclusive: value},
+            "$or": [{field: {strict: value}}, {"id": {strict: doc_id}}],
+        }
+    return query, [(field, scan), ("id", scan)], limit + 1
+
+
+def _in_range(query: dict, field: str, start: Optional[datetime], end: Optional[datetime]) -> dict:
+    bounds = {**({"$gte": start} if start else {}), **({"$lt": end} if end else {})}
+    return {**query, field: bounds} if bounds else query
+
+
+def search_pipeline(text: str, query: dict, field: str, start: Optional[datetime], end: Optional[datetime],
+                    limit: int, after: Optional[Tuple] = None, fields: Optional[List[str]] = None) -> list:
+    """Text search through the collection's (driver_id, text) index, ranked by
+    textScore. Every page scores all of the driver's matching documents, so the
+    cost follows how common the words are for that driver; the time range only
+    filters those matches. Reads one more than `limit`."""
+    pipeline = [
+        {"$match": _in_range({**query, "$text": {"$search": text}}, field, start, end)},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+    ]
+    if after:
+        score, doc_id = after
+        pipeline.append({"$match": {"$or": [{"score": {"$lt": score}}, {"score": score, "id": {"$gt": doc_id}}]}})
+    projection = {"_id": 0, **{name: 1 for name in fields}, "score": 1} if fields else HIDDEN_FIELDS
+    return pipeline + [{"$sort": {"score": -1, "id": 1}}, {"$limit": limit + 1}, {"$project": projection}]
+
+
+def changes_query(driver_id: str, since: int, limit: int) -> Tuple[dict, list, int]:
+    return {"driver_id": driver_id, "version": {"$gt": since}}, [("version", ASCENDING)], limit
+
+
+def open_deliveries_query(driver_id: str, limit: int) -> Tuple[dict, list, int]:
+    return ({"driver_id": driver_id, "status": {"$in": ACTIVE_STATUSES}},
+            [("created_at", ASCENDING), ("id", ASCENDING)], limit)
+
+
+def latest_open_query(driver_id: str, customer_name: str) -> Tuple[dict, list, int]:
+    return ({"driver_id": driver_id, "customer_name": customer_name, "status": {"$in": ACTIVE_STATUSES}},
+            [("created_at", DESCENDING), ("id", DESCENDING)], 1)
+
+
+def cold_messages_query(cutoff: datetime, limit: int) -> Tuple[dict, list, int]:
+    return {"timestamp": {"$lt": cutoff}}, [("timestamp", ASCENDING), ("id", ASCENDING)], limit
+
+
+def cold_deliveries_query(cutoff: datetime, limit: int) -> Tuple[dict, list, int]:
+    """Delivered deliveries created before `cutoff` whose status events are all recorded."""
+    return ({"status": "delivered", "created_at": {"$lt": cutoff}, "unrecorded_events.id": {"$exists": False}},
+            [("created_at", ASCENDING), ("id", ASCENDING)], limit)
+
+
+def rollups_query(granularity: str, filters: dict, start: Optional[datetime], end: Optional[datetime],
+                  limit: int) -> Tuple[dict, list, int]:
+    query = _in_range({**filters, "granularity": granularity}, "period", start, end)
+    # One driver's rollups already come in period order from its index
+    order = [("period", ASCENDING)] + ([] if "driver_id" in filters else [("driver_id", ASCENDING)])
+    return query, order, limit
+
+
+def _find(collection, shape: Tuple[dict, list, int], projection: Optional[dict] = None, **options):
+    query, order, limit = shape
+    return collection.find(query, projection, **options).sort(order).limit(limit)
+
+
+async def _mongo_page(collection, query: dict, field: str, direction: int, limit: int,
+                      after: Optional[Tuple], before: Optional[Tuple], fields: Optional[List[str]]):
+    projection = {"_id": 0, **{name: 1 for name in fields}} if fields else None
+    docs = await _find(collection, page_query(query, field, direction, limit, after, before), projection).to_list(None)
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    if before is not None:
+        docs.reverse()
+    return docs, has_more
+
+
+async def _mongo_search(collection, text: str, query: dict, field: str, start: Optional[datetime],
+                        end: Optional[datetime], limit: int, after: Optional[Tuple], fields: Optional[List[str]],
+                        max_time_ms: Optional[int]) -> Tuple[List[dict], bool]:
+    """search_pipeline, within `max_time_ms`."""
+    options = {"maxTimeMS": max_time_ms} if max_time_ms else {}
+    pipeline = search_pipeline(text, query, field, start, end, limit, after, fields)
+    docs = await collection.aggregate(pipeline, **options).to_list(limit + 1)
+    return docs[:limit], len(docs) > limit
+
+
+async def _mongo_stream(collection, query: dict, field: str, start: Optional[datetime], end: Optional[datetime],
+                        batch_size: int, fields: Optional[List[str]]) -> AsyncIterator[dict]:
+    """Iterate a cursor over the (..., field, id) index; the driver fetches one
+    batch at a time, so memory does not grow with the size of the result."""
+    query = _in_range(query, field, start, end)
+    projection = {"_id": 0, **{name: 1 for name in fields}} if fields else HIDDEN_FIELDS
+    cursor = collection.find(query, projection, batch_size=batch_size).sort([(field, ASCENDING), ("id", ASCENDING)])
+    async for doc in cursor:
+        yield doc
+
+
+class MongoVersionCounter(VersionCounter):
+    def __init__(self, database):
+        self.collection = database.sync_versions
+
+    async def ensure_indexes(self):
+        await self.collection.create_indexes(SYNC_VERSION_INDEXES)
+
+    async def reserve(self, driver_id, count=1):
+        counter = await self.collection.find_one_and_update(
+            {"driver_id": driver_id},
+            {"$inc": {"version": count}, "$set": {"changed_at": datetime.utcnow()}},
+            projection={"_id": 0, "version": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return counter["version"] - count + 1
+
+    async def latest(self, driver_id):
+        counter = await self.collection.find_one({"driver_id": driver_id}, {"_id": 0, "version": 1, "changed_at": 1})
+        return (counter["version"], counter["changed_at"]) if counter else (0, None)
+
+
+async def _mongo_changes(collection, driver_id: str, since: int, limit: int) -> List[dict]:
+    return await _find(collection, changes_query(driver_id, since, limit), HIDDEN_FIELDS).to_list(None)
+
+
+async def _written(collection, versions: Dict[str, int]) -> set:
+    """Ids of the documents still at the version given for them. After a bulk of
+    conditional updates, the others lost a race with another writer."""
+    return {
+        doc["id"] async for doc in collection.find(
+            {"id": {"$in": list(versions)}}, {"_id": 0, "id": 1, "version": 1})
+        if doc.get("version") == versions[doc["id"]]
+    }
+
+
+def _write_errors(exc: BulkWriteError) -> Dict[int, Tuple[int, str]]:
+    return {error["index"]: (error["code"], error["errmsg"]) for error in exc.details["writeErrors"]}
+
+
+async def _present(collection, ids: List[str]) -> List[str]:
+    return [doc["id"] async for doc in collection.find({"id": {"$in": ids}}, {"_id": 0, "id": 1})]
+
+
+# Unread counts start from the beginning of a conversation without a marker
+NEVER_READ = datetime(1970, 1, 1)
+
+
+def inbox_query(driver_id: str) -> Tuple[dict, list]:
+    """Filter and sort reading a driver's conversations, most recent first, from
+    driver_last_message: one index key per conversation."""
+    return {"driver_id": driver_id}, [("last_message.timestamp", DESCENDING), ("customer_name", ASCENDING)]
+
+
+def conversations_pipeline() -> list:
+    """Aggregation over all messages computing the conversation documents: the
+    latest message per (driver_id, customer_name)."""
+    return [
+        {"$sort": {"driver_id": DESCENDING, "customer_name": DESCENDING, "timestamp": DESCENDING, "id": DESCENDING}},
+        {"$group": {"_id": {"driver_id": "$driver_id", "customer_name": "$customer_name"},
+                    "last_message": {"$first": "$$ROOT"}}},
+        {"$project": {"_id": 0, "driver_id": "$_id.driver_id", "customer_name": "$_id.customer_name",
+                      "last_message": 1}},
+        {"$unset": "last_message._id"},
+    ]
+
+
+def merge_last_message(message: dict) -> list:
+    """Conversation update for an inserted message: it becomes the last message
+    unless the conversation already holds a more recent one."""
+    timestamp, message_id = {"$literal": message["timestamp"]}, {"$literal": message["id"]}
+    current_is_newer = {"$or": [
+        {"$gt": ["$last_message.timestamp", timestamp]},
+        {"$and": [{"$eq": ["$last_message.timestamp", timestamp]}, {"$gt": ["$last_message.id", message_id]}]},
+    ]}
+    last_message = {key: value for key, value in message.items() if key != "_id"}
+    return [{"$set": {"last_message": {"$cond": [current_is_newer, "$last_message", {"$literal": last_message}]}}}]
+
+
+def unread_pipeline(driver_id: str, read_at: Dict[str, datetime]) -> list:
+    """Aggregation over messages counting, per conversation, the customer messages
+    after its read marker `read_at[customer_name]`. Every branch of the $or is a
+    range on driver_customer_sender_timestamp, so only unread messages are read."""
+    return [
+        {"$match": {"$or": [
+            {"driver_id": driver_id, "customer_name": customer_name, "sender": "customer", "timestamp": {"$gt": at}}
+            for customer_name, at in read_at.items()
+        ]}},
+        {"$group": {"_id": "$customer_name", "count": {"$sum": 1}}},
+    ]
+
+
+class MongoMessageRepository(MessageRepository):
+    def __init__(self, database, versions: VersionCounter):
+        self.collection = database.messages
+        self.read_markers = database.read_markers
+        self.conversations = database.conversations
+        self.versions = versions
+
+    async def ensure_indexes(self):
+        await create_indexes(self.collection, MESSAGE_INDEXES)
+        await self.read_markers.create_indexes(READ_MARKER_INDEXES)
+        await self.conversations.create_indexes(CONVERSATION_INDEXES)
+
+    async def insert(self, doc: dict):
+        await stamp(self.versions, [doc])
+        await self.collection.insert_one(doc)
+        await self.conversations.update_one(
+            {"driver_id": doc["driver_id"], "customer_name": doc["customer_name"]}, merge_last_message(doc),
+            upsert=True,
+        )
+
+    async def page(self, filters, limit, after=None, before=None, fields=None):
+        return await _mongo_page(self.collection, filters, self.order_field, self.order, limit, after, before, fields)
+
+    def stream(self, filters, start, end, batch_size, fields=None):
+        return _mongo_stream(self.collection, filters, self.order_field, start, end, batch_size, fields)
+
+    async def search(self, text, filters, start, end, limit, after=None, fields=None, max_time_ms=None):
+        return await _mongo_search(self.collection, text, filters, self.order_field, start, end, limit, after,
+                                   fields, max_time_ms)
+
+    async def changes(self, driver_id, since, limit):
+        return await _mongo_changes(self.collection, driver_id, since, limit)
+
+    async def inbox(self, driver_id):
+        query, order = inbox_query(driver_id)
+        conversations = await self.conversations.find(
+            query, {"_id": 0, "customer_name": 1, "last_message": 1}).sort(order).to_list(None)
+        if not conversations:
+            return []
+        markers = {doc["customer_name"]: doc["read_at"] async for doc in self.read_markers.find(
+            {"driver_id": driver_id}, {"_id": 0, "customer_name": 1, "read_at": 1})}
+        read_at = {c["customer_name"]: markers.get(c["customer_name"], NEVER_READ) for c in conversations}
+        unread = {doc["_id"]: doc["count"] async for doc in self.collection.aggregate(
+            unread_pipeline(driver_id, read_at))}
+        return [{**c, "unread_count": unread.get(c["customer_name"], 0)} for c in conversations]
+
+    async def rebuild_conversations(self):
+        # $out swaps the collection in one step; messages inserted during the
+        # rebuild may be missing until their conversation's next message
+        await self.collection.aggregate(conversations_pipeline() + [{"$out": self.conversations.name}]).to_list(None)
+        await self.conversations.create_indexes(CONVERSATION_INDEXES)
+        return await self.conversations.count_documents({})
+
+    async def mark_read(self, driver_id, customer_name, read_at):
+        marker = await self.read_markers.find_one_and_update(
+            {"driver_id": driver_id, "customer_name": customer_name},
+            {"$max": {"read_at": read_at}},
+            projection={"_id": 0, "read_at": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return marker["read_at"]
+
+    async def cold_batch(self, cutoff, limit):
+        return await _find(self.collection, cold_messages_query(cutoff, limit)).to_list(None)
+
+    async def delete_cold(self, ids, cutoff):
+        cold, _, _ = cold_messages_query(cutoff, len(ids))
+        result = await self.collection.delete_many({"id": {"$in": ids}, **cold})
+        # A conversation whose last message is cold has no hot messages left
+        await self.conversations.delete_many({"last_message.id": {"$in": ids}, "last_message.timestamp": {"$lt": cutoff}})
+        return result.deleted_count
+
+    async def present(self, ids):
+        return await _present(self.collection, ids)
+
+    async def count(self):
+        return await self.collection.estimated_document_count()
+
+
+# db.active_customers holds one document per driver:
+#   {driver_id, customers: [{customer_name, customer_phone, latest_order, delivery_id, created_at}]}
+# maintained with single-document pipeline updates.
+
+def _replace_customer(customer_name: str, replacement) -> list:
+    """Update pipeline swapping a customer's entry in the view for `replacement`,
+    an expression giving a list of zero or one entries. `$$current` holds the
+    existing entry (as a list) while it is evaluated."""
+    customers = {"$ifNull": ["$customers", []]}
+    name = {"$literal": customer_name}
+    return [{"$set": {"customers": {"$let": {
+        "vars": {"current": {"$filter": {"input": customers, "cond": {"$eq": ["$$this.customer_name", name]}}}},
+        "in": {"$concatArrays": [
+            {"$filter": {"input": customers, "cond": {"$ne": ["$$this.customer_name", name]}}},
+            replacement,
+        ]},
+    }}}}]
+
+
+def _unless_newer(entry: dict) -> dict:
+    """Replacement expression for _replace_customer: `entry`, unless the view's
+    current entry comes from a more recent delivery."""
+    created_at, delivery_id = {"$literal": entry["created_at"]}, {"$literal": entry["delivery_id"]}
+    current_is_newer = {"$anyElementTrue": [{"$map": {"input": "$$current", "in": {"$or": [
+        {"$gt": ["$$this.created_at", created_at]},
+        {"$and": [{"$eq": ["$$this.created_at", created_at]}, {"$gt": ["$$this.delivery_id", delivery_id]}]},
+    ]}}}]}
+    return {"$cond": [current_is_newer, "$$current", {"$literal": [entry]}]}
+
+
+def merge_active_customer(delivery: dict) -> UpdateOne:
+    """View update for a newly created open delivery: it becomes the customer's
+    entry unless the view already holds a more recent one."""
+    entry = active_customer_entry(delivery)
+    return UpdateOne(
+        {"driver_id": delivery["driver_id"]}, _replace_customer(entry["customer_name"], _unless_newer(entry)),
+        upsert=True,
+    )
+
+
+def active_customers_pipeline(match: dict) -> list:
+    """Aggregation computing view documents from the deliveries matching `match`."""
+    return [
+        {"$match": {**match, "status": {"$in": ACTIVE_STATUSES}, "driver_id": {"$ne": None}}},
+        {"$sort": {"driver_id": 1, "customer_name": 1, "created_at": -1, "id": -1}},
+        {"$group": {
+            "_id": {"driver_id": "$driver_id", "customer_name": "$customer_name"},
+            "customer_phone": {"$first": "$customer_phone"},
+            "latest_order": {"$first": "$order_details"},
+            "delivery_id": {"$first": "$id"},
+            "created_at": {"$first": "$created_at"},
+        }},
+        {"$group": {
+            "_id": "$_id.driver_id",
+            "customers": {"$push": {
+                "customer_name": "$_id.customer_name",
+                "customer_phone": "$customer_phone",
+                "latest_order": "$latest_order",
+                "delivery_id": "$delivery_id",
+                "created_at": "$created_at",
+            }},
+        }},
+        {"$project": {"_id": 0, "driver_id": "$_id", "customers": 1}},
+    ]
+
+
+class MongoDeliveryRepository(DeliveryRepository):
+    def __init__(self, database, versions: VersionCounter):
+        self.collection = database.deliveries
+        self.view = database.active_customers
+        self.versions = versions
+
+    async def ensure_indexes(self):
+        await create_indexes(self.collection, DELIVERY_INDEXES)
+        await self.view.create_indexes(ACTIVE_CUSTOMER_INDEXES)
+
+    async def insert(self, doc):
+        await stamp(self.versions, [doc])
+        await self.collection.insert_one(doc)
+
+    async def insert_many(self, docs):
+        await stamp(self.versions, docs)
+        try:
+            await self.collection.insert_many(docs, ordered=False)
+        except BulkWriteError as exc:
+            return _write_errors(exc)
+        return {}
+
+    async def page(self, filters, limit, after=None, before=None, fields=None):
+        return await _mongo_page(self.collection, filters, self.order_field, self.order, limit, after, before, fields)
+
+    def stream(self, filters, start, end, batch_size, fields=None):
+        return _mongo_stream(self.collection, filters, self.order_field, start, end, batch_size, fields)
+
+    async def search(self, text, filters, start, end, limit, after=None, fields=None, max_time_ms=None):
+        return await _mongo_search(self.collection, text, filters, self.order_field, start, end, limit, after,
+                                   fields, max_time_ms)
+
+    async def apply_transitions(self, changes):
+        ids = [delivery_id for delivery_id, _ in changes]
+        current = {
+            doc["id"]: doc async for doc in self.collection.find(
+                {"id": {"$in": ids}},
+                {"_id": 0, "id": 1, "driver_id": 1, "customer_name": 1, "status": 1, "created_at": 1})
+        }
+        results, planned = plan_transitions(changes, current)
+        if not planned:
+            return results
+        updates = [{"driver_id": result["driver_id"], "status": result["status"]} for result in planned]
+        await stamp(self.versions, updates)
+        # Each update only matches if the status is still the one the plan saw,
+        # and queues its event with it
+        outcome = await self.collection.bulk_write([
+            UpdateOne(
+                {"id": result["delivery_id"], "status": result["previous_status"]},
+                {"$set": update,
+                 "$push": {"unrecorded_events": status_event({**result, "changed_at": update["changed_at"]})}},
+            )
+            for result, update in zip(planned, updates)
+        ], ordered=False)
+        if outcome.modified_count == len(planned):
+            applied = {result["delivery_id"] for result in planned}
+        else:
+            applied = await _written(self.collection, {
+                result["delivery_id"]: update["version"] for result, update in zip(planned, updates)})
+        for result, update in zip(planned, updates):
+            result["applied"] = result["delivery_id"] in applied
+            if result["applied"]:
+                result["changed_at"] = update["changed_at"]
+            else:
+                result["detail"] = "Status changed concurrently"
+        return results
+
+    async def unrecorded_events(self, limit):
+        events = []
+        async for doc in self.collection.find(
+                {"unrecorded_events.id": {"$exists": True}}, {"_id": 0, "unrecorded_events": 1}):
+            events += doc["unrecorded_events"]
+            if len(events) >= limit:
+                break
+        return events[:limit]
+
+    async def mark_recorded(self, events):
+        queued = defaultdict(list)
+        for event in events:
+            queued[event["delivery_id"]].append(event["id"])
+        if queued:
+            await self.collection.bulk_write([
+                UpdateOne({"id": delivery_id}, {"$pull": {"unrecorded_events": {"id": {"$in": event_ids}}}})
+                for delivery_id, event_ids in queued.items()
+            ], ordered=False)
+
+    async def changes(self, driver_id, since, limit):
+        return await _mongo_changes(self.collection, driver_id, since, limit)
+
+    async def open_deliveries(self, driver_id, limit):
+        return await _find(self.collection, open_deliveries_query(driver_id, limit), HIDDEN_FIELDS).to_list(None)
+
+    async def nearby(self, latitude, longitude, max_distance_m, filters, limit):
+        pipeline = [
+            {"$geoNear": {
+                "near": geo_point(latitude, longitude),
+                "key": "location",
+                "distanceField": "distance_m",
+                "maxDistance": max_distance_m,
+                "query": filters,
+                "spherical": True,
+            }},
+            {"$limit": limit},
+            {"$project": HIDDEN_FIELDS},
+        ]
+        return await self.collection.aggregate(pipeline).to_list(limit)
+
+    async def unassigned(self, limit):
+        return await self.collection.find({"driver_id": None}, HIDDEN_FIELDS).sort(
+            [("created_at", ASCENDING), ("id", ASCENDING)]).to_list(limit)
+
+    async def assign_drivers(self, assignments):
+        if not assignments:
+            return []
+        updates = [{"driver_id": driver_id} for _, driver_id in assignments]
+        await stamp(self.versions, updates)
+        # Each update only matches if the delivery is still unassigned
+        outcome = await self.collection.bulk_write([
+            UpdateOne({"id": delivery_id, "driver_id": None}, {"$set": update})
+            for (delivery_id, _), update in zip(assignments, updates)
+        ], ordered=False)
+        if outcome.modified_count == len(assignments):
+            return [delivery_id for delivery_id, _ in assignments]
+        assigned = await _written(self.collection, {
+            delivery_id: update["version"] for (delivery_id, _), update in zip(assignments, updates)})
+        return [delivery_id for delivery_id, _ in assignments if delivery_id in assigned]
+
+    async def backfill_locations(self):
+        """Add the GeoJSON location to deliveries stored before it existed."""
+        result = await self.collection.update_many(
+            {
+                "location": {"$exists": False},
+                "latitude": {"$gte": -90, "$lte": 90},
+                "longitude": {"$gte": -180, "$lte": 180},
+            },
+            [{"$set": {"location": {"type": "Point", "coordinates": ["$longitude", "$latitude"]}}}],
+        )
+        return result.modified_count
+
+    async def active_customers(self, driver_id):
+        view = await self.view.find_one({"driver_id": driver_id}, {"_id": 0, "customers": 1})
+        return view["customers"] if view else []
+
+    async def merge_active_customers(self, docs):
+        await self.view.bulk_write([merge_active_customer(doc) for doc in docs], ordered=False)
+
+    async def _latest_open(self, driver_id: str, customer_name: str) -> Optional[dict]:
+        docs = await _find(self.collection, latest_open_query(driver_id, customer_name)).to_list(None)
+        return docs[0] if docs else None
+
+    async def refresh_active_customer(self, driver_id, customer_name):
+        # A delivery created after the read below merges its own entry, maybe
+        # before this update lands: the update keeps an entry newer than the
+        # one read, and when none was read, a second read catches that delivery
+        latest = await self._latest_open(driver_id, customer_name)
+        replacement = _unless_newer(active_customer_entry(latest)) if latest else {"$literal": []}
+        await self.view.update_one(
+            {"driver_id": driver_id}, _replace_customer(customer_name, replacement), upsert=True
+        )
+        if latest is None:
+            created = await self._latest_open(driver_id, customer_name)
+            if created:
+                await self.merge_active_customers([created])
+
+    async def rebuild_active_customers(self):
+        # $out swaps the collection in one step; writes racing the rebuild
+        # may be missing until their customer is next updated
+        pipeline = active_customers_pipeline({}) + [{"$out": self.view.name}]
+        await self.collection.aggregate(pipeline).to_list(None)
+        await self.view.create_indexes(ACTIVE_CUSTOMER_INDEXES)
+        return await self.view.count_documents({})
+
+    async def check_active_customers(self):
+        expected = {
+            doc["driver_id"]: doc["customers"]
+            async for doc in self.collection.aggregate(active_customers_pipeline({}))
+        }
+        actual = {doc["driver_id"]: doc.get("customers", []) async for doc in self.view.find({}, {"_id": 0})}
+        return _compare_views(actual, expected)
+
+    async def cold_batch(self, cutoff, limit):
+        return await _find(self.collection, cold_deliveries_query(cutoff, limit)).to_list(None)
+
+    async def delete_cold(self, ids, cutoff):
+        cold, _, _ = cold_deliveries_query(cutoff, len(ids))
+        result = await self.collection.delete_many({"id": {"$in": ids}, **cold})
+        return result.deleted_count
+
+    async def present(self, ids):
+        return await _present(self.collection, ids)
+
+    async def count(self):
+        return await self.collection.estimated_document_count()
+
+
+class MongoArchiveRepository(ArchiveRepository):
+    def __init__(self, collection, indexes: List[IndexModel], order_field: str, order: int):
+        super().__init__(order_field, order)
+        self.collection = collection
+        self.indexes = indexes
+
+    async def ensure_indexes(self):
+        await create_indexes(self.collection, self.indexes)
+
+    async def insert_many(self, docs):
+        try:
+            await self.collection.insert_many(docs, ordered=False)
+        except BulkWriteError as exc:
+            return _write_errors(exc)
+        return {}
+
+    async def delete(self, ids):
+        await self.collection.delete_many({"id": {"$in": ids}})
+
+    async def page(self, filters, limit, after=None, before=None, fields=None):
+        return await _mongo_page(self.collection, filters, self.order_field, self.order, limit, after, before, fields)
+
+    def stream(self, filters, start, end, batch_size, fields=None):
+        return _mongo_stream(self.collection, filters, self.order_field, start, end, batch_size, fields)
+
+    async def search(self, text, filters, start, end, limit, after=None, fields=None, max_time_ms=None):
+        return await _mongo_search(self.collection, text, filters, self.order_field, start, end, limit, after,
+                                   fields, max_time_ms)
+
+    async def count(self):
+        return await self.collection.estimated_document_count()
+
+
+class MongoStatusEventRepository(StatusEventRepository):
+    def __init__(self, database):
+        self.collection = database.status_events
+        self.rollup_collection = database.driver_rollups
+
+    async def ensure_indexes(self):
+        await self.collection.create_indexes(STATUS_EVENT_INDEXES)
+        await self.rollup_collection.create_indexes(ROLLUP_INDEXES)
+
+    async def record(self, events):
+        if not events:
+            return 0
+        errors = []
+        try:
+            await self.collection.insert_many([{**event, "rollup_claim": None} for event in events], ordered=False)
+        except BulkWriteError as exc:
+            errors = exc.details["writeErrors"]
+        # Duplicates were stored before, though maybe not yet counted; anything
+        # else is a real failure
+        other = [error for error in errors if error["code"] != DUPLICATE_KEY]
+        await self.add_to_rollups([event["id"] for event in events])
+        if other:
+            raise BulkWriteError({"writeErrors": other, "nInserted": len(events) - len(errors)})
+        return len(events) - len(errors)
+
+    async def add_to_rollups(self, ids: List[str]):
+        """Count the stored events among `ids` that no rollup counts yet. Each is
+        claimed first, so concurrent or repeated calls count it once; an event
+        claimed by a call that then fails to write the rollups stays missing from
+        them until rebuild_rollups."""
+        claim = uuid.uuid4().hex
+        await self.collection.update_many({"id": {"$in": ids}, "rollup_claim": None}, {"$set": {"rollup_claim": claim}})
+        claimed = await self.collection.find(
+            {"id": {"$in": ids}, "rollup_claim": claim}, {"_id": 0, "rollup_claim": 0}).to_list(None)
+        if not claimed:
+            return
+        # An upsert on the unique key alone, which the server retries if two
+        # writers race to create the same rollup
+        await self.rollup_collection.bulk_write([
+            UpdateOne(
+                {"driver_id": driver_id, "granularity": granularity, "period": period},
+                {"$inc": {name: bucket[name] for name in ("started", "delivered", "delivery_seconds_total")},
+                 "$max": {"delivery_seconds_max": bucket["delivery_seconds_max"]}},
+                upsert=True,
+            )
+            for (driver_id, granularity, period), bucket in rollup_increments(claimed).items()
+        ], ordered=False)
+
+    async def rollups(self, granularity, filters, start, end, limit):
+        shape = rollups_query(granularity, filters, start, end, limit)
+        return await _find(self.rollup_collection, shape, {"_id": 0}).to_list(None)
+
+    async def rebuild_rollups(self):
+        # Built aside and renamed over the live collection in one step; events
+        # recorded during the rebuild may be missing until the next one. Every
+        # event is claimed first, so none is counted again by add_to_rollups
+        await self.collection.update_many({"rollup_claim": None}, {"$set": {"rollup_claim": "rebuild"}})
+        increments = {}
+        async for event in self.collection.find({}, {"_id": 0, "rollup_claim": 0}):
+            rollup_increments([event], increments)
+        staging = self.rollup_collection.database[f"{self.rollup_collection.name}_rebuild"]
+        await staging.drop()
+        if increments:
+            await staging.insert_many([
+                {"driver_id": driver_id, "granularity": granularity, "period": period, **bucket}
+                for (driver_id, granularity, period), bucket in increments.items()
+            ])
+            await staging.create_indexes(ROLLUP_INDEXES)
+            await staging.rename(self.rollup_collection.name, dropTarget=True)
+        else:
+            await self.rollup_collection.delete_many({})
+        return len(increments)
+
+
+class MongoStorage(Storage):
+    def __init__(self, database):
+        versions = MongoVersionCounter(database)
+        super().__init__(
+            versions,
+            MongoMessageRepository(database, versions),
+            MongoDeliveryRepository(database, versions),
+            MongoArchiveRepository(database.messages_archive, MESSAGE_ARCHIVE_INDEXES, "timestamp", ASCENDING),
+            MongoArchiveRepository(database.deliveries_archive, DELIVERY_ARCHIVE_INDEXES, "created_at", DESCENDING),
+            MongoStatusEventRepository(database),
+        )
+        self.database = database
+
+    async def ping(self):
+        started = time.perf_counter()
+        await self.database.command("ping")
+        return time.perf_counter() - started
+
+    async def warm_up(self, connections):
+        # Concurrent commands each check out a connection, so the pool grows to
+        # about as many as run at once; the first also waits for server selection
+        if connections <= 0:
+            return
+        await self.database.command("ping")
+        await asyncio.gather(*(self.database.command("ping") for _ in range(connections - 1)))
+
+
+# In-memory engine
+
+def _stored(doc: dict) -> dict:
+    """Copy of `doc` as BSON would store it: datetimes truncated to milliseconds."""
+    stored = {}
+    for key, value in doc.items():
+        if hasattr(value, "microsecond") and hasattr(value, "replace"):
+            value = value.replace(microsecond=value.microsecond // 1000 * 1000)
+        stored[key] = value
+    return stored
+
+
+def _project(doc: dict, fields: Optional[List[str]]) -> dict:
+    if fields:
+        return {name: doc[name] for name in fields if name in doc}
+    return dict(doc)
+
+
+def _public(doc: dict) -> dict:
+    """A delivery without its storage-only fields, as the Mongo engine returns it."""
+    return {key: value for key, value in doc.items() if key not in ("_id", "location")}
+
+
+class _SortedIndex:
+    """Document ids grouped by the values of `key_fields`, each group sorted by (order_field, id)."""
+
+    def __init__(self, key_fields: Tuple[str, ...], order_field: str):
+        self.key_fields = key_fields
+        self.order_field = order_field
+        self.groups: Dict[tuple, list] = defaultdict(list)
+
+    def key(self, doc: dict) -> tuple:
+        return tuple(doc[name] for name in self.key_fields)
+
+    def add(self, doc: dict):
+        insort(self.groups[self.key(doc)], (doc[self.order_field], doc["id"]))
+
+    def remove(self, doc: dict):
+        key = self.key(doc)
+        group = self.groups[key]
+        position = bisect_left(group, (doc[self.order_field], doc["id"]))
+        del group[position]
+        if not group:
+            del self.groups[key]
+
+    def scan(self, key: tuple, ascending: bool, position: Optional[Tuple], limit: int) -> List[str]:
+        """Up to `limit` ids in the given direction, strictly past `position`."""
+        group = self.groups.get(key, [])
+        if ascending:
+            start = bisect_right(group, position) if position else 0
+            return [doc_id for _, doc_id in group[start:start + limit]]
+        end = bisect_left(group, position) if position else len(group)
+        return [doc_id for _, doc_id in reversed(group[max(end - limit, 0):end])]
+
+
+_WORD = re.compile(r"\w+")
+
+
+def _words(value) -> List[str]:
+    return _WORD.findall(value.lower()) if isinstance(value, str) else []
+
+
+class _TextIndex:
+    """Ids of the documents containing each word of the `weights` fields, with
+    words split and case-folded as a MongoDB text index with no language does.
+    Scores follow the shape of MongoDB's textScore (weight times a term
+    frequency factor, summed over matched words) but not its exact values."""
+
+    def __init__(self, weights: Dict[str, int]):
+        self.weights = weights
+        self.postings: Dict[str, set] = defaultdict(set)
+
+    def _doc_words(self, doc: dict) -> set:
+        return {word for name in self.weights for word in _words(doc.get(name))}
+
+    def add(self, doc: dict):
+        for word in self._doc_words(doc):
+            self.postings[word].add(doc["id"])
+
+    def remove(self, doc: dict):
+        for word in self._doc_words(doc):
+            self.postings[word].discard(doc["id"])
+            if not self.postings[word]:
+                del self.postings[word]
+
+    def scores(self, docs: Dict[str, dict], text: str) -> Dict[str, float]:
+        phrases = [phrase.lower() for phrase in re.findall(r'"([^"]*)"', text)]
+        tokens = re.sub(r'"[^"]*"', " ", text).split()
+        negated = {word for token in tokens if token.startswith("-") for word in _words(token[1:])}
+        wanted = {word for token in tokens if not token.startswith("-") for word in _words(token)}
+        wanted |= {word for phrase in phrases for word in _words(phrase)}
+        scores = {}
+        for doc_id in set().union(*(self.postings.get(word, set()) for word in wanted)):
+            doc = docs[doc_id]
+            fields = {name: _words(doc.get(name)) for name in self.weights}
+            if any(word in words for words in fields.values() for word in negated):
+                continue
+            values = [doc.get(name).lower() for name in self.weights if isinstance(doc.get(name), str)]
+            if not all(any(phrase in value for value in values) for phrase in phrases):
+                continue
+            scores[doc_id] = sum(
+                self.weights[name] * 0.5 * (1 + words.count(word) / len(words))
+                for name, words in fields.items() for word in wanted if word in words
+            )
+        return scores
+
+
+class _MemoryCollection:
+    """Documents by id plus sorted indexes, and optionally a text index, over them."""
+
+    def __init__(self, order_field: str, index_keys: List[Tuple[str, ...]],
+                 text_weights: Optional[Dict[str, int]] = None):
+        self.docs: Dict[str, dict] = {}
+        self.indexes = [_SortedIndex(key_fields, order_field) for key_fields in index_keys]
+        self.text = _TextIndex(text_weights) if text_weights else None
+        self.order_field = order_field
+
+    def insert(self, doc: dict):
+        """Raises KeyError if a document with the same id is stored."""
+        if doc["id"] in self.docs:
+            raise KeyError(doc["id"])
+        doc.setdefault("_id", ObjectId())
+        stored = _stored(doc)
+        self.docs[stored["id"]] = stored
+        for index in self.indexes:
+            index.add(stored)
+        if self.text is not None:
+            self.text.add(stored)
+
+    def update(self, doc_id: str, changes: dict):
+        """Set `changes` on a stored document; they must not touch text-indexed fields."""
+        doc = self.docs[doc_id]
+        for index in self.indexes:
+            index.remove(doc)
+        doc.update(_stored(changes))
+        for index in self.indexes:
+            index.add(doc)
+
+    def remove(self, doc_id: str) -> Optional[dict]:
+        doc = self.docs.pop(doc_id, None)
+        if doc is not None:
+            for index in self.indexes:
+                index.remove(doc)
+            if self.text is not None:
+                self.text.remove(doc)
+        return doc
+
+    def oldest(self, predicate, limit: int) -> List[dict]:
+        """Up to `limit` copies of the documents matching `predicate`, in ascending order."""
+        matching = (doc for doc in self.docs.values() if predicate(doc))
+        return [dict(doc) for doc in sorted(matching, key=lambda doc: (doc[self.order_field], doc["id"]))[:limit]]
+
+    def page(self, filters, direction, limit, after, before, fields):
+        backwards = before is not None
+        ascending = (direction == ASCENDING) != backwards
+        position = after or before
+        index = next((index for index in self.indexes if set(index.key_fields) == set(filters)), None)
+        if index is not None:
+            ids = index.scan(tuple(filters[name] for name in index.key_fields), ascending, position, limit + 1)
+            docs = [self.docs[doc_id] for doc_id in ids]
+        else:
+            # No index for this filter; same result, scanned the slow way
+            key = lambda doc: (doc[self.order_field], doc["id"])  # noqa: E731
+            docs = sorted(
+                (doc for doc in self.docs.values() if all(doc.get(k) == v for k, v in filters.items())
+                 and (position is None or (key(doc) > position if ascending else key(doc) < position))),
+                key=key, reverse=not ascending,
+            )[:limit + 1]
+        has_more = len(docs) > limit
+        docs = [_project(doc, fields) for doc in docs[:limit]]
+        if backwards:
+            docs.reverse()
+        return docs, has_more
+
+    def search(self, text, filters, start, end, limit, after, fields):
+        def wanted(doc_id, score):
+            doc = self.docs[doc_id]
+            return (all(doc.get(k) == v for k, v in filters.items())
+                    and (start is None or doc[self.order_field] >= start)
+                    and (end is None or doc[self.order_field] < end)
+                    and (after is None or (-score, doc_id) > (-after[0], after[1])))
+
+        hits = sorted(
+            (-score, doc_id) for doc_id, score in self.text.scores(self.docs, text).items() if wanted(doc_id, score)
+        )[:limit + 1]
+        docs = [{**_project(_public(self.docs[doc_id]), fields), "score": -score} for score, doc_id in hits[:limit]]
+        return docs, len(hits) > limit
+
+
+async def _memory_stream(store: _MemoryCollection, filters: dict, start: Optional[datetime],
+                         end: Optional[datetime], batch_size: int, fields: Optional[List[str]]) -> AsyncIterator[dict]:
+    position = (start, "") if start else None
+    while True:
+        docs, has_more = store.page(filters, ASCENDING, batch_size, position, None, None)
+        for doc in docs:
+            if end and doc[store.order_field] >= end:
+                return
+            yield _project(_public(doc), fields)
+        if not has_more:
+            return
+        position = (docs[-1][store.order_field], docs[-1]["id"])
+
+
+class MemoryVersionCounter(VersionCounter):
+    def __init__(self):
+        self.counters: Dict[str, Tuple[int, datetime]] = {}
+
+    async def reserve(self, driver_id, count=1):
+        version, _ = self.counters.get(driver_id, (0, None))
+        self.counters[driver_id] = (version + count, datetime.utcnow())
+        return version + 1
+
+    async def latest(self, driver_id):
+        return self.counters.get(driver_id, (0, None))
+
+
+def _changes_after(index: _SortedIndex, docs: Dict[str, dict], driver_id: str, since: int, limit: int) -> List[dict]:
+    # Versions are unique per driver, so (since + 1, "") sorts before every later version
+    ids = index.scan((driver_id,), True, (since + 1, ""), limit)
+    return [_public(docs[doc_id]) for doc_id in ids]
+
+
+class MemoryMessageRepository(MessageRepository):
+    def __init__(self, versions: VersionCounter):
+        self.versions = versions
+        self.changed = _SortedIndex(("driver_id",), "version")
+        self.store = _MemoryCollection("timestamp", [("driver_id",), ("driver_id", "customer_name")],
+                                       MESSAGE_TEXT_WEIGHTS)
+        self.by_conversation = self.store.indexes[1]
+        # Latest message per driver and customer name
+        self.conversations: Dict[str, Dict[str, dict]] = defaultdict(dict)
+        self.read_markers: Dict[Tuple[str, str], datetime] = {}
+
+    async def insert(self, doc):
+        await stamp(self.versions, [doc])
+        self.store.insert(doc)
+        self.changed.add(doc)
+        stored = self.store.docs[doc["id"]]
+        last_message = self.conversations[doc["driver_id"]].get(doc["customer_name"])
+        if last_message is None or (last_message["timestamp"], last_message["id"]) < (stored["timestamp"], stored["id"]):
+            self.conversations[doc["driver_id"]][doc["customer_name"]] = stored
+
+    async def page(self, filters, limit, after=None, before=None, fields=None):
+        return self.store.page(filters, self.order, limit, after, before, fields)
+
+    def stream(self, filters, start, end, batch_size, fields=None):
+        return _memory_stream(self.store, filters, start, end, batch_size, fields)
+
+    async def search(self, text, filters, start, end, limit, after=None, fields=None, max_time_ms=None):
+        return self.store.search(text, filters, start, end, limit, after, fields)
+
+    async def changes(self, driver_id, since, limit):
+        return _changes_after(self.changed, self.store.docs, driver_id, since, limit)
+
+    async def inbox(self, driver_id):
+        conversations = []
+        for customer_name, last_message in self.conversations.get(driver_id, {}).items():
+            group = self.by_conversation.groups.get((driver_id, customer_name), [])
+            read_at = self.read_markers.get((driver_id, customer_name), NEVER_READ)
+            start = bisect_right(group, read_at, key=lambda entry: entry[0])
+            unread = sum(1 for _, doc_id in group[start:] if self.store.docs[doc_id]["sender"] == "customer")
+            last_message = {key: value for key, value in last_message.items() if key != "_id"}
+            conversations.append({"customer_name": customer_name, "last_message": last_message, "unread_count": unread})
+        conversations.sort(key=lambda c: c["customer_name"])
+        conversations.sort(key=lambda c: c["last_message"]["timestamp"], reverse=True)
+        return conversations
+
+    async def rebuild_conversations(self):
+        self.conversations = defaultdict(dict)
+        for (driver_id, customer_name), group in self.by_conversation.groups.items():
+            if group:
+                self.conversations[driver_id][customer_name] = self.store.docs[group[-1][1]]
+        return sum(len(conversations) for conversations in self.conversations.values())
+
+    async def mark_read(self, driver_id, customer_name, read_at):
+        read_at = _stored({"read_at": read_at})["read_at"]
+        marker = max(self.read_markers.get((driver_id, customer_name), read_at), read_at)
+        self.read_markers[driver_id, customer_name] = marker
+        return marker
+
+    async def cold_batch(self, cutoff, limit):
+        return self.store.oldest(lambda doc: doc["timestamp"] < cutoff, limit)
+
+    async def delete_cold(self, ids, cutoff):
+        cold = [doc_id for doc_id in ids if doc_id in self.store.docs and self.store.docs[doc_id]["timestamp"] < cutoff]
+        for doc_id in cold:
+            doc = self.store.remove(doc_id)
+            self.changed.remove(doc)
+            conversations = self.conversations.get(doc["driver_id"], {})
+            if conversations.get(doc["customer_name"], {}).get("id") == doc_id:
+                del conversations[doc["customer_name"]]
+        return len(cold)
+
+    async def present(self, ids):
+        return [doc_id for doc_id in ids if doc_id in self.store.docs]
+
+    async def count(self):
+        return len(self.store.docs)
+
+
+class MemoryDeliveryRepository(DeliveryRepository):
+    def __init__(self, versions: VersionCounter):
+        self.versions = versions
+        self.changed = _SortedIndex(("driver_id",), "version")
+        self.store = _MemoryCollection("created_at", [("driver_id",)], DELIVERY_TEXT_WEIGHTS)
+        # Open deliveries per (driver_id, customer_name), sorted by (created_at, id)
+        self.open = _SortedIndex(("driver_id", "customer_name"), "created_at")
+        self.open_by_driver: Dict[str, set] = defaultdict(set)
+        self.view: Dict[str, Dict[str, dict]] = {}
+        # Queued status events per delivery id, by event id
+        self.unrecorded: Dict[str, Dict[str, dict]] = defaultdict(dict)
+
+    def _track_open(self, doc: dict, is_open: bool):
+        if doc["driver_id"] is None:
+            return  # Unassigned deliveries are no driver's open deliveries
+        ids = self.open_by_driver[doc["driver_id"]]
+        if is_open and doc["id"] not in ids:
+            self.open.add(doc)
+            ids.add(doc["id"])
+        elif not is_open and doc["id"] in ids:
+            self.open.remove(doc)
+            ids.discard(doc["id"])
+
+    def _insert(self, doc: dict):
+        self.store.insert(doc)
+        stored = self.store.docs[doc["id"]]
+        self.changed.add(stored)
+        self._track_open(stored, doc["status"] in ACTIVE_STATUSES)
+
+    async def insert(self, doc):
+        await stamp(self.versions, [doc])
+        self._insert(doc)
+
+    async def insert_many(self, docs):
+        await stamp(self.versions, docs)
+        failed = {}
+        for position, doc in enumerate(docs):
+            try:
+                self._insert(doc)
+            except KeyError:
+                failed[position] = (DUPLICATE_KEY, f"duplicate key: id {doc['id']!r}")
+        return failed
+
+    async def page(self, filters, limit, after=None, before=None, fields=None):
+        return self.store.page(filters, self.order, limit, after, before, fields)
+
+    def stream(self, filters, start, end, batch_size, fields=None):
+        return _memory_stream(self.store, filters, start, end, batch_size, fields)
+
+    async def search(self, text, filters, start, end, limit, after=None, fields=None, max_time_ms=None):
+        return self.store.search(text, filters, start, end, limit, after, fields)
+
+    async def apply_transitions(self, changes):
+        current = {delivery_id: self.store.docs[delivery_id] for delivery_id, _ in changes
+                   if delivery_id in self.store.docs}
+        results, planned = plan_transitions(changes, current)
+        updates = [{"driver_id": result["driver_id"], "status": result["status"]} for result in planned]
+        await stamp(self.versions, updates)
+        for result, update in zip(planned, updates):
+            doc = self.store.docs[result["delivery_id"]]
+            self.changed.remove(doc)
+            doc.update(_stored(update))
+            self.changed.add(doc)
+            self._track_open(doc, doc["status"] in ACTIVE_STATUSES)
+            result.update(applied=True, changed_at=doc["changed_at"])
+            event = status_event(result)
+            self.unrecorded[result["delivery_id"]][event["id"]] = event
+        return results
+
+    async def unrecorded_events(self, limit):
+        return [event for queued in self.unrecorded.values() for event in queued.values()][:limit]
+
+    async def mark_recorded(self, events):
+        for event in events:
+            queued = self.unrecorded.get(event["delivery_id"], {})
+            queued.pop(event["id"], None)
+            if not queued:
+                self.unrecorded.pop(event["delivery_id"], None)
+
+    async def changes(self, driver_id, since, limit):
+        return _changes_after(self.changed, self.store.docs, driver_id, since, limit)
+
+    async def open_deliveries(self, driver_id, limit):
+        docs = sorted((self.store.docs[doc_id] for doc_id in self.open_by_driver.get(driver_id, ())),
+                      key=lambda doc: (doc["created_at"], doc["id"]))
+        return [_public(doc) for doc in docs[:limit]]
+
+    async def nearby(self, latitude, longitude, max_distance_m, filters, limit):
+        candidates = [
+            doc for doc in self.store.docs.values()
+            if all(doc.get(key) == value for key, value in filters.items())
+        ]
+        if not candidates:
+            return []
+        lat = np.radians([doc["latitude"] for doc in candidates])
+        lon = np.radians([doc["longitude"] for doc in candidates])
+        lat0, lon0 = np.radians(latitude), np.radians(longitude)
+        a = np.sin((lat - lat0) / 2) ** 2 + np.cos(lat) * np.cos(lat0) * np.sin((lon - lon0) / 2) ** 2
+        distances = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+        nearest = [int(i) for i in np.argsort(distances, kind="stable") if distances[i] <= max_distance_m][:limit]
+        return [{**_public(candidates[i]), "distance_m": float(distances[i])} for i in nearest]
+
+    async def unassigned(self, limit):
+        ids = self.store.indexes[0].scan((None,), True, None, limit)
+        return [_public(self.store.docs[doc_id]) for doc_id in ids]
+
+    async def assign_drivers(self, assignments):
+        assignments = [(delivery_id, driver_id) for delivery_id, driver_id in assignments
+                       if delivery_id in self.store.docs and self.store.docs[delivery_id]["driver_id"] is None]
+        updates = [{"driver_id": driver_id} for _, driver_id in assignments]
+        await stamp(self.versions, updates)
+        for (delivery_id, _), update in zip(assignments, updates):
+            doc = self.store.docs[delivery_id]
+            self.changed.remove(doc)
+            self.store.update(delivery_id, update)
+            self.changed.add(doc)
+            self._track_open(doc, doc["status"] in ACTIVE_STATUSES)
+        return [delivery_id for delivery_id, _ in assignments]
+
+    def _latest_open(self, driver_id: str, customer_name: str) -> Optional[dict]:
+        ids = self.open.scan((driver_id, customer_name), False, None, 1)
+        return self.store.docs[ids[0]] if ids else None
+
+    async def active_customers(self, driver_id):
+        return [dict(entry) for entry in self.view.get(driver_id, {}).values()]
+
+    async def merge_active_customers(self, docs):
+        for doc in docs:
+            entries = self.view.setdefault(doc["driver_id"], {})
+            entry = active_customer_entry(_stored(doc))
+            current = entries.get(entry["customer_name"])
+            if current is None or (current["created_at"], current["delivery_id"]) <= (
+                    entry["created_at"], entry["delivery_id"]):
+                entries[entry["customer_name"]] = entry
+
+    async def refresh_active_customer(self, driver_id, customer_name):
+        entries = self.view.setdefault(driver_id, {})
+        latest = self._latest_open(driver_id, customer_name)
+        if latest is None:
+            entries.pop(customer_name, None)
+        else:
+            entries[customer_name] = active_customer_entry(latest)
+
+    def _computed_view(self) -> Dict[str, Dict[str, dict]]:
+        view: Dict[str, Dict[str, dict]] = {}
+        for driver_id, customer_name in self.open.groups:
+            view.setdefault(driver_id, {})[customer_name] = active_customer_entry(
+                self._latest_open(driver_id, customer_name))
+        return view
+
+    async def rebuild_active_customers(self):
+        self.view = self._computed_view()
+        return len(self.view)
+
+    async def check_active_customers(self):
+        actual = {driver_id: list(entries.values()) for driver_id, entries in self.view.items()}
+        expected = {driver_id: list(entries.values()) for driver_id, entries in self._computed_view().items()}
+        return _compare_views(actual, expected)
+
+    def _is_cold(self, doc: dict, cutoff: datetime) -> bool:
+        return doc["status"] == "delivered" and doc["created_at"] < cutoff and doc["id"] not in self.unrecorded
+
+    async def cold_batch(self, cutoff, limit):
+        return self.store.oldest(lambda doc: self._is_cold(doc, cutoff), limit)
+
+    async def delete_cold(self, ids, cutoff):
+        cold = [doc_id for doc_id in ids if doc_id in self.store.docs and self._is_cold(self.store.docs[doc_id], cutoff)]
+        for doc_id in cold:
+            doc = self.store.remove(doc_id)
+            self.changed.remove(doc)
+            self._track_open(doc, False)
+        return len(cold)
+
+    async def present(self, ids):
+        return [doc_id for doc_id in ids if doc_id in self.store.docs]
+
+    async def count(self):
+        return len(self.store.docs)
+
+
+class MemoryArchiveRepository(ArchiveRepository):
+    def __init__(self, order_field: str, order: int, index_keys: List[Tuple[str, ...]],
+                 text_weights: Dict[str, int]):
+        super().__init__(order_field, order)
+        self.store = _MemoryCollection(order_field, index_keys, text_weights)
+
+    async def insert_many(self, docs):
+        failed = {}
+        for position, doc in enumerate(docs):
+            try:
+                self.store.insert(doc)
+            except KeyError:
+                failed[position] = (DUPLICATE_KEY, f"duplicate key: id {doc['id']!r}")
+        return failed
+
+    async def delete(self, ids):
+        for doc_id in ids:
+            self.store.remove(doc_id)
+
+    async def page(self, filters, limit, after=None, before=None, fields=None):
+        return self.store.page(filters, self.order, limit, after, before, fields)
+
+    def stream(self, filters, start, end, batch_size, fields=None):
+        return _memory_stream(self.store, filters, start, end, batch_size, fields)
+
+    async def search(self, text, filters, start, end, limit, after=None, fields=None, max_time_ms=None):
+        return self.store.search(text, filters, start, end, limit, after, fields)
+
+    async def count(self):
+        return len(self.store.docs)
+
+
+class MemoryStatusEventRepository(StatusEventRepository):
+    def __init__(self):
+        self.events: Dict[str, dict] = {}
+        self.rollup_buckets: Dict[Tuple[str, str, datetime], dict] = {}
+
+    async def record(self, events):
+        recorded = [_stored(event) for event in events if event["id"] not in self.events]
+        for event in recorded:
+            self.events[event["id"]] = event
+        rollup_increments(recorded, self.rollup_buckets)
+        return len(recorded)
+
+    async def rollups(self, granularity, filters, start, end, limit):
+        rows = [
+            {"driver_id": driver_id, "granularity": granularity, "period": period, **bucket}
+            for (driver_id, bucket_granularity, period), bucket in self.rollup_buckets.items()
+            if bucket_granularity == granularity
+            and (start is None or period >= start) and (end is None or period < end)
+        ]
+        rows = [row for row in rows if all(row[k] == v for k, v in filters.items())]
+        return sorted(rows, key=lambda row: (row["period"], row["driver_id"]))[:limit]
+
+    async def rebuild_rollups(self):
+        self.rollup_buckets = rollup_increments(self.events.values())
+        return len(self.rollup_buckets)
+
+
+class MemoryStorage(Storage):
+    def __init__(self):
+        versions = MemoryVersionCounter()
+        super().__init__(
+            versions,
+            MemoryMessageRepository(versions),
+            MemoryDeliveryRepository(versions),
+            MemoryArchiveRepository("timestamp", ASCENDING, [("driver_id",), ("driver_id", "customer_name")],
+                                    MESSAGE_TEXT_WEIGHTS),
+            MemoryArchiveRepository("created_at", DESCENDING, [("driver_id",)], DELIVERY_TEXT_WEIGHTS),
+            MemoryStatusEventRepository(),
+        )
+
+
+def create_storage(engine: str, database=None) -> Storage:
+    if engine == "mongo":
+        return MongoStorage(database)
+    if engine == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Unknown STORAGE_ENGINE {engine!r}; expected 'mongo' or 'memory'")
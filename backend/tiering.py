@@ -0,0 +1,109 @@
+"""Hot/cold tiering of messages and delivered deliveries.
+
+Old messages and long-delivered deliveries are moved, a batch at a time,
+from the collections the driver-facing routes read into archive
+collections that only the history routes read, so the hot working set
+stays proportional to current activity rather than to all history.
+
+Each batch is copied before it is deleted, so an interrupted run loses
+nothing: the next run finds the same documents still hot and the archive
+ignores the copies it already holds. A delivery whose status leaves
+``delivered`` between the copy and the delete stays hot and its archive
+copy is removed again.
+
+Pages cached from the hot collections still list the documents moved, so
+each batch moved is passed to an ``on_archived(name, docs)`` callback, which
+the server uses to invalidate the affected cache tags.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional
+
+import bson
+
+from metrics import TIER_DOCUMENTS, TIERING_BYTES_MOVED, TIERING_DOCUMENTS_MOVED
+from storage import DUPLICATE_KEY
+
+logger = logging.getLogger(__name__)
+
+OnArchived = Callable[[str, List[dict]], Awaitable[None]]
+
+
+class TieringPolicy:
+    """How old documents must be before they are archived, and the batch size."""
+
+    def __init__(self, message_max_age: timedelta, delivered_max_age: timedelta, batch_size: int = 1000):
+        self.message_max_age = message_max_age
+        self.delivered_max_age = delivered_max_age
+        self.batch_size = batch_size
+
+    @classmethod
+    def from_env(cls) -> "TieringPolicy":
+        return cls(
+            message_max_age=timedelta(days=float(os.environ.get('TIERING_MESSAGE_MAX_AGE_DAYS', '30'))),
+            delivered_max_age=timedelta(hours=float(os.environ.get('TIERING_DELIVERED_MAX_AGE_HOURS', '24'))),
+            batch_size=int(os.environ.get('TIERING_BATCH_SIZE', '1000')),
+        )
+
+
+async def archive_collection(name: str, hot, archive, cutoff: datetime, batch_size: int,
+                             on_archived: Optional[OnArchived] = None) -> int:
+    """Move every document of `hot` that is cold at `cutoff` into `archive`.
+    Returns the number of documents moved."""
+    moved = 0
+    while True:
+        batch = await hot.cold_batch(cutoff, batch_size)
+        if not batch:
+            break
+        failed = await archive.insert_many(batch)
+        # Duplicates are copies left by an interrupted run; anything else must stay hot
+        errors = {batch[i]["id"]: message for i, (code, message) in failed.items() if code != DUPLICATE_KEY}
+        if errors:
+            logger.error("Could not archive %d %s, e.g. %s", len(errors), name, next(iter(errors.values())))
+        kept = set(errors)
+        ids = [doc["id"] for doc in batch if doc["id"] not in kept]
+        deleted = await hot.delete_cold(ids, cutoff)
+        still_hot = set()
+        if deleted < len(ids):
+            still_hot = set(await hot.present(ids))
+            await archive.delete(list(still_hot))
+        archived = [doc for doc in batch if doc["id"] not in kept and doc["id"] not in still_hot]
+        moved += len(archived)
+        TIERING_DOCUMENTS_MOVED.labels(name).inc(len(archived))
+        TIERING_BYTES_MOVED.labels(name).inc(sum(len(bson.encode(doc)) for doc in archived))
+        if archived and on_archived:
+            await on_archived(name, archived)
+        if len(batch) < batch_size or kept:
+            break
+    TIER_DOCUMENTS.labels(name, "hot").set(await hot.count())
+    TIER_DOCUMENTS.labels(name, "archive").set(await archive.count())
+    return moved
+
+
+async def archive_cold(storage, policy: TieringPolicy, now: Optional[datetime] = None,
+                       on_archived: Optional[OnArchived] = None) -> dict:
+    """Run the policy once. Returns the number of documents moved per collection."""
+    now = now or datetime.utcnow()
+    return {
+        "messages": await archive_collection(
+            "messages", storage.messages, storage.messages_archive,
+            now - policy.message_max_age, policy.batch_size, on_archived),
+        "deliveries": await archive_collection(
+            "deliveries", storage.deliveries, storage.deliveries_archive,
+            now - policy.delivered_max_age, policy.batch_size, on_archived),
+    }
+
+
+async def run_periodically(get_storage, policy: TieringPolicy, interval: float,
+                           on_archived: Optional[OnArchived] = None):
+    """Apply the policy every `interval` seconds until cancelled."""
+    while True:
+        try:
+            moved = await archive_cold(get_storage(), policy, on_archived=on_archived)
+            if any(moved.values()):
+                logger.info("Archived %(messages)d messages and %(deliveries)d deliveries", moved)
+        except Exception:
+            logger.exception("Tiering run failed")
+        await asyncio.sleep(interval)
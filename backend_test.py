@@ -134,7 +134,7 @@ class BackendTester:
             response = self.session.get(f"{BACKEND_URL}/deliveries/{DRIVER_ID}")
             
             if response.status_code == 200:
-                data = response.json()
+                data = response.json()["items"]
                 if isinstance(data, list) and len(data) >= len(self.created_deliveries):
                     self.log_test("Get Driver Deliveries", True, 
                                 f"Retrieved {len(data)} deliveries", {"count": len(data)})
@@ -163,11 +163,12 @@ class BackendTester:
         
         for i, delivery in enumerate(self.created_deliveries[:2]):  # Test first 2 deliveries
             try:
-                status = statuses[i % len(statuses)]
-                response = self.session.put(
-                    f"{BACKEND_URL}/deliveries/{delivery['id']}/status",
-                    params={"status": status}
-                )
+                # Statuses only move pending -> in_progress -> delivered, one step at a time
+                for status in statuses[:i % len(statuses) + 1]:
+                    response = self.session.put(
+                        f"{BACKEND_URL}/deliveries/{delivery['id']}/status",
+                        params={"status": status}
+                    )
                 
                 if response.status_code == 200:
                     data = response.json()
@@ -243,7 +244,7 @@ class BackendTester:
             response = self.session.get(f"{BACKEND_URL}/messages/{DRIVER_ID}")
             
             if response.status_code == 200:
-                data = response.json()
+                data = response.json()["items"]
                 if isinstance(data, list) and len(data) >= len(self.created_messages):
                     self.log_test("Get Driver Messages", True, 
                                 f"Retrieved {len(data)} messages", {"count": len(data)})
@@ -271,7 +272,7 @@ class BackendTester:
                 response = self.session.get(f"{BACKEND_URL}/messages/{DRIVER_ID}/{customer}")
                 
                 if response.status_code == 200:
-                    data = response.json()
+                    data = response.json()["items"]
                     if isinstance(data, list):
                         # Check if all messages are for the correct customer
                         valid_conversation = all(msg.get("customer_name") == customer for msg in data)
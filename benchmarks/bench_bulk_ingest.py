@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Delivery ingest benchmark: one POST /api/deliveries per record versus a
+single POST /api/deliveries/bulk with an NDJSON body.
+
+Runs the app in-process over ASGI against the MongoDB server in
+backend/.env, using a throwaway database.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import httpx  # noqa: E402
+
+import server  # noqa: E402
+from storage import MongoStorage  # noqa: E402
+
+
+def make_records(count: int):
+    return [
+        {
+            "driver_id": f"driver_{i % 25:03d}",
+            "customer_name": f"Customer {i}",
+            "customer_phone": "+1-555-0100",
+            "address": f"{i} Oak Street, Downtown",
+            "latitude": 40.7 + (i % 100) / 1000,
+            "longitude": -74.0 + (i % 100) / 1000,
+            "order_details": "2x Margherita Pizza, 1x Caesar Salad",
+        }
+        for i in range(count)
+    ]
+
+
+async def run(count: int):
+    database_name = f"bench_ingest_{uuid.uuid4().hex}"
+    server.storage = MongoStorage(server.client[database_name])
+    await server.storage.ensure_indexes()
+    records = make_records(count)
+    transport = httpx.ASGITransport(app=server.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            started = time.perf_counter()
+            for record in records:
+                response = await http.post("/api/deliveries", json=record)
+                response.raise_for_status()
+            single = time.perf_counter() - started
+
+            body = "\n".join(json.dumps(record) for record in records)
+            started = time.perf_counter()
+            response = await http.post("/api/deliveries/bulk", content=body,
+                                       headers={"Content-Type": "application/x-ndjson"})
+            response.raise_for_status()
+            bulk = time.perf_counter() - started
+            assert response.json()["created"] == count
+    finally:
+        await server.client.drop_database(database_name)
+
+    print(f"records:            {count}")
+    print(f"single-insert path: {count / single:10.0f} records/s ({single:.2f}s)")
+    print(f"bulk NDJSON path:   {count / bulk:10.0f} records/s ({bulk:.2f}s)")
+    print(f"speedup:            {single / bulk:10.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=5000)
+    asyncio.run(run(parser.parse_args().records))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Dispatch benchmark: thousands of unassigned deliveries against hundreds of drivers.
+
+Times the assignment alone (distance matrix and matching), then a whole batch
+on the in-memory engine (read the unassigned deliveries, assign, write back),
+for deliveries spread over the city and for deliveries crowded into one
+neighbourhood, where many compete for the same few drivers. Exits non-zero
+if a batch takes longer than the budget.
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from dispatch import plan_dispatch  # noqa: E402
+from storage import MemoryStorage  # noqa: E402
+
+# (deliveries, drivers); drivers take capacity enough for about 1.2x the deliveries
+SIZES = [(1000, 100), (2000, 200), (5000, 200), (5000, 500)]
+# Side in degrees of the square the deliveries fall in; drivers cover 0.3
+SPREADS = {"spread": 0.3, "crowded": 0.02}
+START = datetime(2024, 1, 1)
+
+
+def points(rng, count, spread):
+    return [(40.60 + lat, -74.10 + lon) for lat, lon in rng.uniform(0, spread, size=(count, 2))]
+
+
+def delivery(i, latitude, longitude):
+    return {"id": f"d{i:06d}", "driver_id": None, "customer_name": f"Customer {i}", "customer_phone": "+1-555-0123",
+            "address": "123 Oak Street", "latitude": latitude, "longitude": longitude, "status": "pending",
+            "order_details": "Pizza", "created_at": START + timedelta(seconds=i)}
+
+
+async def batch(deliveries, drivers, capacity) -> float:
+    """Seconds for one dispatch batch through the memory engine."""
+    storage = MemoryStorage()
+    await storage.deliveries.insert_many([delivery(i, *point) for i, point in enumerate(deliveries)])
+    started = time.perf_counter()
+    pending = await storage.deliveries.unassigned(len(deliveries))
+    plan = plan_dispatch([(doc["latitude"], doc["longitude"]) for doc in pending], drivers,
+                         [capacity] * len(drivers))
+    assigned = await storage.deliveries.assign_drivers(
+        [(pending[row]["id"], f"driver_{column:04d}") for row, column, _ in plan])
+    elapsed = time.perf_counter() - started
+    assert len(assigned) == len(deliveries)
+    return elapsed
+
+
+def run(repeats: int, budget_s: float) -> bool:
+    rng = np.random.default_rng(42)
+    within_budget = True
+    print(f"{'layout':>8} {'deliveries':>10} {'drivers':>8} {'assign ms':>10} {'max ms':>8} {'batch ms':>9}"
+          f" {'mean km':>8}")
+    for layout, spread in SPREADS.items():
+        for count, driver_count in SIZES:
+            capacity = -(-count * 6 // (driver_count * 5))
+            timings, batches, mean_km = [], [], 0.0
+            for _ in range(repeats):
+                deliveries, drivers = points(rng, count, spread), points(rng, driver_count, 0.3)
+                started = time.perf_counter()
+                plan = plan_dispatch(deliveries, drivers, [capacity] * driver_count)
+                timings.append(time.perf_counter() - started)
+                mean_km = statistics.mean(distance for _, _, distance in plan)
+                batches.append(asyncio.run(batch(deliveries, drivers, capacity)))
+            within_budget &= max(batches) <= budget_s
+            print(f"{layout:>8} {count:>10} {driver_count:>8} {statistics.median(timings) * 1000:>10.1f}"
+                  f" {max(timings) * 1000:>8.1f} {statistics.median(batches) * 1000:>9.1f} {mean_km:>8.2f}")
+    return within_budget
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--budget-s", type=float, default=1.0, help="longest acceptable batch")
+    args = parser.parse_args()
+    sys.exit(0 if run(args.repeats, args.budget_s) else 1)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Export benchmark: streams GET /api/export/messages/{driver_id} for growing
+numbers of messages and reports throughput and the peak memory allocated
+while the response was produced, which should stay flat as the export grows.
+
+Drives the app in-process over ASGI with the memory storage engine, counting
+the response bytes as they are sent rather than collecting them.
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+from storage import MemoryStorage  # noqa: E402
+
+START = datetime(2024, 1, 1)
+
+
+async def seed(count: int):
+    server.storage = MemoryStorage()
+    for i in range(count):
+        await server.storage.messages.insert(server.Message(
+            driver_id="driver_001", customer_name=f"Customer {i % 50}", text=f"On my way, order {i}",
+            sender="driver", timestamp=START + timedelta(seconds=i),
+        ).dict())
+
+
+async def export(query: str):
+    """Run one export request; returns (status, bytes sent, seconds, peak bytes allocated)."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": "/api/export/messages/driver_001", "raw_path": b"/api/export/messages/driver_001",
+        "query_string": query.encode(), "headers": [], "client": ("bench", 1), "server": ("bench", 80),
+        "root_path": "", "app": server.app,
+    }
+    sent = 0
+    status = None
+    requested = False
+    finished = asyncio.Event()
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal sent, status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            sent += len(message.get("body", b""))
+            if not message.get("more_body", False):
+                finished.set()
+
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    await server.app(scope, receive, send)
+    elapsed = time.perf_counter() - started
+    return status, sent, elapsed, tracemalloc.get_traced_memory()[1] - baseline
+
+
+async def run(sizes, formats, batch_sizes):
+    print(f"{'messages':>9} {'format':>10} {'batch':>6} {'MB sent':>8} {'rows/s':>9} {'peak MB':>8}")
+    for size in sizes:
+        await seed(size)
+        tracemalloc.start()
+        for export_format in formats:
+            for batch_size in batch_sizes:
+                server.EXPORT_BATCH_SIZE = batch_size
+                fmt, _, compressed = export_format.partition("+")
+                query = f"format={fmt}&gzip={'true' if compressed else 'false'}"
+                status, sent, elapsed, peak = await export(query)
+                assert status == 200, status
+                print(f"{size:>9} {export_format:>10} {batch_size:>6} {sent / 1e6:>8.1f} "
+                      f"{size / elapsed:>9.0f} {peak / 1e6:>8.2f}")
+        tracemalloc.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000", help="comma-separated message counts")
+    parser.add_argument("--formats", default="ndjson,csv,ndjson+gzip", help="comma-separated formats")
+    parser.add_argument("--batch-sizes", default="250,1000,5000", help="comma-separated EXPORT_BATCH_SIZE values")
+    args = parser.parse_args()
+    asyncio.run(run([int(s) for s in args.sizes.split(",")], args.formats.split(","),
+                    [int(b) for b in args.batch_sizes.split(",")]))
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Concurrent load benchmark replaying the backend_test.py scenarios.
+
+Workers pick scenarios at random from a weighted mix (create deliveries,
+update status, send messages, read conversations, read active customers)
+across a configurable set of drivers and customers, and the run reports
+p50/p95/p99 latency and requests per second per route.
+
+The app runs in-process over ASGI by default, or in a local uvicorn
+process with --target uvicorn. --storage memory (default) needs no
+database; --storage mongo uses a throwaway database on the server in
+backend/.env.
+
+Results can be saved with --output and compared with an earlier run with
+--baseline; the exit status is 1 when a route's p95 latency grew, or its
+throughput fell, by more than --threshold.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+import httpx  # noqa: E402
+
+DEFAULT_MIX = "create_delivery=2,update_status=2,send_message=4,read_conversation=4,read_active_customers=1"
+NEXT_STATUS = {"pending": "in_progress", "in_progress": "delivered"}
+SENDERS = ["driver", "customer"]
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name.strip()!r}; expected one of {', '.join(SCENARIOS)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+class Fleet:
+    """Drivers, their customers and the open deliveries created for them so far."""
+
+    def __init__(self, drivers: int, customers: int):
+        self.drivers = [f"driver_{i:03d}" for i in range(drivers)]
+        self.customers = [f"Customer {i}" for i in range(customers)]
+        # (delivery_id, status) per driver, for deliveries not yet delivered
+        self.deliveries = defaultdict(list)
+
+    def delivery(self, rng: random.Random, driver_id: str) -> dict:
+        customer = rng.randrange(len(self.customers))
+        return {
+            "driver_id": driver_id,
+            "customer_name": self.customers[customer],
+            "customer_phone": f"+1-555-{customer:04d}",
+            "address": f"{customer} Oak Street, Downtown",
+            "latitude": 40.70 + rng.uniform(0, 0.1),
+            "longitude": -74.02 + rng.uniform(0, 0.1),
+            "order_details": "2x Margherita Pizza, 1x Caesar Salad",
+        }
+
+
+# Each scenario issues one request and returns (route, response)
+
+async def create_delivery(http, fleet, rng):
+    driver_id = rng.choice(fleet.drivers)
+    response = await http.post("/api/deliveries", json=fleet.delivery(rng, driver_id))
+    if response.status_code == 200:
+        fleet.deliveries[driver_id].append((response.json()["id"], "pending"))
+    return "POST /api/deliveries", response
+
+
+async def update_status(http, fleet, rng):
+    """Advance one of the driver's open deliveries; creates one when none is left."""
+    driver_id = rng.choice(fleet.drivers)
+    open_deliveries = fleet.deliveries[driver_id]
+    if not open_deliveries:
+        return await create_delivery(http, fleet, rng)
+    # Taken out while in flight so that no other worker changes it concurrently
+    position = rng.randrange(len(open_deliveries))
+    open_deliveries[position], open_deliveries[-1] = open_deliveries[-1], open_deliveries[position]
+    delivery_id, status = open_deliveries.pop()
+    status = NEXT_STATUS[status]
+    response = await http.put(f"/api/deliveries/{delivery_id}/status", params={"status": status})
+    if response.status_code == 200 and status in NEXT_STATUS:
+        open_deliveries.append((delivery_id, status))
+    return "PUT /api/deliveries/{delivery_id}/status", response
+
+
+async def send_message(http, fleet, rng):
+    response = await http.post("/api/messages", json={
+        "driver_id": rng.choice(fleet.drivers),
+        "customer_name": rng.choice(fleet.customers),
+        "text": "On my way, about 5 minutes out",
+        "sender": rng.choice(SENDERS),
+    })
+    return "POST /api/messages", response
+
+
+async def read_conversation(http, fleet, rng):
+    response = await http.get(f"/api/messages/{rng.choice(fleet.drivers)}/{rng.choice(fleet.customers)}")
+    return "GET /api/messages/{driver_id}/{customer_name}", response
+
+
+async def read_active_customers(http, fleet, rng):
+    response = await http.get(f"/api/driver/{rng.choice(fleet.drivers)}/active-customers")
+    return "GET /api/driver/{driver_id}/active-customers", response
+
+
+SCENARIOS = {
+    "create_delivery": create_delivery,
+    "update_status": update_status,
+    "send_message": send_message,
+    "read_conversation": read_conversation,
+    "read_active_customers": read_active_customers,
+}
+
+
+async def seed(http, fleet, rng):
+    """One delivery per driver so that the first status updates have a target."""
+    for driver_id in fleet.drivers:
+        response = await http.post("/api/deliveries", json=fleet.delivery(rng, driver_id))
+        response.raise_for_status()
+        fleet.deliveries[driver_id].append((response.json()["id"], "pending"))
+
+
+async def worker(http, fleet, mix, seed_value, deadline, remaining, samples, errors):
+    rng = random.Random(seed_value)
+    names, weights = list(mix), list(mix.values())
+    while time.perf_counter() < deadline and remaining[0] > 0:
+        remaining[0] -= 1
+        scenario = SCENARIOS[rng.choices(names, weights)[0]]
+        started = time.perf_counter()
+        route, response = await scenario(http, fleet, rng)
+        samples[route].append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            errors[route] += 1
+
+
+async def drive(http, args) -> dict:
+    fleet = Fleet(args.drivers, args.customers)
+    await seed(http, fleet, random.Random(args.seed))
+    samples, errors = defaultdict(list), defaultdict(int)
+    remaining = [args.requests or float("inf")]
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        worker(http, fleet, args.mix, args.seed + i, started + args.duration, remaining, samples, errors)
+        for i in range(args.concurrency)
+    ))
+    elapsed = time.perf_counter() - started
+    routes = {}
+    for route, latencies in sorted(samples.items()):
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+        routes[route] = {
+            "requests": len(latencies),
+            "errors": errors[route],
+            "rps": len(latencies) / elapsed,
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "p99_ms": float(p99),
+        }
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "elapsed_s": elapsed,
+        "total_rps": sum(len(latencies) for latencies in samples.values()) / elapsed,
+        "routes": routes,
+    }
+
+
+async def run_asgi(args) -> dict:
+    import server
+    from storage import MemoryStorage, MongoStorage
+
+    database_name = f"bench_load_{uuid.uuid4().hex}"
+    if args.storage == "memory":
+        server.storage = MemoryStorage()
+    else:
+        server.storage = MongoStorage(server.client[database_name])
+    await server.storage.ensure_indexes()
+    transport = httpx.ASGITransport(app=server.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            return await drive(http, args)
+    finally:
+        if args.storage == "mongo":
+            await server.client.drop_database(database_name)
+
+
+async def run_uvicorn(args) -> dict:
+    database_name = f"bench_load_{uuid.uuid4().hex}"
+    env = {**os.environ, "STORAGE_ENGINE": args.storage, "DB_NAME": database_name}
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as http:
+            for _ in range(100):
+                try:
+                    (await http.get("/api/")).raise_for_status()
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError(f"uvicorn did not start on {base_url}")
+            return await drive(http, args)
+    finally:
+        process.terminate()
+        process.wait()
+        if args.storage == "mongo":
+            from pymongo import MongoClient
+            from dotenv import load_dotenv
+
+            load_dotenv(BACKEND_DIR / ".env")
+            MongoClient(os.environ["MONGO_URL"]).drop_database(database_name)
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Regressions of `results` against `baseline`, one line each."""
+    regressions = []
+    for route, current in results["routes"].items():
+        previous = baseline["routes"].get(route)
+        if previous is None:
+            continue
+        if current["p95_ms"] > previous["p95_ms"] * (1 + threshold):
+            regressions.append(f"{route}: p95 {previous['p95_ms']:.2f} -> {current['p95_ms']:.2f} ms")
+        if current["rps"] < previous["rps"] * (1 - threshold):
+            regressions.append(f"{route}: {previous['rps']:.0f} -> {current['rps']:.0f} requests/s")
+    return regressions
+
+
+def report(results: dict):
+    print(f"{results['config']['target']} / {results['config']['storage']}, "
+          f"{results['config']['concurrency']} workers, {results['elapsed_s']:.1f}s, "
+          f"{results['total_rps']:.0f} requests/s overall")
+    print(f"{'route':<48} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route, stats in results["routes"].items():
+        print(f"{route:<48} {stats['requests']:>8} {stats['errors']:>6} {stats['rps']:>8.0f} "
+              f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=["asgi", "uvicorn"], default="asgi")
+    parser.add_argument("--storage", choices=["memory", "mongo"], default="memory")
+    parser.add_argument("--port", type=int, default=8765, help="port for --target uvicorn")
+    parser.add_argument("--drivers", type=int, default=20)
+    parser.add_argument("--customers", type=int, default=10, help="customers shared by all drivers")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"scenario weights (default {DEFAULT_MIX})")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    parser.add_argument("--requests", type=int, default=0, help="stop after this many requests (0: no limit)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=Path, help="write results as JSON")
+    parser.add_argument("--baseline", type=Path, help="JSON results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+    # The app configures INFO logging; a line per request would dominate the profile
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    results = asyncio.run(run_asgi(args) if args.target == "asgi" else run_uvicorn(args))
+    report(results)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2, default=str))
+    if args.baseline:
+        regressions = compare(results, json.loads(args.baseline.read_text()), args.threshold)
+        print()
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Stop-order optimizer benchmark over the stop counts drivers carry in practice.
+
+Reports wall time (median of several runs), the mean route length of the
+nearest-neighbour order and of 2-opt, and the mean distance saved, for the
+default and a relaxed time budget.
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from routing import plan_route  # noqa: E402
+
+STOP_COUNTS = [5, 10, 20, 30, 50, 100, 200, 500]
+
+
+def run(budget_ms: float, repeats: int):
+    rng = np.random.default_rng(42)
+    start = (40.7128, -74.0060)
+    print(f"time budget {budget_ms:.0f} ms")
+    print(f"{'stops':>6} {'median ms':>10} {'max ms':>8} {'baseline km':>12} {'2-opt km':>9} {'saved':>7}")
+    for count in STOP_COUNTS:
+        timings, saved, baselines, totals = [], [], [], []
+        for _ in range(repeats):
+            stops = [(40.70 + lat, -74.02 + lon) for lat, lon in rng.uniform(0, 0.15, size=(count, 2))]
+            started = time.perf_counter()
+            plan = plan_route(start, stops, budget_ms / 1000)
+            timings.append((time.perf_counter() - started) * 1000)
+            baselines.append(plan["baseline_distance_km"])
+            totals.append(plan["total_distance_km"])
+            saved.append(1 - totals[-1] / baselines[-1])
+        print(f"{count:>6} {statistics.median(timings):>10.2f} {max(timings):>8.2f} "
+              f"{statistics.mean(baselines):>12.2f} {statistics.mean(totals):>9.2f} {statistics.mean(saved):>6.1%}")
+    print()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, nargs="*", default=[20, 200])
+    parser.add_argument("--repeats", type=int, default=15)
+    args = parser.parse_args()
+    for budget in args.budget_ms:
+        run(budget, args.repeats)
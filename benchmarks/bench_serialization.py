@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Per-request CPU cost of rendering a list page: the old path (build a model
+per document, validate against response_model, jsonable_encoder, json.dumps)
+versus the projection + orjson fast path. Checks both produce the same bytes.
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from bson import ObjectId
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+
+import server  # noqa: E402
+
+
+def messages(count):
+    start = datetime(2025, 7, 1, 12, 0, 0)
+    return [
+        {"_id": ObjectId(), "id": f"m{i:06d}", "driver_id": "driver_001", "customer_name": "Sarah Johnson",
+         "text": "I'll be there in 5 minutes, please meet me at the lobby", "sender": "driver",
+         "timestamp": start + timedelta(milliseconds=1500 * i)}
+        for i in range(count)
+    ]
+
+
+def deliveries(count):
+    start = datetime(2025, 7, 1, 12, 0, 0)
+    return [
+        {"_id": ObjectId(), "id": f"d{i:06d}", "driver_id": "driver_001", "customer_name": "Mike Chen",
+         "customer_phone": "+1-555-0456", "address": "456 Pine Avenue, Midtown",
+         "latitude": 40.7589 + i / 1e5, "longitude": -73.9851, "status": "pending",
+         "order_details": "1x Chicken Teriyaki Bowl, 1x Miso Soup", "created_at": start + timedelta(seconds=i),
+         "location": {"type": "Point", "coordinates": [-73.9851, 40.7589]}}
+        for i in range(count)
+    ]
+
+
+def legacy(page, model, field):
+    content = {**page, "items": [model(**doc) for doc in page["items"]]}
+    return JSONResponse(asyncio.run(serialize_response(field=field, response_content=content))).body
+
+
+def projected(docs, model):
+    """The documents as Mongo returns them under the fast path's projection."""
+    fields = set(model.model_fields)
+    return [{key: value for key, value in doc.items() if key in fields} for doc in docs]
+
+
+def cpu_ms(func, repeats):
+    started = time.process_time()
+    for _ in range(repeats):
+        func()
+    return (time.process_time() - started) / repeats * 1000
+
+
+def run(items, repeats):
+    cases = [
+        ("messages", server.Message, server.MessagePage, messages(items)),
+        ("deliveries", server.DeliveryLocation, server.DeliveryPage, deliveries(items)),
+    ]
+    print(f"{items} items per page, CPU ms per request (mean of {repeats})")
+    print(f"{'endpoint':<12} {'before':>9} {'after':>9} {'speedup':>8}")
+    for name, model, page_model, docs in cases:
+        page = {"items": docs, "next_cursor": "abc", "prev_cursor": None, "has_more": True}
+        field = create_response_field(name="response", type_=page_model)
+        fast_page = {**page, "items": projected(docs, model)}
+        assert legacy(page, model, field) == server.encode_page(fast_page, model), f"{name}: output differs"
+        before = cpu_ms(lambda: legacy(page, model, field), repeats)
+        after = cpu_ms(lambda: server.encode_page(fast_page, model), repeats)
+        print(f"{name:<12} {before:>9.2f} {after:>9.2f} {before / after:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+    run(args.items, args.repeats)
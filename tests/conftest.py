@@ -0,0 +1,55 @@
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+from dotenv import load_dotenv
+from fastapi.testclient import TestClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+load_dotenv(BACKEND_DIR / ".env")
+
+import server  # noqa: E402
+from cache import MemoryStore, ReadThroughCache  # noqa: E402
+from storage import MemoryStorage, MongoStorage  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def mongo_url():
+    """URL of a reachable MongoDB server; tests needing one are skipped otherwise."""
+    url = os.environ["MONGO_URL"]
+    try:
+        MongoClient(url, serverSelectionTimeoutMS=500).admin.command("ping")
+    except PyMongoError:
+        pytest.skip(f"MongoDB is not reachable at {url}")
+    return url
+
+
+@pytest.fixture
+def mongo_database(mongo_url):
+    """A throwaway Motor database, dropped after the test."""
+    name = f"test_{uuid.uuid4().hex}"
+    yield AsyncIOMotorClient(mongo_url)[name]
+    MongoClient(mongo_url).drop_database(name)
+
+
+@pytest.fixture(params=["memory", "mongo"])
+def storage(request):
+    """Each storage engine in turn; the Mongo one only when a server is reachable."""
+    if request.param == "memory":
+        return MemoryStorage()
+    return MongoStorage(request.getfixturevalue("mongo_database"))
+
+
+@pytest.fixture
+def api(storage, monkeypatch):
+    """Test client for the app running on `storage` with an empty cache."""
+    monkeypatch.setattr(server, "storage", storage)
+    monkeypatch.setattr(server, "cache", ReadThroughCache(MemoryStore(), ttl=60))
+    with TestClient(server.app) as client:
+        yield client
@@ -0,0 +1,92 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+from storage import MongoStorage
+
+DELIVERY = {"driver_id": "driver_001", "customer_phone": "+1-555-0123", "address": "123 Oak Street",
+            "latitude": 40.7128, "longitude": -74.0060}
+
+
+def test_view_tracks_creates_and_status_changes(api, storage):
+    def create(customer_name, order):
+        response = api.post("/api/deliveries", json={**DELIVERY, "customer_name": customer_name, "order_details": order})
+        return response.json()["id"]
+
+    def active():
+        response = api.get("/api/driver/driver_001/active-customers")
+        return {c["_id"]: c["latest_order"] for c in response.json()}
+
+    def check():
+        return api.portal.call(storage.deliveries.check_active_customers)
+
+    def deliver(delivery_id):
+        for status in ("in_progress", "delivered"):
+            assert api.put(f"/api/deliveries/{delivery_id}/status", params={"status": status}).status_code == 200
+
+    sarah_first = create("Sarah Johnson", "Pizza")
+    sarah_second = create("Sarah $name", "Salad")
+    mike = create("Mike Chen", "Teriyaki Bowl")
+    sarah_latest = create("Sarah Johnson", "Lasagna")
+    assert active() == {"Sarah Johnson": "Lasagna", "Sarah $name": "Salad", "Mike Chen": "Teriyaki Bowl"}
+
+    deliver(sarah_latest)
+    api.put(f"/api/deliveries/{mike}/status", params={"status": "in_progress"})
+    deliver(sarah_second)
+    assert active() == {"Sarah Johnson": "Pizza", "Mike Chen": "Teriyaki Bowl"}
+
+    deliver(sarah_first)
+    assert active() == {"Mike Chen": "Teriyaki Bowl"}
+    assert check() == []
+
+
+def test_rebuild_repairs_a_drifted_view(api, storage):
+    for customer_name in ("Sarah Johnson", "Mike Chen"):
+        api.post("/api/deliveries", json={**DELIVERY, "customer_name": customer_name, "order_details": "Pizza"})
+    delivery_id = api.get("/api/deliveries/driver_001").json()["items"][0]["id"]
+    # Change a status behind the view's back
+    api.portal.call(storage.deliveries.apply_transitions, [(delivery_id, "in_progress")])
+    api.portal.call(storage.deliveries.apply_transitions, [(delivery_id, "delivered")])
+
+    assert api.portal.call(storage.deliveries.check_active_customers) == ["driver_001"]
+    assert api.portal.call(storage.deliveries.rebuild_active_customers) == 1
+    assert api.portal.call(storage.deliveries.check_active_customers) == []
+    assert len(api.get("/api/driver/driver_001/active-customers").json()) == 1
+
+
+@pytest.mark.parametrize("open_before", [True, False])
+def test_refresh_keeps_an_entry_created_concurrently(mongo_database, open_before):
+    """A delivery created and merged between the refresh's read and its update stays in the view."""
+    now = datetime(2024, 6, 1, 12, 0)
+
+    def delivery(delivery_id, minutes, status="pending"):
+        return server.delivery_document(server.DeliveryLocation(
+            **DELIVERY, id=delivery_id, customer_name="Sarah Johnson", order_details=delivery_id, status=status,
+            created_at=now + timedelta(minutes=minutes)))
+
+    async def run():
+        storage = MongoStorage(mongo_database)
+        await storage.ensure_indexes()
+        deliveries = storage.deliveries
+        await deliveries.insert_many([delivery("old", 0, "pending" if open_before else "delivered")])
+        await deliveries.merge_active_customers([delivery("old", 0)])
+        read = deliveries._latest_open
+
+        async def racing_read(driver_id, customer_name):
+            latest = await read(driver_id, customer_name)
+            if not getattr(racing_read, "raced", False):
+                racing_read.raced = True
+                created = delivery("new", 5)
+                await deliveries.insert_many([created])
+                await deliveries.merge_active_customers([created])
+            return latest
+
+        deliveries._latest_open = racing_read
+        await deliveries.refresh_active_customer("driver_001", "Sarah Johnson")
+        return await deliveries.active_customers("driver_001"), await deliveries.check_active_customers()
+
+    customers, drifted = asyncio.run(run())
+    assert [entry["delivery_id"] for entry in customers] == ["new"]
+    assert drifted == []
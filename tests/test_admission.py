@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+from prometheus_client import REGISTRY
+
+import server
+from admission import ConcurrencyLimiter, Overloaded, TokenBuckets, load_limiters, load_policies
+
+MESSAGE = {"driver_id": "driver_001", "customer_name": "Sarah Johnson", "text": "hi", "sender": "driver"}
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_limiter_queues_in_order_and_sheds_the_excess():
+    async def run():
+        limiter = ConcurrencyLimiter("POST", "/test", limit=1, queue=2, timeout=1.0)
+        order = []
+
+        async def request(name):
+            await limiter.acquire()
+            order.append(name)
+            await asyncio.sleep(0.01)
+            limiter.release()
+
+        await limiter.acquire()
+        waiting = [asyncio.create_task(request(name)) for name in ("a", "b")]
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as rejected:
+            await limiter.acquire()
+        limiter.release()
+        await asyncio.gather(*waiting)
+        return order, rejected.value.reason, limiter.in_flight, len(limiter.waiters)
+
+    assert asyncio.run(run()) == (["a", "b"], "queue_full", 0, 0)
+
+
+def test_waiters_give_up_at_the_deadline():
+    async def run():
+        limiter = ConcurrencyLimiter("POST", "/deadline", limit=1, queue=5, timeout=0.01)
+        await limiter.acquire()
+        with pytest.raises(Overloaded) as rejected:
+            await limiter.acquire()
+        # A cancelled waiter does not keep or leak a slot either
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        limiter.release()
+        return rejected.value.reason, limiter.in_flight, len(limiter.waiters)
+
+    before = sample("admission_rejected_total", method="POST", route="/deadline", reason="deadline")
+    assert asyncio.run(run()) == ("deadline", 0, 0)
+    assert sample("admission_rejected_total", method="POST", route="/deadline", reason="deadline") == before + 1
+
+
+def test_overloaded_route_answers_503_with_retry_after(api, monkeypatch):
+    limiter = ConcurrencyLimiter("POST", "/api/messages", limit=0, queue=0, timeout=1.0, retry_after=2.5)
+    monkeypatch.setitem(server.admission_limiters, "POST /api/messages", limiter)
+
+    response = api.post("/api/messages", json=MESSAGE)
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "3"
+    assert api.get("/api/messages/driver_001").status_code == 200
+    assert sample("admission_queue_depth", method="POST", route="/api/messages") == 0
+
+
+def test_token_buckets_refill_over_time():
+    now = [0.0]
+    buckets = TokenBuckets(rate=2, burst=2, clock=lambda: now[0])
+    assert [buckets.take("driver_001") for _ in range(3)] == [None, None, 0.5]
+    assert buckets.take("driver_002") is None
+    now[0] = 0.5
+    assert buckets.take("driver_001") is None
+    assert buckets.take("driver_001") == pytest.approx(0.5)
+
+
+def test_driver_rate_limit_answers_429(api, monkeypatch):
+    monkeypatch.setattr(server, "driver_buckets", TokenBuckets(rate=0.5, burst=1))
+    assert api.post("/api/messages", json=MESSAGE).status_code == 200
+    response = api.post("/api/messages", json=MESSAGE)
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "2"
+    assert api.post("/api/messages", json={**MESSAGE, "driver_id": "driver_002"}).status_code == 200
+
+
+def test_policies_can_be_overridden_or_lifted():
+    defaults = {"POST /a": {"limit": 1, "queue": 2, "timeout": 1.0}, "POST /b": {"limit": 1, "queue": 2, "timeout": 1.0}}
+    policies = load_policies(defaults, '{"POST /a": {"limit": 8}, "POST /b": null}')
+    assert policies == {"POST /a": {"limit": 8, "queue": 2, "timeout": 1.0}}
+    assert load_limiters(policies)["POST /a"].limit == 8
@@ -0,0 +1,99 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+import storage as storage_module
+from storage import MongoStorage, status_event
+
+DELIVERY = {"driver_id": "driver_001", "customer_name": "Sarah Johnson", "customer_phone": "+1-555-0123",
+            "address": "123 Oak Street", "latitude": 40.7128, "longitude": -74.0060, "order_details": "Pizza"}
+
+
+@pytest.fixture
+def changed_at(monkeypatch):
+    """The time every status change is stamped with: shortly after the deliveries
+    the test creates, so their delivery times are positive and all fall in one hour."""
+    now = datetime.utcnow() + timedelta(seconds=30)
+
+    class Clock(datetime):
+        @classmethod
+        def utcnow(cls):
+            return now
+
+    monkeypatch.setattr(storage_module, "datetime", Clock)
+    return now
+
+
+def test_status_changes_feed_the_driver_rollups(api, changed_at):
+    ids = [api.post("/api/deliveries", json=DELIVERY).json()["id"] for _ in range(3)]
+    api.post("/api/deliveries/status", json=[{"delivery_id": i, "status": "in_progress"} for i in ids])
+    api.post("/api/deliveries/status", json=[{"delivery_id": i, "status": "delivered"} for i in ids[:2]])
+    # Rejected and repeated changes record nothing
+    assert api.put(f"/api/deliveries/{ids[0]}/status", params={"status": "delivered"}).status_code == 409
+
+    [row] = api.get("/api/analytics/drivers/driver_001").json()
+    assert datetime.fromisoformat(row["period"]) == changed_at.replace(minute=0, second=0, microsecond=0)
+    assert (row["started"], row["delivered"]) == (3, 2)
+    assert 0 <= row["avg_delivery_seconds"] <= row["max_delivery_seconds"] < 60
+
+    daily = api.get("/api/analytics/drivers", params={"granularity": "day"}).json()
+    assert [(r["driver_id"], r["delivered"]) for r in daily] == [("driver_001", 2)]
+    later = (changed_at + timedelta(days=2)).isoformat()
+    assert api.get("/api/analytics/drivers", params={"start": later}).json() == []
+
+
+def test_periods_without_deliveries_have_no_delivery_time(api):
+    delivery_id = api.post("/api/deliveries", json=DELIVERY).json()["id"]
+    api.put(f"/api/deliveries/{delivery_id}/status", params={"status": "in_progress"})
+    [row] = api.get("/api/analytics/drivers/driver_001", params={"granularity": "day"}).json()
+    assert (row["started"], row["delivered"], row["avg_delivery_seconds"]) == (1, 0, None)
+    assert api.get("/api/analytics/drivers", params={"granularity": "week"}).status_code == 422
+
+
+def test_failed_recording_leaves_the_events_queued(api, storage, monkeypatch):
+    delivery_id = api.post("/api/deliveries", json=DELIVERY).json()["id"]
+    api.put(f"/api/deliveries/{delivery_id}/status", params={"status": "in_progress"})
+    assert [c["_id"] for c in api.get("/api/driver/driver_001/active-customers").json()] == ["Sarah Johnson"]
+    assert api.get("/api/deliveries/driver_001").json()["items"][0]["status"] == "in_progress"
+
+    async def failing(events):
+        raise RuntimeError("events store unavailable")
+
+    record = storage.status_events.record
+    monkeypatch.setattr(storage.status_events, "record", failing)
+    assert api.put(f"/api/deliveries/{delivery_id}/status", params={"status": "delivered"}).status_code == 200
+    assert api.get("/api/driver/driver_001/active-customers").json() == []
+    assert api.get("/api/deliveries/driver_001").json()["items"][0]["status"] == "delivered"
+    [row] = api.get("/api/analytics/drivers/driver_001").json()
+    assert (row["started"], row["delivered"]) == (1, 0)
+    with pytest.raises(RuntimeError):
+        api.portal.call(server.record_queued_status_events)
+
+    monkeypatch.setattr(storage.status_events, "record", record)
+    assert api.portal.call(server.record_queued_status_events) == 1
+    assert api.portal.call(server.record_queued_status_events) == 0
+    [row] = api.get("/api/analytics/drivers/driver_001").json()
+    assert (row["started"], row["delivered"]) == (1, 1)
+
+
+def test_recording_again_completes_the_rollups(mongo_database):
+    """Events stored before the rollups counted them are counted once when recorded again."""
+    now = datetime(2024, 6, 1, 12, 0)
+    events = [status_event({"delivery_id": f"d{i}", "driver_id": "driver_001", "previous_status": "in_progress",
+                            "status": "delivered", "changed_at": now + timedelta(minutes=i), "created_at": now})
+              for i in range(3)]
+
+    async def run():
+        storage = MongoStorage(mongo_database)
+        await storage.ensure_indexes()
+        await storage.status_events.record(events[:1])
+        await mongo_database.status_events.insert_many([{**event, "rollup_claim": None} for event in events[1:]])
+        recorded = [await storage.status_events.record(events), await storage.status_events.record(events)]
+        return recorded, await storage.status_events.rollups("hour", {}, None, None, 10)
+
+    recorded, [rollup] = asyncio.run(run())
+    assert recorded == [0, 0]
+    assert (rollup["delivered"], rollup["delivery_seconds_total"]) == (3, 180.0)
+    assert "event_ids" not in rollup
@@ -0,0 +1,101 @@
+import asyncio
+
+from cache import MemoryStore, ReadThroughCache, cache_tag
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Loader:
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        return {"items": [self.calls]}
+
+
+def test_memory_store_evicts_least_recently_used():
+    async def run():
+        store = MemoryStore(max_entries=2)
+        await store.set("a", 1, 60)
+        await store.set("b", 2, 60)
+        await store.get("a")
+        await store.set("c", 3, 60)
+        return [await store.get(key) for key in "abc"], store.stats()
+
+    values, stats = asyncio.run(run())
+    assert values == [1, None, 3]
+    assert stats["evictions"] == 1
+
+
+def test_memory_store_expires_entries():
+    clock = Clock()
+
+    async def run():
+        store = MemoryStore(clock=clock)
+        await store.set("a", 1, 5)
+        clock.now = 4.9
+        fresh = await store.get("a")
+        clock.now = 5.0
+        return fresh, await store.get("a"), store.stats()
+
+    fresh, expired, stats = asyncio.run(run())
+    assert (fresh, expired) == (1, None)
+    assert stats["expirations"] == 1
+
+
+def test_read_through_hits_until_invalidated():
+    async def run():
+        cache = ReadThroughCache(MemoryStore(), ttl=60)
+        load_a, load_b = Loader(), Loader()
+        first = await cache.get_or_load("deliveries:d1", "100", load_a)
+        second = await cache.get_or_load("deliveries:d1", "100", load_a)
+        other = await cache.get_or_load("deliveries:d2", "100", load_b)
+        await cache.invalidate("deliveries:d1")
+        third = await cache.get_or_load("deliveries:d1", "100", load_a)
+        untouched = await cache.get_or_load("deliveries:d2", "100", load_b)
+        return first, second, third, other, untouched, load_a.calls, load_b.calls, cache.stats()
+
+    first, second, third, other, untouched, calls_a, calls_b, stats = asyncio.run(run())
+    assert first == second == {"items": [1]}
+    assert third == {"items": [2]}
+    assert other == untouched
+    assert (calls_a, calls_b) == (2, 1)
+    assert (stats["hits"], stats["misses"], stats["invalidations"]) == (2, 3, 1)
+
+
+def test_evicted_version_never_resurrects_stale_entries():
+    async def run():
+        store = MemoryStore(max_entries=3)
+        cache = ReadThroughCache(store, ttl=60)
+        loader = Loader()
+        await cache.get_or_load("messages:d1", "page", loader)
+        # Push the tag's version out of the store while its entry may survive
+        for key in range(3):
+            await store.set(f"filler:{key}", key, 60)
+        return await cache.get_or_load("messages:d1", "page", loader), loader.calls
+
+    value, calls = asyncio.run(run())
+    assert value == {"items": [2]}
+    assert calls == 2
+
+
+def test_tags_of_different_parts_never_collide():
+    assert cache_tag("conversation", "a:b", "c") != cache_tag("conversation", "a", "b:c")
+    assert cache_tag("messages", "d1@x") != cache_tag("messages", "d1") + "@x"
+
+    async def run():
+        cache = ReadThroughCache(MemoryStore(), ttl=60)
+        loader = Loader()
+        first = await cache.get_or_load(cache_tag("conversation", "a:b", "c"), "page", loader)
+        await cache.invalidate(cache_tag("conversation", "a", "b:c"))
+        return first, await cache.get_or_load(cache_tag("conversation", "a:b", "c"), "page", loader), loader.calls
+
+    first, second, calls = asyncio.run(run())
+    assert first == second and calls == 1
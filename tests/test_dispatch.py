@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from dispatch import assign, plan_dispatch
+from routing import haversine_km
+
+DELIVERY = {"customer_name": "Sarah Johnson", "customer_phone": "+1-555-0123", "address": "123 Oak Street",
+            "order_details": "Pizza"}
+
+
+def greedy(costs, capacities, max_cost=None):
+    """Reference assignment: every (delivery, driver) pair, closest first."""
+    count, drivers = costs.shape
+    remaining, assigned = list(capacities), [-1] * count
+    for flat in np.argsort(costs, axis=None, kind="stable"):
+        row, column = divmod(int(flat), drivers)
+        if max_cost is not None and costs[row, column] > max_cost:
+            break
+        if assigned[row] < 0 and remaining[column] > 0:
+            assigned[row] = column
+            remaining[column] -= 1
+    return assigned
+
+
+def test_distances_are_great_circle_distances():
+    deliveries = [(40.7128, -74.0060), (40.7129, -74.0060), (34.0522, -118.2437)]
+    plan = plan_dispatch(deliveries, [(40.7128, -74.0060)], [3])
+    assert [distance for _, _, distance in plan] == pytest.approx(
+        [haversine_km(deliveries[0], point) for point in deliveries], abs=1e-6)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_assignment_matches_closest_pair_first(seed):
+    rng = np.random.default_rng(seed)
+    costs = rng.uniform(0, 10, size=(rng.integers(1, 200), rng.integers(1, 40)))
+    capacities = rng.integers(0, 6, size=costs.shape[1])
+    max_cost = [None, 4.0][seed % 2]
+    assigned = assign(costs, capacities, max_cost)
+    assert list(assigned) == greedy(costs, capacities, max_cost)
+    assert all(np.bincount(assigned[assigned >= 0], minlength=len(capacities)) <= capacities)
+
+
+def test_plan_dispatch_sends_each_driver_its_nearest_deliveries():
+    deliveries = [(40.70, -74.00), (40.80, -74.00), (40.701, -74.00), (41.50, -74.00)]
+    drivers = [(40.70, -74.001), (40.80, -74.001)]
+    plan = plan_dispatch(deliveries, drivers, [1, 5], max_distance_km=20)
+    assert [(row, column) for row, column, _ in plan] == [(0, 0), (1, 1), (2, 1)]
+    assert plan[0][2] == pytest.approx(0.084, abs=0.001)
+    assert plan_dispatch([], drivers, [1, 1]) == []
+
+
+def test_dispatch_assigns_unassigned_deliveries(api):
+    near_a = api.post("/api/deliveries", json={**DELIVERY, "latitude": 40.70, "longitude": -74.00}).json()
+    near_b = api.post("/api/deliveries", json={**DELIVERY, "customer_name": "Tom Lee",
+                                               "latitude": 40.80, "longitude": -74.00}).json()
+    far = api.post("/api/deliveries", json={**DELIVERY, "latitude": 45.0, "longitude": -74.00}).json()
+    assert near_a["driver_id"] is None
+    assert api.put(f"/api/deliveries/{near_a['id']}/status", params={"status": "in_progress"}).json() == {
+        "detail": "Delivery is not assigned to a driver"}
+
+    body = {"drivers": [
+        {"driver_id": "driver_a", "latitude": 40.701, "longitude": -74.00, "capacity": 2},
+        {"driver_id": "driver_b", "latitude": 40.801, "longitude": -74.00},
+    ], "max_distance_km": 50}
+    assert api.get("/api/deliveries/driver_a").json()["items"] == []
+    result = api.post("/api/dispatch", json=body).json()
+
+    assert (result["considered"], result["assigned"], result["unassigned"]) == (3, 2, 1)
+    assert {(a["delivery_id"], a["driver_id"]) for a in result["assignments"]} == {
+        (near_a["id"], "driver_a"), (near_b["id"], "driver_b")}
+    assert result["total_distance_km"] == pytest.approx(0.222, abs=0.001)
+    assert [d["id"] for d in api.get("/api/deliveries/driver_a").json()["items"]] == [near_a["id"]]
+    assert [c["_id"] for c in api.get("/api/driver/driver_b/active-customers").json()] == ["Tom Lee"]
+    assert api.put(f"/api/deliveries/{near_a['id']}/status", params={"status": "in_progress"}).status_code == 200
+
+    again = api.post("/api/dispatch", json=body).json()
+    assert (again["considered"], again["assigned"]) == (1, 0)
+    body["max_distance_km"] = None
+    assert api.post("/api/dispatch", json=body).json()["assignments"][0]["delivery_id"] == far["id"]
+
+
+def test_dispatch_rejects_duplicate_drivers(api):
+    driver = {"driver_id": "driver_a", "latitude": 40.7, "longitude": -74.0}
+    assert api.post("/api/dispatch", json={"drivers": [driver, driver]}).status_code == 422
@@ -0,0 +1,59 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+import server
+from storage import MemoryStorage
+from tiering import TieringPolicy, archive_cold
+
+NOW = datetime(2024, 6, 1, 12, 0, 0)
+
+
+def message(i, age_days, driver_id="driver_001"):
+    return server.Message(id=f"m{i}", driver_id=driver_id, customer_name="Sarah Johnson", text=f"text {i}",
+                          sender="driver", timestamp=NOW - timedelta(days=age_days)).dict()
+
+
+def seed(api, storage):
+    for i, age in enumerate([60, 40, 10, 5, 1]):
+        api.portal.call(storage.messages.insert, message(i, age))
+    api.portal.call(storage.messages.insert, message(9, 5, driver_id="driver_002"))
+    policy = TieringPolicy(message_max_age=timedelta(days=30), delivered_max_age=timedelta(days=1))
+    api.portal.call(archive_cold, storage, policy, NOW)
+
+
+def test_export_streams_archive_then_hot_documents_in_range(api, storage, monkeypatch):
+    monkeypatch.setattr(server, "EXPORT_BATCH_SIZE", 2)
+    seed(api, storage)
+
+    response = api.get("/api/export/messages/driver_001", params={"start": (NOW - timedelta(days=50)).isoformat(),
+                                                                   "end": (NOW - timedelta(days=2)).isoformat()})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["id"] for row in rows] == ["m1", "m2", "m3"]
+    assert set(rows[0]) == set(server.Message.model_fields)
+
+
+def test_export_as_gzipped_csv(api, storage):
+    seed(api, storage)
+
+    response = api.get("/api/export/messages/driver_001", params={"format": "csv", "gzip": True})
+    assert response.headers["content-encoding"] == "gzip"
+    assert 'filename="message-driver_001.csv"' in response.headers["content-disposition"]
+    # The client has already gunzipped the body
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["id"] for row in rows] == ["m0", "m1", "m2", "m3", "m4"]
+    assert rows[0]["timestamp"] == (NOW - timedelta(days=60)).isoformat()
+
+
+def test_export_rejects_unknown_formats(api):
+    assert api.get("/api/export/deliveries/driver_001", params={"format": "xml"}).status_code == 422
+
+
+def test_memory_archives_index_the_export_filter():
+    """Without an index on the filter, every export batch rescans the whole archive."""
+    storage = MemoryStorage()
+    for archive in (storage.messages_archive, storage.deliveries_archive):
+        assert ("driver_id",) in [index.key_fields for index in archive.store.indexes]
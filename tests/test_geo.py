@@ -0,0 +1,50 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+import server
+from storage import MongoStorage
+
+DELIVERY = {"driver_id": "driver_001", "customer_name": "Sarah Johnson", "customer_phone": "+1-555-0123",
+            "address": "123 Oak Street, Downtown", "latitude": 40.7128, "longitude": -74.0060,
+            "order_details": "2x Margherita Pizza"}
+
+POINTS = {"far": (40.7831, -73.9712), "near": (40.7130, -74.0050), "mid": (40.7306, -73.9866)}
+
+
+def test_stored_delivery_has_geojson_point():
+    doc = server.delivery_document(server.DeliveryLocation(**DELIVERY))
+    assert doc["location"] == {"type": "Point", "coordinates": [-74.0060, 40.7128]}
+
+
+def test_out_of_range_coordinates_are_rejected():
+    response = TestClient(server.app).post("/api/deliveries", json={**DELIVERY, "latitude": 140.0})
+    assert response.status_code == 422
+
+
+def test_nearby_deliveries_sorted_by_distance(api):
+    for label, (latitude, longitude) in POINTS.items():
+        api.post("/api/deliveries", json={**DELIVERY, "customer_name": label,
+                                          "latitude": latitude, "longitude": longitude})
+    response = api.get("/api/deliveries/nearby", params={
+        "latitude": 40.7128, "longitude": -74.0060, "max_distance_km": 5, "status": "pending"})
+
+    assert response.status_code == 200
+    results = response.json()
+    assert [r["customer_name"] for r in results] == ["near", "mid"]
+    assert results[0]["distance_m"] < results[1]["distance_m"] < 5000
+
+
+def test_backfill_adds_locations_to_old_deliveries(mongo_database):
+    async def run():
+        storage = MongoStorage(mongo_database)
+        await storage.ensure_indexes()
+        for label, (latitude, longitude) in POINTS.items():
+            await mongo_database.deliveries.insert_one(server.DeliveryLocation(
+                **{**DELIVERY, "customer_name": label, "latitude": latitude, "longitude": longitude}).dict())
+        backfilled = await storage.deliveries.backfill_locations()
+        return backfilled, await storage.deliveries.nearby(40.7128, -74.0060, 5000, {}, 10)
+
+    backfilled, nearby = asyncio.run(run())
+    assert backfilled == 3
+    assert [d["customer_name"] for d in nearby] == ["near", "mid"]
@@ -0,0 +1,39 @@
+import time
+
+
+def send(api, customer_name, text, sender="customer", driver_id="driver_001"):
+    # Stored timestamps have millisecond resolution; keep the messages in order
+    time.sleep(0.002)
+    response = api.post("/api/messages", json={"driver_id": driver_id, "customer_name": customer_name,
+                                               "text": text, "sender": sender})
+    return response.json()
+
+
+def inbox(api):
+    return [(c["customer_name"], c["last_message"]["text"], c["unread_count"])
+            for c in api.get("/api/driver/driver_001/inbox").json()]
+
+
+def test_inbox_lists_conversations_with_unread_counts(api):
+    send(api, "Sarah Johnson", "Where are you?")
+    send(api, "Sarah Johnson", "Ring the bell")
+    send(api, "Mike Chen", "Hi")
+    send(api, "Mike Chen", "On my way", sender="driver")
+    send(api, "Emily Rodriguez", "Other driver", driver_id="driver_002")
+
+    assert inbox(api) == [("Mike Chen", "On my way", 1), ("Sarah Johnson", "Ring the bell", 2)]
+
+    marker = api.put("/api/messages/driver_001/Sarah Johnson/read").json()
+    assert marker["customer_name"] == "Sarah Johnson"
+    send(api, "Sarah Johnson", "Thanks!")
+    assert inbox(api) == [("Sarah Johnson", "Thanks!", 1), ("Mike Chen", "On my way", 1)]
+
+
+def test_read_marker_never_moves_back(api):
+    first = send(api, "Sarah Johnson", "Where are you?")
+    send(api, "Sarah Johnson", "Ring the bell")
+    latest = api.put("/api/messages/driver_001/Sarah Johnson/read").json()["read_at"]
+
+    stale = api.put("/api/messages/driver_001/Sarah Johnson/read", params={"read_at": first["timestamp"] + "Z"})
+    assert stale.json()["read_at"] == latest
+    assert inbox(api) == [("Sarah Johnson", "Ring the bell", 0)]
@@ -0,0 +1,246 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import server
+import storage
+
+
+def plan_stages(explain):
+    """Collect every stage name that appears under a winningPlan in an explain document."""
+    stages = []
+
+    def walk(node, in_plan):
+        if isinstance(node, dict):
+            if in_plan and "stage" in node:
+                stages.append(node["stage"])
+            for key, value in node.items():
+                walk(value, in_plan or key == "winningPlan")
+        elif isinstance(node, list):
+            for item in node:
+                walk(item, in_plan)
+
+    walk(explain, False)
+    return stages
+
+
+def plan_nodes(explain):
+    """Every stage document under a winningPlan in an explain document."""
+    nodes = []
+
+    def walk(node, in_plan):
+        if isinstance(node, dict):
+            if in_plan and "stage" in node:
+                nodes.append(node)
+            for key, value in node.items():
+                walk(value, in_plan or key == "winningPlan")
+        elif isinstance(node, list):
+            for item in node:
+                walk(item, in_plan)
+
+    walk(explain, False)
+    return nodes
+
+
+async def seed(database):
+    now = datetime.utcnow()
+    statuses = ["pending", "in_progress", "delivered"]
+    await database.messages.insert_many([
+        server.Message(
+            driver_id=f"driver_{i % 10}",
+            customer_name=f"customer_{i % 7}",
+            text=f"message {i}",
+            sender="driver",
+            timestamp=now + timedelta(seconds=i),
+        ).dict()
+        for i in range(500)
+    ])
+    await database.deliveries.insert_many([
+        server.delivery_document(server.DeliveryLocation(
+            driver_id=f"driver_{i % 10}",
+            customer_name=f"customer_{i % 7}",
+            customer_phone="+1-555-0100",
+            address=f"{i} Main Street",
+            latitude=40.7 + (i % 50) / 1000,
+            longitude=-74.0,
+            status=statuses[i % 3],
+            order_details="1x Pizza",
+            created_at=now + timedelta(seconds=i),
+        ))
+        for i in range(500)
+    ])
+    await storage.MongoStorage(database).deliveries.rebuild_active_customers()
+
+
+async def explain_find(collection, shape):
+    query, order, limit = shape
+    return await collection.find(query).sort(order).limit(limit).explain()
+
+
+async def explain_route_queries(database):
+    """Explain the query shapes the repositories build for each route, including a deep keyset page."""
+    cursor = server.encode_cursor({"timestamp": datetime.utcnow(), "id": "m"}, "timestamp")
+    position = server.decode_cursor(cursor)
+    messages, deliveries = storage.MongoMessageRepository, storage.MongoDeliveryRepository
+    driver, conversation = {"driver_id": "driver_1"}, {"driver_id": "driver_1", "customer_name": "customer_1"}
+    return {
+        "get_driver_messages": await explain_find(database.messages, storage.page_query(
+            driver, messages.order_field, messages.order, 100)),
+        "get_driver_messages?after": await explain_find(database.messages, storage.page_query(
+            driver, messages.order_field, messages.order, 100, after=position)),
+        "get_conversation": await explain_find(database.messages, storage.page_query(
+            conversation, messages.order_field, messages.order, 100)),
+        "get_conversation?before": await explain_find(database.messages, storage.page_query(
+            conversation, messages.order_field, messages.order, 100, before=position)),
+        "sync_driver messages": await explain_find(database.messages, storage.changes_query("driver_1", 10, 501)),
+        "sync_driver deliveries": await explain_find(database.deliveries, storage.changes_query("driver_1", 10, 501)),
+        "get_driver_deliveries": await explain_find(database.deliveries, storage.page_query(
+            driver, deliveries.order_field, deliveries.order, 100)),
+        "update_delivery_status": await database.command(
+            "explain",
+            {"update": "deliveries", "updates": [
+                {"q": {"id": "missing"}, "u": {"$set": {"status": "delivered"}}}
+            ]},
+        ),
+        "get_active_customers": await database.active_customers.find(
+            {"driver_id": "driver_1"}
+        ).explain(),
+        "refresh_active_customer": await explain_find(
+            database.deliveries, storage.latest_open_query("driver_1", "customer_1")),
+        "get_driver_route": await explain_find(database.deliveries, storage.open_deliveries_query("driver_1", 200)),
+        "archive_cold messages": await explain_find(
+            database.messages, storage.cold_messages_query(datetime.utcnow(), 1000)),
+        "archive_cold deliveries": await explain_find(
+            database.deliveries, storage.cold_deliveries_query(datetime.utcnow(), 1000)),
+        "get_driver_analytics": await explain_find(
+            database.driver_rollups, storage.rollups_query("hour", driver, position[0], None, 500)),
+        "get_fleet_analytics": await explain_find(
+            database.driver_rollups, storage.rollups_query("day", {}, position[0], None, 500)),
+        "get_nearby_deliveries": await database.command(
+            "explain",
+            {"aggregate": "deliveries", "pipeline": [
+                {"$geoNear": {"near": storage.geo_point(40.7, -74.0), "key": "location",
+                              "distanceField": "distance_m", "maxDistance": 5000,
+                              "query": {"status": "pending"}, "spherical": True}},
+                {"$limit": 20},
+            ], "cursor": {}},
+        ),
+    }
+
+
+def test_route_queries_use_indexes(mongo_url):
+    async def run():
+        client = AsyncIOMotorClient(mongo_url)
+        database = client[f"test_indexes_{uuid.uuid4().hex}"]
+        try:
+            await storage.MongoStorage(database).ensure_indexes()
+            await seed(database)
+            return await explain_route_queries(database)
+        finally:
+            await client.drop_database(database.name)
+            client.close()
+
+    for route, explain in asyncio.run(run()).items():
+        stages = plan_stages(explain)
+        assert stages, f"{route}: no winning plan in explain output"
+        assert "COLLSCAN" not in stages, f"{route} falls back to a collection scan: {stages}"
+        assert "SORT" not in stages, f"{route} sorts in memory: {stages}"
+
+
+def test_inbox_uses_indexes(mongo_url):
+    """Explain both reads the inbox runs, as MongoMessageRepository.inbox builds them."""
+    async def run():
+        client = AsyncIOMotorClient(mongo_url)
+        database = client[f"test_indexes_{uuid.uuid4().hex}"]
+        try:
+            mongo = storage.MongoStorage(database)
+            await mongo.ensure_indexes()
+            await seed(database)
+            await mongo.messages.rebuild_conversations()
+            query, order = storage.inbox_query("driver_1")
+            latest = await database.command(
+                "explain", {"find": "conversations", "filter": query, "sort": dict(order)}, verbosity="executionStats")
+            read_at = {f"customer_{i}": datetime.utcnow() - timedelta(seconds=i) for i in range(7)}
+            unread = await database.command("explain", {
+                "aggregate": "messages", "pipeline": storage.unread_pipeline("driver_1", read_at), "cursor": {}})
+            return latest, unread
+        finally:
+            await client.drop_database(database.name)
+            client.close()
+
+    latest, unread = asyncio.run(run())
+    stages, nodes = plan_stages(latest), plan_nodes(latest)
+    assert "SORT" not in stages, f"inbox sorts conversations in memory: {stages}"
+    assert {node["indexName"] for node in nodes if "indexName" in node} == {"driver_last_message"}
+    # driver_1 talks to 7 customers: one key per conversation, however long
+    stats = latest["executionStats"]
+    assert (stats["nReturned"], stats["totalKeysExamined"], stats["totalDocsExamined"]) == (7, 7, 7)
+
+    stages, nodes = plan_stages(unread), plan_nodes(unread)
+    assert "COLLSCAN" not in stages, f"inbox unread counts fall back to a collection scan: {stages}"
+    assert {node["indexName"] for node in nodes if "indexName" in node} == {"driver_customer_sender_timestamp"}
+
+
+def test_search_uses_the_text_indexes(mongo_url):
+    """Ranking sorts the matches, so only the match itself must come from an index."""
+    async def run():
+        client = AsyncIOMotorClient(mongo_url)
+        database = client[f"test_indexes_{uuid.uuid4().hex}"]
+        try:
+            await storage.MongoStorage(database).ensure_indexes()
+            await seed(database)
+            explains = {}
+            for collection, repository, text in [("messages", storage.MongoMessageRepository, "message 42"),
+                                                 ("deliveries", storage.MongoDeliveryRepository, "main pizza")]:
+                pipeline = storage.search_pipeline(text, {"driver_id": "driver_1"}, repository.order_field,
+                                                   None, None, 100)
+                explains[collection] = await database.command(
+                    "explain", {"aggregate": collection, "pipeline": pipeline, "cursor": {}})
+            return explains
+        finally:
+            await client.drop_database(database.name)
+            client.close()
+
+    for collection, explain in asyncio.run(run()).items():
+        stages = plan_stages(explain)
+        assert "TEXT_MATCH" in stages, f"search {collection} does not use the text index: {stages}"
+        assert "driver_text_search" in str(explain), f"search {collection} does not use the driver prefix"
+        assert "COLLSCAN" not in stages, f"search {collection} falls back to a collection scan: {stages}"
+
+
+def test_ensure_indexes_is_idempotent(mongo_url):
+    async def run():
+        client = AsyncIOMotorClient(mongo_url)
+        database = client[f"test_indexes_{uuid.uuid4().hex}"]
+        try:
+            await storage.MongoStorage(database).ensure_indexes()
+            await storage.MongoStorage(database).ensure_indexes()
+            return (
+                await database.messages.index_information(),
+                await database.deliveries.index_information(),
+            )
+        finally:
+            await client.drop_database(database.name)
+            client.close()
+
+    message_indexes, delivery_indexes = asyncio.run(run())
+    assert {index.document["name"] for index in storage.MESSAGE_INDEXES} <= set(message_indexes)
+    assert {index.document["name"] for index in storage.DELIVERY_INDEXES} <= set(delivery_indexes)
+
+
+def test_ensure_indexes_replaces_the_old_text_index(mongo_url):
+    async def run():
+        client = AsyncIOMotorClient(mongo_url)
+        database = client[f"test_indexes_{uuid.uuid4().hex}"]
+        try:
+            await database.messages.create_index([("text", "text")], name="text_search")
+            await storage.MongoStorage(database).ensure_indexes()
+            return await database.messages.index_information()
+        finally:
+            await client.drop_database(database.name)
+            client.close()
+
+    indexes = asyncio.run(run())
+    assert "text_search" not in indexes and "driver_text_search" in indexes
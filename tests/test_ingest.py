@@ -0,0 +1,64 @@
+import asyncio
+import json
+
+import pytest
+
+import server
+from ingest import MalformedBody, iter_records
+
+
+def collect(body: bytes, content_type: str, chunk_size: int = 7):
+    async def chunks():
+        for start in range(0, len(body), chunk_size):
+            yield body[start:start + chunk_size]
+
+    async def run():
+        return [item async for item in iter_records(chunks(), content_type)]
+
+    return asyncio.run(run())
+
+
+RECORDS = [{"customer_name": "Sarah Johnson", "order": "2x Margherita Pizza, [extra] {cheese}"},
+           {"customer_name": "Mike Chen", "order": "Teriyaki Bowl é"}]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 64, 10_000])
+def test_json_array_records_split_across_chunks(chunk_size):
+    body = json.dumps(RECORDS, indent=2, ensure_ascii=False).encode()
+    assert collect(body, "application/json", chunk_size) == [(r, None) for r in RECORDS]
+
+
+def test_empty_json_array():
+    assert collect(b" [ ] ", "application/json") == []
+
+
+@pytest.mark.parametrize("body", [b"{}", b"[{}, {}", b"[{} {}]", b"[{}] []", b"[{\"a\": }]"])
+def test_malformed_json_array(body):
+    with pytest.raises(MalformedBody):
+        collect(body, "application/json")
+
+
+def test_ndjson_bad_line_only_affects_itself():
+    body = b"\n".join(json.dumps(r).encode() for r in RECORDS[:1]) + b"\n{oops\n\n" + json.dumps(RECORDS[1]).encode()
+    items = collect(body, "application/x-ndjson; charset=utf-8", chunk_size=5)
+    assert items[0] == (RECORDS[0], None)
+    assert items[1][0] is None and items[1][1].startswith("Malformed JSON")
+    assert items[2] == (RECORDS[1], None)
+
+
+def test_bulk_endpoint_reports_each_record(api, monkeypatch):
+    monkeypatch.setattr(server, "BULK_CHUNK_SIZE", 2)
+    valid = {"driver_id": "driver_001", "customer_name": "Sarah Johnson", "customer_phone": "+1-555-0123",
+             "address": "123 Oak Street", "latitude": 40.7128, "longitude": -74.0060, "order_details": "Pizza"}
+    body = "\n".join([json.dumps(valid), json.dumps({**valid, "latitude": "north"}), "[]",
+                      json.dumps(valid), json.dumps(valid)])
+    response = api.post("/api/deliveries/bulk", content=body, headers={"Content-Type": "application/x-ndjson"})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert (data["created"], data["invalid"], data["failed"]) == (3, 2, 0)
+    assert [r["status"] for r in data["results"]] == ["created", "invalid", "invalid", "created", "created"]
+    assert data["results"][1]["errors"][0].startswith("latitude")
+    stored = api.get("/api/deliveries/driver_001").json()["items"]
+    assert sorted(d["id"] for d in stored) == sorted(r["id"] for r in data["results"] if r["id"])
+    assert len(api.get("/api/driver/driver_001/active-customers").json()) == 1
@@ -0,0 +1,69 @@
+import logging
+from types import SimpleNamespace
+
+from prometheus_client import REGISTRY
+
+import metrics
+from metrics import CommandTimer, PoolMonitor
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_requests_are_recorded_by_route_template(api):
+    labels = {"method": "GET", "route": "/api/messages/{driver_id}/{customer_name}", "status": "200"}
+    before = sample("http_request_duration_seconds_count", **labels)
+    api.get("/api/messages/driver_001/Sarah Johnson")
+    api.get("/api/messages/driver_002/Mike Chen")
+
+    assert sample("http_request_duration_seconds_count", **labels) == before + 2
+    assert sample("http_requests_in_progress", method="GET", route=labels["route"]) == 0
+    body = api.get("/metrics").text
+    assert 'route="/api/messages/{driver_id}/{customer_name}"' in body
+    assert "driver_001" not in body
+
+
+def test_the_route_template_is_resolved_once_per_request(api, monkeypatch):
+    resolved = []
+    resolve = metrics._resolve_route_template
+    monkeypatch.setattr(metrics, "_resolve_route_template", lambda scope: resolved.append(1) or resolve(scope))
+    api.put("/api/deliveries/missing/status", params={"status": "delivered"})
+    assert len(resolved) == 1
+
+
+def test_command_timer_records_collection_and_logs_slow_commands(caplog):
+    timer = CommandTimer(slow_threshold_ms=50)
+
+    def run(command_name, command, duration_ms, request_id):
+        timer.started(SimpleNamespace(command_name=command_name, command=command, database_name="app",
+                                      connection_id=("localhost", 27017), request_id=request_id))
+        timer.succeeded(SimpleNamespace(command_name=command_name, duration_micros=duration_ms * 1000,
+                                        connection_id=("localhost", 27017), request_id=request_id))
+
+    labels = {"collection": "messages", "command": "find", "outcome": "success"}
+    before = sample("mongodb_command_duration_seconds_count", **labels)
+    slow_before = sample("mongodb_slow_commands_total", collection="messages", command="getMore")
+    with caplog.at_level(logging.WARNING, logger="metrics"):
+        run("find", {"find": "messages", "filter": {}}, 2, 1)
+        run("getMore", {"getMore": 12345, "collection": "messages"}, 80, 2)
+
+    assert sample("mongodb_command_duration_seconds_count", **labels) == before + 1
+    assert sample("mongodb_slow_commands_total", collection="messages", command="getMore") == slow_before + 1
+    assert [record.getMessage() for record in caplog.records] == [
+        "Slow MongoDB command: getMore on app.messages took 80.0 ms (success)"]
+
+
+def test_pool_monitor_tracks_the_busiest_pool():
+    monitor = PoolMonitor()
+    first, second = SimpleNamespace(address=("db1", 27017)), SimpleNamespace(address=("db2", 27017))
+    for event in (first, first, second):
+        monitor.connection_created(event)
+        monitor.connection_check_out_started(event)
+        monitor.connection_checked_out(event)
+    monitor.connection_check_out_started(first)
+    monitor.connection_checked_in(second)
+
+    assert monitor.snapshot(max_pool_size=2) == {
+        "open": 2, "checked_out": 2, "waiting": 1, "max_size": 2, "saturation": 1.5}
+    assert sample("mongodb_pool_connections", address="db2:27017", state="checked_out") == 0
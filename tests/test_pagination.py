@@ -0,0 +1,50 @@
+import time
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+def test_cursor_round_trip():
+    doc = {"timestamp": datetime(2025, 7, 1, 12, 30, 15, 123000), "id": "abc"}
+    assert server.decode_cursor(server.encode_cursor(doc, "timestamp")) == (doc["timestamp"], "abc")
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "", "W10", "WyJ4IiwgInkiXQ"])
+def test_invalid_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as exc_info:
+        server.decode_cursor(cursor)
+    assert exc_info.value.status_code == 400
+
+
+def test_after_and_before_are_exclusive(api):
+    response = api.get("/api/messages/driver_001", params={"after": "x", "before": "y"})
+    assert response.status_code == 400
+
+
+def test_pages_walk_forward_and_back(api):
+    for i in range(7):
+        # Stored timestamps have millisecond resolution; keep the messages in order
+        time.sleep(0.002)
+        api.post("/api/messages", json={"driver_id": "driver_001", "customer_name": "Sarah Johnson",
+                                        "text": str(i), "sender": "driver"})
+    forward, after = [], None
+    while True:
+        page = api.get("/api/messages/driver_001", params={"limit": 3, **({"after": after} if after else {})}).json()
+        forward += [m["text"] for m in page["items"]]
+        after = page["next_cursor"]
+        if not page["has_more"]:
+            break
+    backward, before = [m["text"] for m in page["items"]], page["prev_cursor"]
+    while True:
+        page = api.get("/api/messages/driver_001", params={"limit": 3, "before": before}).json()
+        backward = [m["text"] for m in page["items"]] + backward
+        before = page["prev_cursor"]
+        if not page["has_more"]:
+            break
+
+    assert forward == backward == [str(i) for i in range(7)]
+    # Polling past the end keeps a stable cursor
+    assert api.get("/api/messages/driver_001", params={"after": after}).json()["next_cursor"] == after
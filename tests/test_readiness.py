@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+from pymongo.errors import ServerSelectionTimeoutError
+
+import server
+from metrics import PoolMonitor
+from storage import MemoryStorage
+
+
+def checked_out(monitor, count, address=("db1", 27017)):
+    for _ in range(count):
+        event = SimpleNamespace(address=address)
+        monitor.connection_check_out_started(event)
+        monitor.connection_checked_out(event)
+
+
+def test_startup_warms_up_storage_before_serving(monkeypatch):
+    storage = MemoryStorage()
+    calls = []
+
+    async def warm_up(connections):
+        calls.append(("warm_up", connections))
+
+    async def ensure_indexes():
+        calls.append(("ensure_indexes",))
+
+    monkeypatch.setattr(storage, "warm_up", warm_up)
+    monkeypatch.setattr(storage, "ensure_indexes", ensure_indexes)
+    monkeypatch.setattr(server, "storage", storage)
+    monkeypatch.setattr(server, "MONGO_WARM_CONNECTIONS", 4)
+    with TestClient(server.app):
+        assert calls == [("warm_up", 4), ("ensure_indexes",)]
+
+
+def test_ready_reports_round_trip_and_pool(api, monkeypatch):
+    monitor = PoolMonitor()
+    monkeypatch.setattr(server, "pool_monitor", monitor)
+    checked_out(monitor, 3)
+
+    response = api.get("/ready")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["ready"] and body["database_rtt_ms"] >= 0
+    assert body["pool"]["checked_out"] == 3
+    assert body["pool"]["saturation"] == 3 / body["pool"]["max_size"]
+
+
+def test_not_ready_when_pool_is_saturated(api, monkeypatch):
+    monitor = PoolMonitor()
+    monkeypatch.setattr(server, "pool_monitor", monitor)
+    monkeypatch.setattr(server, "READY_MAX_POOL_SATURATION", 0.5)
+    checked_out(monitor, server.max_pool_size() // 2 + 1)
+
+    assert api.get("/ready").status_code == 503
+
+
+def test_not_ready_when_database_is_unreachable(api, storage, monkeypatch):
+    async def ping():
+        raise ServerSelectionTimeoutError("no servers")
+
+    monkeypatch.setattr(storage, "ping", ping)
+    response = api.get("/ready")
+    assert response.status_code == 503
+    assert response.json()["database_rtt_ms"] is None
+
+
+def test_client_options_come_from_the_environment(monkeypatch):
+    monkeypatch.setenv("MONGO_MAX_POOL_SIZE", "50")
+    monkeypatch.setenv("MONGO_COMPRESSORS", "zlib")
+    monkeypatch.delenv("MONGO_SOCKET_TIMEOUT_MS", raising=False)
+    options = server.mongo_client_options()
+    assert options["maxPoolSize"] == "50" and options["compressors"] == "zlib"
+    assert "socketTimeoutMS" not in options
@@ -0,0 +1,71 @@
+import asyncio
+from datetime import datetime
+
+from fastapi.testclient import TestClient
+
+import server
+from realtime import SUBSCRIPTION_BUFFER, InProcessBroker
+
+
+def message(customer_name="Sarah Johnson", text="On my way", driver_id="driver_001"):
+    return server.Message(driver_id=driver_id, customer_name=customer_name,
+                          text=text, sender="driver").dict()
+
+
+def test_messages_reach_driver_and_conversation_subscribers():
+    async def run():
+        broker = InProcessBroker()
+        driver = broker.subscribe("driver_001")
+        sarah = broker.subscribe("driver_001", "Sarah Johnson")
+        mike = broker.subscribe("driver_001", "Mike Chen")
+        other_driver = broker.subscribe("driver_002")
+        await broker.publish(message(text="first"))
+        await broker.publish(message(text="second", customer_name="Mike Chen"))
+        received = [await asyncio.wait_for(driver.__anext__(), 1) for _ in range(2)]
+        return received, await sarah.__anext__(), await mike.__anext__(), other_driver
+
+    received, sarah, mike, other_driver = asyncio.run(run())
+    assert [m["text"] for m in received] == ["first", "second"]
+    assert sarah["text"] == "first"
+    assert mike["text"] == "second"
+    assert other_driver._queue.empty()
+
+
+def test_conversations_sharing_a_joined_name_stay_apart():
+    async def run():
+        broker = InProcessBroker()
+        first = broker.subscribe("a:b", "c")
+        second = broker.subscribe("a", "b:c")
+        await broker.publish(message(driver_id="a:b", customer_name="c"))
+        return await asyncio.wait_for(first.__anext__(), 1), second
+
+    received, second = asyncio.run(run())
+    assert (received["driver_id"], received["customer_name"]) == ("a:b", "c")
+    assert second._queue.empty()
+
+
+def test_slow_subscriber_is_dropped_not_buffered_forever():
+    async def run():
+        broker = InProcessBroker()
+        subscription = broker.subscribe("driver_001")
+        for i in range(SUBSCRIPTION_BUFFER + 1):
+            await broker.publish(message(text=str(i)))
+        drained = [m async for m in subscription]
+        return subscription, drained, broker.hub.subscriber_count
+
+    subscription, drained, remaining = asyncio.run(run())
+    assert subscription.overflowed
+    assert drained
+    assert remaining == 0
+
+
+def test_websocket_pushes_published_messages():
+    client = TestClient(server.app)
+    with client.websocket_connect("/api/ws/messages/driver_001/Sarah%20Johnson") as websocket:
+        websocket.portal.call(server.broker.publish, message(customer_name="Mike Chen"))
+        websocket.portal.call(server.broker.publish, message(text="Arriving in 5 minutes"))
+        pushed = websocket.receive_json()
+    assert pushed["text"] == "Arriving in 5 minutes"
+    assert pushed["customer_name"] == "Sarah Johnson"
+    assert datetime.fromisoformat(pushed["timestamp"])
+    assert server.broker.hub.subscriber_count == 0
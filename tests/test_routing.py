@@ -0,0 +1,59 @@
+import itertools
+import time
+
+import numpy as np
+import pytest
+
+from routing import haversine_km, haversine_matrix, nearest_neighbour_tour, path_length, plan_route
+
+
+def random_stops(count, seed=7):
+    rng = np.random.default_rng(seed)
+    return [(40.70 + lat, -74.02 + lon) for lat, lon in rng.uniform(0, 0.12, size=(count, 2))]
+
+
+def test_haversine_matches_known_distance():
+    # New York to Los Angeles is about 3936 km along the great circle
+    assert haversine_km((40.7128, -74.0060), (34.0522, -118.2437)) == pytest.approx(3936, rel=0.005)
+
+
+def test_haversine_matrix_is_symmetric_with_zero_diagonal():
+    stops = np.array(random_stops(12))
+    distances = haversine_matrix(stops[:, 0], stops[:, 1])
+    assert np.allclose(distances, distances.T)
+    assert np.allclose(np.diag(distances), 0)
+
+
+def test_empty_route():
+    assert plan_route((40.7, -74.0), [], 0.02) == {"order": [], "total_distance_km": 0.0, "baseline_distance_km": 0.0}
+
+
+def test_small_routes_are_optimal():
+    start, stops = (40.7128, -74.0060), random_stops(7)
+    plan = plan_route(start, stops, 1.0)
+    points = np.array([start, *stops])
+    distances = haversine_matrix(points[:, 0], points[:, 1])
+    best = min(path_length(distances, [0, *perm]) for perm in itertools.permutations(range(1, 8)))
+    assert sorted(plan["order"]) == list(range(7))
+    assert plan["total_distance_km"] == pytest.approx(best, rel=0.05)
+
+
+@pytest.mark.parametrize("count", [2, 20, 50])
+def test_local_search_never_worse_than_nearest_neighbour(count):
+    start, stops = (40.7128, -74.0060), random_stops(count, seed=count)
+    plan = plan_route(start, stops, 1.0)
+    points = np.array([start, *stops])
+    distances = haversine_matrix(points[:, 0], points[:, 1])
+    assert plan["baseline_distance_km"] == pytest.approx(path_length(distances, nearest_neighbour_tour(distances)))
+    assert plan["total_distance_km"] <= plan["baseline_distance_km"] + 1e-9
+    assert plan["total_distance_km"] == pytest.approx(path_length(distances, [0, *(i + 1 for i in plan["order"])]))
+
+
+def test_time_budget_bounds_large_inputs():
+    stops = random_stops(800)
+    started = time.perf_counter()
+    plan = plan_route((40.7128, -74.0060), stops, 0.05)
+    elapsed = time.perf_counter() - started
+    assert sorted(plan["order"]) == list(range(800))
+    # Distance matrix and nearest-neighbour run outside the 2-opt budget
+    assert elapsed < 1.0
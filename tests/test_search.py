@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+from pymongo.errors import ExecutionTimeout
+
+import server
+from tiering import TieringPolicy, archive_cold
+
+NOW = datetime(2024, 6, 1, 12, 0, 0)
+
+
+def delivery(i, order_details, address="12 Elm Street", driver_id="driver_001", age=timedelta(hours=1),
+             status="pending"):
+    return server.delivery_document(server.DeliveryLocation(
+        id=f"d{i}", driver_id=driver_id, customer_name="Sarah Johnson", customer_phone="+1-555-0123",
+        address=address, latitude=40.7128, longitude=-74.0060, order_details=order_details, status=status,
+        created_at=NOW - age,
+    ))
+
+
+def test_search_covers_hot_and_archived_deliveries(api, storage):
+    for doc in [
+        delivery(0, "Chicken Teriyaki", age=timedelta(days=3), status="delivered"),
+        delivery(1, "Teriyaki salmon, extra teriyaki sauce"),
+        delivery(2, "Margherita pizza", address="4B Teriyaki Lane"),
+        delivery(3, "Teriyaki bowl", driver_id="driver_002"),
+        delivery(4, "Caesar salad"),
+    ]:
+        api.portal.call(storage.deliveries.insert, doc)
+    policy = TieringPolicy(message_max_age=timedelta(days=30), delivered_max_age=timedelta(days=1))
+    assert api.portal.call(archive_cold, storage, policy, NOW)["deliveries"] == 1
+
+    first = api.get("/api/search/deliveries", params={"q": "teriyaki", "driver_id": "driver_001", "limit": 2}).json()
+    second = api.get("/api/search/deliveries", params={"q": "teriyaki", "driver_id": "driver_001", "limit": 2,
+                                                       "after": first["next_cursor"]}).json()
+    hits = first["items"] + second["items"]
+    assert first["has_more"] and not second["has_more"]
+    assert sorted(hit["id"] for hit in hits) == ["d0", "d1", "d2"]
+    assert [hit["score"] for hit in hits] == sorted((hit["score"] for hit in hits), reverse=True)
+    assert set(hits[0]) == set(server.DeliverySearchHit.model_fields)
+
+    recent = api.get("/api/search/deliveries", params={"q": "teriyaki", "driver_id": "driver_001",
+                                                       "start": (NOW - timedelta(days=1)).isoformat()}).json()
+    assert sorted(hit["id"] for hit in recent["items"]) == ["d1", "d2"]
+    other = api.get("/api/search/deliveries", params={"q": "teriyaki", "driver_id": "driver_002"}).json()
+    assert [hit["id"] for hit in other["items"]] == ["d3"]
+
+
+def test_message_search(api):
+    for text in ["Leave it at apartment 4B", "On my way", "Which apartment?"]:
+        api.post("/api/messages", json={"driver_id": "driver_001", "customer_name": "Sarah Johnson",
+                                        "text": text, "sender": "customer"})
+    phrase = api.get("/api/search/messages", params={"q": '"apartment 4B"', "driver_id": "driver_001"}).json()
+    assert [hit["text"] for hit in phrase["items"]] == ["Leave it at apartment 4B"]
+    assert api.get("/api/search/messages", params={"q": "apartment", "driver_id": "driver_001"}).json()["items"][0]["score"] > 0
+
+
+def test_search_rejects_bad_input(api, storage, monkeypatch):
+    assert api.get("/api/search/messages", params={"q": "", "driver_id": "driver_001"}).status_code == 422
+    assert api.get("/api/search/messages", params={"q": "x"}).status_code == 422
+    assert api.get("/api/search/messages", params={"q": "x", "driver_id": "driver_001",
+                                                   "after": "not-a-cursor"}).status_code == 400
+
+    async def too_slow(*args, **kwargs):
+        raise ExecutionTimeout("operation exceeded time limit")
+
+    monkeypatch.setattr(storage.messages, "search", too_slow)
+    response = api.get("/api/search/messages", params={"q": "the", "driver_id": "driver_001"})
+    assert response.status_code == 422
+    assert "too broad" in response.json()["detail"]
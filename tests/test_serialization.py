@@ -0,0 +1,65 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+import server
+
+
+def stored(doc: dict) -> dict:
+    """A document as Motor returns it: with _id and millisecond datetimes."""
+    doc = {"_id": ObjectId(), **doc}
+    for key, value in doc.items():
+        if isinstance(value, datetime):
+            doc[key] = value.replace(microsecond=value.microsecond // 1000 * 1000)
+    return doc
+
+
+def legacy_body(page: dict, model, page_model) -> bytes:
+    """Bytes the endpoints produced by building models and validating them against response_model."""
+    content = {**page, "items": [model(**doc) for doc in page["items"]]}
+    field = create_response_field(name="response", type_=page_model)
+    return JSONResponse(asyncio.run(serialize_response(field=field, response_content=content))).body
+
+
+def make_messages(count):
+    start = datetime(2025, 7, 1, 12, 0, 0)
+    return [stored(server.Message(
+        driver_id="driver_001", customer_name="Zoë O'Brien", text=f"Almost there 🚗 \"gate\" {i}",
+        sender="driver", timestamp=start + timedelta(milliseconds=1500 * i)).dict()) for i in range(count)]
+
+
+def make_deliveries(count, longitude=-73.9851):
+    start = datetime(2025, 7, 1, 12, 0, 0)
+    return [stored(server.delivery_document(server.DeliveryLocation(
+        driver_id="driver_001", customer_name="Mike Chen", customer_phone="+1-555-0456",
+        address="456 Pine Avenue, Midtown", latitude=40.7589 + i / 1e4, longitude=longitude,
+        order_details="1x Chicken Teriyaki Bowl", created_at=start + timedelta(seconds=i)))) for i in range(count)]
+
+
+@pytest.mark.parametrize("model, page_model, docs", [
+    (server.Message, server.MessagePage, make_messages(50)),
+    (server.DeliveryLocation, server.DeliveryPage, make_deliveries(50)),
+])
+def test_fast_path_is_byte_identical(model, page_model, docs):
+    page = {"items": docs, "next_cursor": "abc", "prev_cursor": None, "has_more": True}
+    assert server.encode_page(page, model) == legacy_body(page, model, page_model)
+
+
+@pytest.mark.parametrize("longitude", [0.0, -0.0, -0.00005, 1e-7, 0.0001, 1e16, 3.5e17, -179.99999])
+def test_floats_are_written_as_repr_writes_them(longitude):
+    page = {"items": make_deliveries(3, longitude), "next_cursor": None, "prev_cursor": None, "has_more": False}
+    assert server.encode_page(page, server.DeliveryLocation) == legacy_body(
+        page, server.DeliveryLocation, server.DeliveryPage)
+
+
+def test_documents_missing_fields_fall_back_to_the_model():
+    doc = make_deliveries(1)[0]
+    del doc["status"]
+    page = {"items": [doc], "next_cursor": None, "prev_cursor": None, "has_more": False}
+    assert server.encode_page(page, server.DeliveryLocation) == legacy_body(
+        page, server.DeliveryLocation, server.DeliveryPage)
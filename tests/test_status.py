@@ -0,0 +1,21 @@
+DELIVERY = {"driver_id": "driver_001", "customer_phone": "+1-555-0123", "address": "123 Oak Street",
+            "latitude": 40.7128, "longitude": -74.0060}
+
+
+def test_batch_status_changes(api):
+    ids = [api.post("/api/deliveries", json={**DELIVERY, "customer_name": name, "order_details": "Pizza"}).json()["id"]
+           for name in ("Sarah Johnson", "Mike Chen")]
+    response = api.post("/api/deliveries/status", json=[
+        {"delivery_id": ids[0], "status": "in_progress"},
+        {"delivery_id": ids[1], "status": "delivered"},
+        {"delivery_id": "missing", "status": "in_progress"},
+    ])
+
+    assert response.status_code == 200
+    assert [(r["matched"], r["applied"]) for r in response.json()] == [(True, True), (True, False), (False, False)]
+    assert response.json()[1]["detail"] == "Cannot move from pending to delivered"
+    assert api.put(f"/api/deliveries/{ids[1]}/status", params={"status": "delivered"}).status_code == 409
+    assert api.put("/api/deliveries/missing/status", params={"status": "in_progress"}).status_code == 404
+    assert api.put(f"/api/deliveries/{ids[1]}/status", params={"status": "lost"}).status_code == 422
+    statuses = {d["id"]: d["status"] for d in api.get("/api/deliveries/driver_001").json()["items"]}
+    assert statuses == {ids[0]: "in_progress", ids[1]: "pending"}
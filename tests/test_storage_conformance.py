@@ -0,0 +1,291 @@
+"""The same behaviour checks against every storage engine."""
+import asyncio
+from datetime import datetime, timedelta
+
+import server
+from storage import DUPLICATE_KEY
+
+NOW = datetime(2024, 1, 1, 12, 0, 0)
+
+
+def message(i, customer_name="Sarah Johnson", seconds=None):
+    return server.Message(
+        id=f"m{i:03d}", driver_id="driver_001", customer_name=customer_name, text=str(i), sender="driver",
+        timestamp=NOW + timedelta(seconds=i if seconds is None else seconds),
+    ).dict()
+
+
+def delivery(i, customer_name="Sarah Johnson", status="pending", latitude=40.7128, longitude=-74.0060):
+    return server.delivery_document(server.DeliveryLocation(
+        id=f"d{i:03d}", driver_id="driver_001", customer_name=customer_name, customer_phone="+1-555-0123",
+        address="123 Oak Street", latitude=latitude, longitude=longitude, status=status,
+        order_details=f"order {i}", created_at=NOW + timedelta(seconds=i),
+    ))
+
+
+async def walk(repository, filters, limit):
+    """Every page forward, then every page back from the end; returns both id lists."""
+    forward, after = [], None
+    while True:
+        docs, has_more = await repository.page(filters, limit, after=after)
+        forward += [doc["id"] for doc in docs]
+        if not has_more:
+            break
+        after = (docs[-1][repository.order_field], docs[-1]["id"])
+    backward, before = [], None
+    docs, _ = await repository.page(filters, limit, before=(NOW + timedelta(days=1), "~"))
+    while docs:
+        backward = [doc["id"] for doc in docs] + backward
+        before = (docs[0][repository.order_field], docs[0]["id"])
+        docs, _ = await repository.page(filters, limit, before=before)
+    return forward, backward
+
+
+def test_message_pages_with_timestamp_ties(storage):
+    async def run():
+        await storage.ensure_indexes()
+        # Three messages share each timestamp, so pages split inside a tie
+        for i in range(10):
+            await storage.messages.insert(message(i, seconds=i // 3))
+        await storage.messages.insert(message(99, customer_name="Mike Chen"))
+        return (
+            await walk(storage.messages, {"driver_id": "driver_001"}, 4),
+            await walk(storage.messages, {"driver_id": "driver_001", "customer_name": "Sarah Johnson"}, 4),
+        )
+
+    (driver_forward, driver_backward), (conversation_forward, conversation_backward) = asyncio.run(run())
+    expected = [f"m{i:03d}" for i in range(10)]
+    assert driver_forward == driver_backward == expected + ["m099"]
+    assert conversation_forward == conversation_backward == expected
+
+
+def test_delivery_pages_newest_first_with_projection(storage):
+    async def run():
+        await storage.ensure_indexes()
+        for i in range(7):
+            await storage.deliveries.insert(delivery(i))
+        docs, has_more = await storage.deliveries.page({"driver_id": "driver_001"}, 3, fields=["id", "created_at"])
+        return docs, has_more, (await walk(storage.deliveries, {"driver_id": "driver_001"}, 3))[0]
+
+    docs, has_more, ids = asyncio.run(run())
+    assert has_more
+    assert [set(doc) for doc in docs] == [{"id", "created_at"}] * 3
+    assert ids == [f"d{i:03d}" for i in reversed(range(7))]
+
+
+def test_insert_many_reports_duplicates(storage):
+    async def run():
+        await storage.ensure_indexes()
+        await storage.deliveries.insert(delivery(1))
+        failed = await storage.deliveries.insert_many([delivery(0), delivery(1), delivery(2)])
+        docs, _ = await storage.deliveries.page({"driver_id": "driver_001"}, 10)
+        return failed, [doc["id"] for doc in docs]
+
+    failed, ids = asyncio.run(run())
+    assert list(failed) == [1]
+    assert failed[1][0] == DUPLICATE_KEY
+    assert ids == ["d002", "d001", "d000"]
+
+
+def test_transitions_follow_the_state_machine(storage):
+    async def run():
+        await storage.ensure_indexes()
+        for i, status in enumerate(["pending", "in_progress", "delivered", "pending"]):
+            await storage.deliveries.insert(delivery(i, status=status))
+        results = await storage.deliveries.apply_transitions([
+            ("d000", "delivered"), ("d001", "delivered"), ("d002", "in_progress"),
+            ("nope", "in_progress"), ("d003", "in_progress"), ("d003", "delivered"),
+        ])
+        return results, await storage.deliveries.open_deliveries("driver_001", 10)
+
+    results, open_deliveries = asyncio.run(run())
+    assert [(r["matched"], r["applied"], r["previous_status"], r["detail"]) for r in results] == [
+        (True, False, "pending", "Cannot move from pending to delivered"),
+        (True, True, "in_progress", None),
+        (True, False, "delivered", "Cannot move from delivered to in_progress"),
+        (False, False, None, "Delivery not found"),
+        (True, True, "pending", None),
+        (True, False, "pending", "Duplicate delivery_id in batch"),
+    ]
+    assert (results[1]["driver_id"], results[1]["customer_name"]) == ("driver_001", "Sarah Johnson")
+    assert [doc["id"] for doc in open_deliveries] == ["d000", "d003"]
+    assert not {"_id", "location"} & set(open_deliveries[0])
+
+
+def test_writes_take_the_next_driver_version(storage):
+    async def run():
+        await storage.ensure_indexes()
+        await storage.messages.insert(message(0))
+        await storage.deliveries.insert_many([delivery(0), delivery(1)])
+        await storage.deliveries.apply_transitions([("d000", "in_progress")])
+        return (
+            await storage.versions.latest("driver_001"),
+            await storage.messages.changes("driver_001", 0, 10),
+            await storage.deliveries.changes("driver_001", 1, 10),
+        )
+
+    (latest, changed_at), messages, deliveries = asyncio.run(run())
+    assert latest == 4
+    assert changed_at is not None
+    assert [(doc["id"], doc["version"]) for doc in messages] == [("m000", 1)]
+    assert [(doc["id"], doc["version"], doc["status"]) for doc in deliveries] == [
+        ("d001", 3, "pending"), ("d000", 4, "in_progress")]
+    assert not {"_id", "location"} & set(deliveries[0])
+
+
+def test_active_customers_view(storage):
+    async def run():
+        deliveries = storage.deliveries
+        await storage.ensure_indexes()
+        docs = [delivery(i, customer_name=name, status=status) for i, name, status in [
+            (0, "Sarah Johnson", "in_progress"), (2, "Sarah Johnson", "in_progress"),
+            (1, "Mike Chen", "in_progress"), (3, "Sarah Johnson", "delivered")]]
+        for doc in docs:
+            await deliveries.insert(doc)
+        # Merged out of order: the older delivery must not win
+        await deliveries.merge_active_customers([docs[1], docs[0], docs[2]])
+        merged = {c["customer_name"]: c["delivery_id"] for c in await deliveries.active_customers("driver_001")}
+
+        await deliveries.apply_transitions([("d002", "delivered"), ("d001", "delivered")])
+        await deliveries.refresh_active_customer("driver_001", "Sarah Johnson")
+        await deliveries.refresh_active_customer("driver_001", "Mike Chen")
+        refreshed = {c["customer_name"]: c["delivery_id"] for c in await deliveries.active_customers("driver_001")}
+        consistent = await deliveries.check_active_customers()
+
+        await deliveries.apply_transitions([("d000", "delivered")])
+        drifted = await deliveries.check_active_customers()
+        rebuilt = await deliveries.rebuild_active_customers()
+        return merged, refreshed, consistent, drifted, rebuilt, await deliveries.active_customers("driver_001")
+
+    merged, refreshed, consistent, drifted, rebuilt, final = asyncio.run(run())
+    assert merged == {"Sarah Johnson": "d002", "Mike Chen": "d001"}
+    assert refreshed == {"Sarah Johnson": "d000"}
+    assert consistent == []
+    assert drifted == ["driver_001"]
+    assert final == []
+    assert rebuilt == 0
+
+
+def test_inbox_keeps_the_latest_message_per_conversation(storage):
+    async def run():
+        messages = storage.messages
+        await storage.ensure_indexes()
+        # Inserted out of order: the older message must not replace the newer one
+        for doc in [message(2), message(1), message(0, "Mike Chen", seconds=5), message(3, seconds=2)]:
+            await messages.insert(doc)
+        inserted = await messages.inbox("driver_001")
+        rebuilt = await messages.rebuild_conversations()
+        return inserted, rebuilt, await messages.inbox("driver_001")
+
+    inserted, rebuilt, final = asyncio.run(run())
+    expected = [("Mike Chen", "m000"), ("Sarah Johnson", "m003")]
+    assert [(c["customer_name"], c["last_message"]["id"]) for c in inserted] == expected
+    assert rebuilt == 2
+    assert final == inserted
+
+
+def test_unassigned_deliveries_wait_for_dispatch(storage):
+    async def run():
+        deliveries = storage.deliveries
+        await storage.ensure_indexes()
+        for i in (2, 0, 1):
+            await deliveries.insert({**delivery(i), "driver_id": None})
+        await deliveries.insert(delivery(3))
+        waiting = [doc["id"] for doc in await deliveries.unassigned(10)]
+        blocked = await deliveries.apply_transitions([("d000", "in_progress")])
+        assigned = await deliveries.assign_drivers([("d000", "driver_002"), ("d001", "driver_002")])
+        again = await deliveries.assign_drivers([("d000", "driver_003"), ("d003", "driver_003")])
+        return (waiting, blocked, assigned, again, [doc["id"] for doc in await deliveries.unassigned(10)],
+                await deliveries.changes("driver_002", 0, 10), await deliveries.open_deliveries("driver_002", 10),
+                await deliveries.check_active_customers())
+
+    waiting, blocked, assigned, again, remaining, changes, open_deliveries, drift = asyncio.run(run())
+    assert waiting == ["d000", "d001", "d002"]
+    assert (blocked[0]["matched"], blocked[0]["applied"], blocked[0]["detail"]) == (
+        True, False, "Delivery is not assigned to a driver")
+    assert assigned == ["d000", "d001"]
+    assert again == []
+    assert remaining == ["d002"]
+    assert [(doc["id"], doc["version"], doc["driver_id"]) for doc in changes] == [
+        ("d000", 1, "driver_002"), ("d001", 2, "driver_002")]
+    assert [doc["id"] for doc in open_deliveries] == ["d000", "d001"]
+    assert drift == ["driver_001", "driver_002"]
+
+
+def test_nearby_orders_by_distance(storage):
+    async def run():
+        await storage.ensure_indexes()
+        points = [(40.7831, -73.9712), (40.7130, -74.0050), (40.7306, -73.9866)]
+        for i, (latitude, longitude) in enumerate(points):
+            await storage.deliveries.insert(delivery(i, latitude=latitude, longitude=longitude))
+        await storage.deliveries.insert(delivery(3, status="delivered", latitude=40.7128, longitude=-74.0060))
+        return await storage.deliveries.nearby(40.7128, -74.0060, 5000, {"status": "pending"}, 10)
+
+    results = asyncio.run(run())
+    assert [doc["id"] for doc in results] == ["d001", "d002"]
+    assert results[0]["distance_m"] < results[1]["distance_m"] < 5000
+    assert abs(results[0]["distance_m"] - 86.6) < 5
+
+
+def test_text_search_ranks_and_pages(storage):
+    texts = ["Leave it at apartment 4B please", "apartment 4B", "Teriyaki bowl for apartment 12",
+             "Ring twice at 4B", "apartment 4B, not 4C, code 4B", "Call on arrival"]
+
+    async def run():
+        await storage.ensure_indexes()
+        for i, text in enumerate(texts):
+            await storage.messages.insert({**message(i), "text": text})
+        await storage.messages.insert({**message(9), "driver_id": "driver_002", "text": "apartment 4B"})
+        pages, after = [], None
+        while True:
+            docs, has_more = await storage.messages.search("apartment 4B", {"driver_id": "driver_001"}, None, None,
+                                                           2, after, ["id", "text"])
+            pages.append(docs)
+            if not has_more:
+                break
+            after = (docs[-1]["score"], docs[-1]["id"])
+        phrase, _ = await storage.messages.search('"apartment 4B" -code', {"driver_id": "driver_001"}, None, None, 10)
+        ranged, _ = await storage.messages.search("4B", {"driver_id": "driver_001"}, NOW + timedelta(seconds=1),
+                                                  NOW + timedelta(seconds=4), 10)
+        return pages, phrase, ranged
+
+    pages, phrase, ranged = asyncio.run(run())
+    ranked = [doc for page in pages for doc in page]
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert {doc["id"] for doc in ranked} == {"m000", "m001", "m002", "m003", "m004"}
+    assert [doc["score"] for doc in ranked] == sorted((doc["score"] for doc in ranked), reverse=True)
+    # Both words in a short text beat one word in a longer one
+    assert ranked[-1]["id"] in ("m002", "m003") and ranked[0]["id"] in ("m001", "m004")
+    assert sorted(doc["id"] for doc in phrase) == ["m000", "m001"]
+    assert sorted(doc["id"] for doc in ranged) == ["m001", "m003"]
+
+
+def test_status_events_roll_up_by_hour_and_day(storage):
+    def event(delivery, status, minutes, created_minutes=0, driver_id="driver_001"):
+        return {"id": f"{delivery}:{status}", "delivery_id": delivery, "driver_id": driver_id,
+                "previous_status": None, "status": status, "changed_at": NOW + timedelta(minutes=minutes),
+                "created_at": NOW + timedelta(minutes=created_minutes)}
+
+    events = [
+        event("d1", "in_progress", 5), event("d1", "delivered", 20),
+        event("d2", "in_progress", 30, created_minutes=10), event("d2", "delivered", 70, created_minutes=10),
+        event("d3", "delivered", 65, driver_id="driver_002"),
+    ]
+
+    async def run():
+        await storage.ensure_indexes()
+        recorded = [await storage.status_events.record(events[:3]), await storage.status_events.record(events)]
+        hourly = await storage.status_events.rollups("hour", {"driver_id": "driver_001"}, None, None, 10)
+        daily = await storage.status_events.rollups("day", {}, NOW - timedelta(days=1), None, 10)
+        rebuilt = await storage.status_events.rebuild_rollups()
+        return recorded, hourly, daily, rebuilt, await storage.status_events.rollups("day", {}, None, None, 10)
+
+    recorded, hourly, daily, rebuilt, daily_after_rebuild = asyncio.run(run())
+    assert recorded == [3, 2]
+    assert [(r["period"], r["started"], r["delivered"], r["delivery_seconds_total"], r["delivery_seconds_max"])
+            for r in hourly] == [(NOW, 2, 1, 1200.0, 1200.0), (NOW + timedelta(hours=1), 0, 1, 3600.0, 3600.0)]
+    day = NOW.replace(hour=0)
+    assert [(r["driver_id"], r["period"], r["started"], r["delivered"], r["delivery_seconds_total"])
+            for r in daily] == [("driver_001", day, 2, 2, 4800.0), ("driver_002", day, 0, 1, 3900.0)]
+    assert rebuilt == 5
+    assert [{k: v for k, v in r.items() if k != "_id"} for r in daily_after_rebuild] == daily
@@ -0,0 +1,74 @@
+import server
+
+DELIVERY = {"driver_id": "driver_001", "customer_name": "Sarah Johnson", "customer_phone": "+1-555-0123",
+            "address": "123 Oak Street", "latitude": 40.7128, "longitude": -74.0060, "order_details": "Pizza"}
+
+
+def send(api, text, driver_id="driver_001"):
+    api.post("/api/messages", json={"driver_id": driver_id, "customer_name": "Sarah Johnson",
+                                    "text": text, "sender": "customer"})
+
+
+def test_sync_returns_only_changes_after_the_token(api, monkeypatch):
+    monkeypatch.setattr(server, "SYNC_SETTLE_SECONDS", 0)
+    assert api.get("/api/sync/driver_001").status_code == 304
+
+    send(api, "hello")
+    delivery_id = api.post("/api/deliveries", json=DELIVERY).json()["id"]
+    send(api, "other driver", driver_id="driver_002")
+    first = api.get("/api/sync/driver_001").json()
+    assert [m["text"] for m in first["messages"]] == ["hello"]
+    assert [d["id"] for d in first["deliveries"]] == [delivery_id]
+    assert api.get("/api/sync/driver_001", params={"since": first["token"]}).status_code == 304
+
+    api.put(f"/api/deliveries/{delivery_id}/status", params={"status": "in_progress"})
+    second = api.get("/api/sync/driver_001", params={"since": first["token"]}).json()
+    assert second["messages"] == []
+    assert [(d["id"], d["status"]) for d in second["deliveries"]] == [(delivery_id, "in_progress")]
+    assert int(second["token"]) > int(first["token"])
+
+
+def test_sync_pages_through_many_changes(api, monkeypatch):
+    monkeypatch.setattr(server, "SYNC_SETTLE_SECONDS", 0)
+    for i in range(5):
+        send(api, str(i))
+    texts, token, has_more = [], "0", True
+    while has_more:
+        page = api.get("/api/sync/driver_001", params={"since": token, "limit": 2}).json()
+        texts += [m["text"] for m in page["messages"]]
+        token, has_more = page["token"], page["has_more"]
+    assert texts == ["0", "1", "2", "3", "4"]
+
+
+def test_recent_changes_are_repeated_until_settled(api, monkeypatch):
+    monkeypatch.setattr(server, "SYNC_SETTLE_SECONDS", 3600)
+    send(api, "hello")
+    send(api, "there")
+    response = api.get("/api/sync/driver_001", params={"limit": 1})
+    page = response.json()
+    assert [m["text"] for m in page["messages"]] == ["hello"]
+    # Nothing settled: more changes wait, but syncing again now would not reach them
+    assert (page["token"], page["has_more"]) == ("0", False)
+    assert 3500 < int(response.headers["Retry-After"]) <= 3600
+
+    monkeypatch.setattr(server, "SYNC_SETTLE_SECONDS", 0)
+    again = api.get("/api/sync/driver_001", params={"since": page["token"]}).json()
+    assert [m["text"] for m in again["messages"]] == ["hello", "there"]
+    assert "Retry-After" not in api.get("/api/sync/driver_001").headers
+    assert api.get("/api/sync/driver_001", params={"since": again["token"]}).status_code == 304
+
+
+def test_invalid_token_is_rejected(api):
+    assert api.get("/api/sync/driver_001", params={"since": "abc"}).status_code == 400
+
+
+def test_token_ahead_of_the_server_is_gone(api):
+    send(api, "hello")
+    assert api.get("/api/sync/driver_001", params={"since": "1"}).status_code == 304
+    assert api.get("/api/sync/driver_001", params={"since": "2"}).status_code == 410
+    assert api.get("/api/sync/driver_002", params={"since": "5"}).status_code == 410
+
+
+def test_unassigned_deliveries_take_no_version(api, storage):
+    api.post("/api/deliveries", json={**DELIVERY, "driver_id": None})
+    assert api.portal.call(storage.versions.latest, None) == (0, None)
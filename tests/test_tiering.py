@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta
+
+import bson
+from prometheus_client import REGISTRY
+
+import server
+from tiering import TieringPolicy, archive_cold
+
+NOW = datetime(2024, 6, 1, 12, 0, 0)
+DOCUMENT_TOO_LARGE = 10334
+POLICY = TieringPolicy(message_max_age=timedelta(days=30), delivered_max_age=timedelta(hours=24), batch_size=2)
+
+
+def message(i, age):
+    return server.Message(id=f"m{i}", driver_id="driver_001", customer_name="Sarah Johnson", text=str(i),
+                          sender="driver", timestamp=NOW - age).dict()
+
+
+def delivery(i, age, status):
+    return server.delivery_document(server.DeliveryLocation(
+        id=f"d{i}", driver_id="driver_001", customer_name="Sarah Johnson", customer_phone="+1-555-0123",
+        address="123 Oak Street", latitude=40.7128, longitude=-74.0060, order_details="Pizza", status=status,
+        created_at=NOW - age,
+    ))
+
+
+def test_cold_documents_move_to_the_history_routes(api, storage):
+    messages = [message(i, timedelta(days=age)) for i, age in enumerate([90, 60, 31, 29, 1])]
+    deliveries = [
+        delivery(0, timedelta(hours=48), "delivered"),
+        delivery(1, timedelta(hours=30), "delivered"),
+        delivery(2, timedelta(hours=48), "pending"),
+        delivery(3, timedelta(hours=2), "delivered"),
+    ]
+    for doc in messages:
+        api.portal.call(storage.messages.insert, doc)
+    for doc in deliveries:
+        api.portal.call(storage.deliveries.insert, doc)
+    # A copy left behind by an interrupted run
+    api.portal.call(storage.messages_archive.insert_many, [dict(messages[0])])
+
+    moved = api.portal.call(archive_cold, storage, POLICY, NOW)
+
+    assert moved == {"messages": 3, "deliveries": 2}
+    hot = api.get("/api/messages/driver_001/Sarah Johnson").json()["items"]
+    history = api.get("/api/history/messages/driver_001/Sarah Johnson").json()["items"]
+    assert [m["id"] for m in hot] == ["m3", "m4"]
+    assert [m["id"] for m in history] == ["m0", "m1", "m2"]
+    assert [d["id"] for d in api.get("/api/deliveries/driver_001").json()["items"]] == ["d3", "d2"]
+    assert [d["id"] for d in api.get("/api/history/deliveries/driver_001").json()["items"]] == ["d1", "d0"]
+
+    assert api.portal.call(archive_cold, storage, POLICY, NOW) == {"messages": 0, "deliveries": 0}
+    assert REGISTRY.get_sample_value("tier_documents", {"collection": "messages", "tier": "hot"}) == 2
+    assert REGISTRY.get_sample_value("tier_documents", {"collection": "deliveries", "tier": "archive"}) == 2
+
+
+def test_documents_the_archive_rejects_stay_hot(api, storage, monkeypatch):
+    for i in range(2):
+        api.portal.call(storage.messages.insert, message(i, timedelta(days=60)))
+    insert_many = storage.messages_archive.insert_many
+
+    async def reject_first(docs):
+        failed = await insert_many(docs[1:])
+        return {0: (DOCUMENT_TOO_LARGE, "object to insert too large"), **{i + 1: e for i, e in failed.items()}}
+
+    monkeypatch.setattr(storage.messages_archive, "insert_many", reject_first)
+    assert api.portal.call(archive_cold, storage, POLICY, NOW)["messages"] == 1
+    assert [m["id"] for m in api.get("/api/messages/driver_001/Sarah Johnson").json()["items"]] == ["m0"]
+
+
+def test_history_pages_use_cursors(api, storage):
+    for i in range(5):
+        api.portal.call(storage.messages.insert, message(i, timedelta(days=60 - i)))
+    api.portal.call(archive_cold, storage, POLICY, NOW)
+
+    first = api.get("/api/history/messages/driver_001/Sarah Johnson", params={"limit": 3}).json()
+    second = api.get("/api/history/messages/driver_001/Sarah Johnson",
+                     params={"limit": 3, "after": first["next_cursor"]}).json()
+    assert [m["text"] for m in first["items"] + second["items"]] == ["0", "1", "2", "3", "4"]
+    assert first["has_more"] and not second["has_more"]
+
+
+def test_archiving_invalidates_cached_pages_and_counts_only_what_moved(api, storage, monkeypatch):
+    deliveries = [delivery(i, timedelta(hours=48), "delivered") for i in range(3)]
+    for doc in deliveries:
+        api.portal.call(storage.deliveries.insert, doc)
+    assert len(api.get("/api/deliveries/driver_001").json()["items"]) == 3
+    delete_cold = storage.deliveries.delete_cold
+
+    async def keep_first(ids, cutoff):
+        # d0 left the cold set between the copy and the delete
+        return await delete_cold([doc_id for doc_id in ids if doc_id != "d0"], cutoff)
+
+    monkeypatch.setattr(storage.deliveries, "delete_cold", keep_first)
+    archived = []
+
+    async def on_archived(collection, docs):
+        archived.extend(docs)
+        await server.invalidate_archived(collection, docs)
+
+    sample = {"collection": "deliveries"}
+    bytes_before = REGISTRY.get_sample_value("tiering_bytes_moved_total", sample) or 0
+    moved = api.portal.call(archive_cold, storage, POLICY, NOW, on_archived)
+
+    assert moved["deliveries"] == 2
+    assert sorted(doc["id"] for doc in archived) == ["d1", "d2"]
+    assert REGISTRY.get_sample_value("tiering_bytes_moved_total", sample) - bytes_before == sum(
+        len(bson.encode(doc)) for doc in archived)
+    assert [d["id"] for d in api.get("/api/deliveries/driver_001").json()["items"]] == ["d0"]